@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for oauthist OAuth 2.0 flows
+
+Runs every flow against the local Redis server and reports throughput,
+latency percentiles and the number of Redis commands per operation.
+
+    $ python benchmarks/bench_flows.py -n 1000
+    $ python benchmarks/bench_flows.py -n 1000 --json > results.json
+
+Redis commands are counted with ``INFO commandstats``, so make sure nobody
+else uses the same Redis server while benchmarks are running. All oauthist
+objects are removed from the database after the run.
+"""
+import sys
+import json
+import timeit
+import argparse
+import ormist
+import oauthist
+
+SCOPES = ['user_ro', 'user_rw', 'projects_ro', 'projects_rw']
+CALLBACK = 'http://web.example.com/oauth2cb'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-H', '--host', '--hostname', default='127.0.0.1', help='Redis server hostname')
+    parser.add_argument('-p', '--port', default=6379, type=int, help='Redis server port')
+    parser.add_argument('-d', '--db', default=15, type=int, help='Redis database number')
+    parser.add_argument('-n', '--number', default=1000, type=int, help='number of operations per benchmark')
+    parser.add_argument('-b', '--batch-size', default=100, type=int, help='batch size for verify_many')
+    parser.add_argument('--cache-size', default=None, type=int, help='size of the access token cache')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--label', default=None, help='arbitrary label (e.g. release name) to store with JSON results')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (all by default)')
+    return parser
+
+
+#--- flows
+
+def verify_requisites(username, password):
+    return {'user_id': 1}
+
+
+def new_client():
+    client = oauthist.Client(client_type='web', redirect_urls=[CALLBACK])
+    client.save()
+    return client
+
+
+def new_token(client):
+    return oauthist.PasswordExchangeRequest(
+        username='user1', password='password', scope='user_ro user_rw',
+        client_id=client.id, client_secret=client.client_secret,
+        verify_requisites=verify_requisites).exchange_for_token()
+
+
+def bench_code_request(args):
+    client = new_client()
+
+    def op():
+        req = oauthist.CodeRequest(client_id=client.id, redirect_uri=CALLBACK,
+                                   scope='user_ro user_rw', state='1234')
+        assert not req.is_broken()
+        assert not req.is_invalid()
+        req.save_code(user_id=1).accept()
+    return op
+
+
+def bench_code_exchange(args):
+    client = new_client()
+    codes = []
+    for _ in range(args.number):
+        req = oauthist.CodeRequest(client_id=client.id, redirect_uri=CALLBACK,
+                                   scope='user_ro user_rw', state='1234')
+        code = req.save_code(user_id=1)
+        code.accept()
+        codes.append(code.id)
+    codes.reverse()
+
+    def op():
+        req = oauthist.CodeExchangeRequest(code=codes.pop(),
+                                           client_id=client.id,
+                                           client_secret=client.client_secret,
+                                           redirect_uri=CALLBACK,
+                                           state='1234')
+        req.exchange_for_token()
+    return op
+
+
+def bench_password_exchange(args):
+    client = new_client()
+
+    def op():
+        new_token(client)
+    return op
+
+
+def bench_verify(args):
+    token = new_token(new_client())
+    scopes = oauthist.compile_scopes('user_ro')
+
+    def op():
+        oauthist.ProtectedResourceRequest(token.id).verify_access_token(scopes)
+    return op
+
+
+def bench_verify_many(args):
+    client = new_client()
+    tokens = [new_token(client).id for _ in range(args.batch_size)]
+    scopes = oauthist.compile_scopes('user_ro')
+
+    def op():
+        oauthist.ProtectedResourceRequest.verify_many(tokens, scopes)
+    return op
+
+
+BENCHMARKS = [
+    ('code_request', bench_code_request),
+    ('code_exchange', bench_code_exchange),
+    ('password_exchange', bench_password_exchange),
+    ('verify', bench_verify),
+    ('verify_many', bench_verify_many),
+]
+
+
+#--- measurements
+
+def commands_processed(redis_client):
+    """
+    Return the number of commands, processed by Redis server so far
+    (excluding the INFO command, issued by this function)
+    """
+    stats = redis_client.info('commandstats')
+    return sum(value['calls'] for value in stats.values()) + 1
+
+
+def percentile(sorted_values, pct):
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run(name, setup, args, redis_client):
+    op = setup(args)
+    latencies = []
+    timer = timeit.default_timer
+    commands_before = commands_processed(redis_client)
+    started = timer()
+    for _ in range(args.number):
+        op_started = timer()
+        op()
+        latencies.append(timer() - op_started)
+    elapsed = timer() - started
+    commands = commands_processed(redis_client) - commands_before - 1
+    latencies.sort()
+    return {
+        'name': name,
+        'number': args.number,
+        'ops_per_sec': args.number / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'commands_per_op': float(commands) / args.number,
+    }
+
+
+def print_results(results):
+    print('{0:<20} {1:>12} {2:>10} {3:>10} {4:>12}'.format(
+        'benchmark', 'ops/sec', 'p50, ms', 'p99, ms', 'commands/op'))
+    print('-' * 68)
+    for result in results:
+        print('{name:<20} {ops_per_sec:>12.1f} {p50_ms:>10.3f} {p99_ms:>10.3f} '
+              '{commands_per_op:>12.2f}'.format(**result))
+
+
+def main():
+    args = get_parser().parse_args()
+    ormist.setup_redis('oauthist_bench', args.host, args.port, db=args.db)
+    oauthist.configure(ormist_system='oauthist_bench', scopes=SCOPES,
+                       access_token_cache_size=args.cache_size)
+    redis_client = oauthist.get_redis()
+    results = []
+    try:
+        for name, setup in BENCHMARKS:
+            if args.benchmarks and name not in args.benchmarks:
+                continue
+            results.append(run(name, setup, args, redis_client))
+            oauthist.full_cleanup()
+    finally:
+        oauthist.full_cleanup()
+    if args.json:
+        json.dump({'label': args.label,
+                   'python': sys.version.split()[0],
+                   'cache_size': args.cache_size,
+                   'results': results}, sys.stdout, indent=2)
+        print('')
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,9 @@ from oauthist.core import *
 from oauthist.client import *
 from oauthist.authorization_code import *
 from oauthist.access_token import *
+from oauthist.introspection import *
 from oauthist.errors import *
+from oauthist.revocation import RevocationListener
+from oauthist.storage import CompactSerializer
+from oauthist.instrumentation import add_listener, remove_listener
+from oauthist.middleware import BearerMiddleware
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
-import json
+import time
 from oauthist import CONFIDENTIAL_CLIENTS
 import ormist
-from oauthist.core import framework
-from oauthist.client import Client
+from oauthist.core import (framework, get_redis, redis_key, scope_mask,
+                           CompiledScopes, encode_json, LuaScript)
+from oauthist.utils import sign, unsign, expire_timestamp, chunks
+from oauthist.compat import text, u
+from oauthist.storage import (get_object, get_objects, read_objects_with_ttl,
+                              queue_objects_with_ttl, parse_objects_with_ttl,
+                              claim_object, object_key, dump_object)
+from oauthist.instrumentation import instrumented, timed, incr
+from oauthist.client import Client, get_client
 from oauthist.authorization_code import Code
+from oauthist.revocation import revoke
+from oauthist.ratelimit import check_rate_limit
 from oauthist.errors import OauthistValidationError, OauthistRuntimeError, InvalidAccessToken
 
 JSON_HEADERS =  {
@@ -13,6 +22,24 @@ JSON_HEADERS =  {
     'Pragma': 'no-cache',
 }
 
+# standard errors of token endpoint (see RFC 6749, section 5.2), response
+# bodies of which are serialized only once
+ERROR_CODES = frozenset(['invalid_request', 'invalid_client', 'invalid_grant',
+                         'unauthorized_client', 'unsupported_grant_type',
+                         'invalid_scope', 'slow_down'])
+
+# HTTP statuses of errors, other than "400 Bad Request"
+ERROR_STATUSES = {
+    'slow_down': 429,
+}
+
+# attributes, which are always copied to access tokens
+ESSENTIAL_TOKEN_ATTRS = frozenset(['client_id', 'scope', 'user_id', 'username'])
+
+# sorted set of ids of access tokens, scored by the time of their last use
+# (see ``track_token_usage`` option of configure)
+LAST_USED_KEY = redis_key('tokens_last_used')
+
 
 class GenericAccessTokenRequest(object):
     """
@@ -27,13 +54,14 @@ class GenericAccessTokenRequest(object):
         """
         Return True if request is invalid. Leverages :meth:`check_invalid`
         """
-        try:
-            self.check_invalid()
-        except OauthistValidationError as e:
-            self.error = str(e)
-            return True
-        else:
-            return False
+        with timed('%s.is_invalid' % self.__class__.__name__):
+            try:
+                self.check_invalid()
+            except OauthistValidationError as e:
+                self.error = str(e)
+                return True
+            else:
+                return False
 
     def get_error(self):
         """
@@ -44,7 +72,8 @@ class GenericAccessTokenRequest(object):
         if not self.error:
             raise OauthistRuntimeError('Error attribute is not defined, maybe '
                                        'you forgot to call '
-                                       'CodeExchangeRequest.is_invalid()')
+                                       '%s.is_invalid()' %
+                                       self.__class__.__name__)
         return AccessTokenError(self.error)
 
 
@@ -112,13 +141,43 @@ class CodeExchangeRequest(GenericAccessTokenRequest):
         self.grant_type = grant_type
         self.expire = expire or framework.access_token_timeout
 
-        self.client_obj = Client.objects.get(self.client_id)
-        self.code_obj = Code.objects.get(self.code)
         self.error = None
         self.error_description = None
         self.access_token = None
+        # objects are fetched lazily, once request parameters are validated
+        self.client_obj = None
+        self.code_obj = None
+        self._fetched = False
+
+    def fetch_objects(self):
+        """
+        Fetch the client and the code from the database with one round trip,
+        unless they have already been fetched
+        """
+        if self._fetched:
+            return
+        self._fetched = True
+        cache = framework.client_cache
+        if cache is not None and self.client_id:
+            found, self.client_obj = cache.lookup(self.client_id)
+            if found:
+                self.code_obj = get_object(Code, self.code)
+                return
+        self.client_obj, self.code_obj = get_objects((Client, self.client_id),
+                                                     (Code, self.code))
+        if cache is not None and self.client_id:
+            cache.store(self.client_id, self.client_obj)
 
     def check_invalid(self):
+        self.check_params()
+        self.fetch_objects()
+        self.check_objects()
+
+    def check_params(self):
+        """
+        Validate request parameters, before anything is fetched from the
+        database
+        """
         if self.grant_type != 'authorization_code':
             raise OauthistValidationError('invalid_request')
         # check for missing values
@@ -128,6 +187,11 @@ class CodeExchangeRequest(GenericAccessTokenRequest):
             raise OauthistValidationError('invalid_request')
         if not self.client_secret:
             raise OauthistValidationError('invalid_request')
+
+    def check_objects(self):
+        """
+        Validate the client and the code, fetched from the database
+        """
         # check for missing objects
         if not self.client_obj:
             raise OauthistValidationError('invalid_client')
@@ -137,6 +201,9 @@ class CodeExchangeRequest(GenericAccessTokenRequest):
         self.redirect_uri = self.client_obj.check_redirect_uri(self.redirect_uri)
         if self.client_secret != self.client_obj.client_secret:
             raise OauthistValidationError('invalid_client')
+        # the code must have been issued to the same client
+        if text(self.code_obj.attrs.get('client_id')) != text(self.client_id):
+            raise OauthistValidationError('invalid_grant')
         if self.state != self.code_obj.state:
             raise OauthistValidationError('invalid_grant')
         if self.redirect_uri != self.code_obj.redirect_uri:
@@ -144,6 +211,7 @@ class CodeExchangeRequest(GenericAccessTokenRequest):
         if not self.code_obj.attrs.get('accepted'):
             raise OauthistValidationError('invalid_grant')
 
+    @instrumented('CodeExchangeRequest.exchange_for_token')
     def exchange_for_token(self, **attrs):
         """
         Perform action "exchange code request for access token".
@@ -155,19 +223,36 @@ class CodeExchangeRequest(GenericAccessTokenRequest):
         :rtype: AccessToken
         """
         self.check_invalid()
+        self.build_access_token(**attrs)
+        refresh_token = None
+        if framework.refresh_tokens:
+            refresh_token = build_refresh_token(self.access_token)
+        # the code is deleted and tokens are saved atomically. Only one of
+        # concurrent requests, trying to exchange the same code, succeeds
+        if not issue_tokens(self.access_token, refresh_token, self.code_obj):
+            self.code_obj = self.access_token = None
+            raise OauthistValidationError('invalid_grant')
+        return self.access_token
+
+    def build_access_token(self, **attrs):
+        """
+        Create (but don't save) access token with attributes, copied from the
+        code object
+
+        :rtype: AccessToken
+        """
         if not self.access_token:
-            self.access_token = AccessToken()
+            self.access_token = new_access_token()
         # we have to copy all attributes from the code obj, except
         # those which we don't need anymore
         code_attrs = self.code_obj.attrs.copy()
         for key in ('state', 'accepted', 'redirect_uri', 'expire'):
             code_attrs.pop(key, None)
+        code_attrs = filter_token_attrs(code_attrs)
         code_attrs.update(attrs)
         self.access_token.set(**code_attrs)
         self.access_token.set_expire(self.expire)
-        self.code_obj.delete()  # delete authorization code
         self.code_obj = None
-        self.access_token.save()
         return self.access_token
 
 
@@ -210,7 +295,8 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
                      'client_secret', 'grant_type')
         kwargs = {'verify_requisites': verify_requisites,
                   'client_required': client_required,
-                  'client_secret_required': client_secret_required}
+                  'client_secret_required': client_secret_required,
+                  'remote_addr': getattr(request, 'remote_addr', None)}
         for arg_name in arg_names:
             kwargs[arg_name] = request.form.get(arg_name)
 
@@ -220,7 +306,7 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
     def __init__(self, username=None, password=None, scope=None, client_id=None,
                  client_secret=None, grant_type='password',
                  expire=None, verify_requisites=None, client_required=True,
-                 client_secret_required=True):
+                 client_secret_required=True, remote_addr=None):
         """
         Constructor for password exchange request.
 
@@ -258,6 +344,10 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
         and native) don't have client secret. Nonetheless, according to
         :rfc:`6749`, there is no explicit limitation to these types of clients.
         With his option you may make all clients use their client secrets
+
+        :param remote_addr: IP address of the client, used for rate limiting
+        (see ``rate_limits`` in :func:`oauthist.configure`)
+        :type remote_addr: str
         """
         self.username = username
         self.password = password
@@ -269,15 +359,34 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
         self.verify_requisites = verify_requisites
         self.client_required = client_required
         self.client_secret_required = client_secret_required
+        self.remote_addr = remote_addr
 
-        self.client_obj = Client.objects.get(self.client_id)
         self.error = None
         self.error_description = None
         self.access_token = None
         self.user_attrs = None
+        self.rate_limit_passed = None
+        self.fetch_objects()
 
+    def fetch_objects(self):
+        """
+        Fetch the client from the database
+        """
+        self.client_obj = get_client(self.client_id)
 
     def check_invalid(self):
+        self.check_request()
+        self.check_rate_limit()
+        # check for user requisites
+        self.user_attrs = self.verify_requisites(self.username, self.password)
+        if self.user_attrs is None:  # invalid requisites
+            raise OauthistValidationError('invalid_grant')
+
+    def check_request(self):
+        """
+        Validate request parameters and client authentication, but not the
+        user requisites
+        """
         if self.grant_type != 'password':
             raise OauthistValidationError('invalid_request')
         # check for missing values
@@ -299,12 +408,23 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
                 if self.client_obj.client_type in CONFIDENTIAL_CLIENTS:
                     raise OauthistValidationError('invalid_client')
 
-        # check for user requisites
-        self.user_attrs = self.verify_requisites(self.username, self.password)
-        if self.user_attrs is None:  # invalid requisites
-            raise OauthistValidationError('invalid_grant')
-
+    def check_rate_limit(self):
+        """
+        Count the request and reject it with "slow_down" error, if it
+        exceeds rate limits. Must be called before user requisites are
+        verified.
 
+        The request is counted only once, even though it's validated twice
+        (by :meth:`is_invalid` and :meth:`exchange_for_token`).
+        """
+        if self.rate_limit_passed is None:
+            self.rate_limit_passed = check_rate_limit(
+                client_id=self.client_id, username=self.username,
+                remote_addr=self.remote_addr)
+        if not self.rate_limit_passed:
+            raise OauthistValidationError('slow_down')
+
+    @instrumented('PasswordExchangeRequest.exchange_for_token')
     def exchange_for_token(self, **attrs):
         """
         Perform action "exchange code request for access token".
@@ -316,35 +436,193 @@ class PasswordExchangeRequest(GenericAccessTokenRequest):
         :rtype: AccessToken
         """
         self.check_invalid()
+        self.build_access_token(**attrs)
+        refresh_token = None
+        if framework.refresh_tokens:
+            refresh_token = build_refresh_token(self.access_token)
+        issue_tokens(self.access_token, refresh_token)
+        return self.access_token
+
+    def build_access_token(self, **attrs):
+        """
+        Create (but don't save) access token with attributes of the client
+        and the user
+
+        :rtype: AccessToken
+        """
         if not self.access_token:
-            self.access_token = AccessToken()
+            self.access_token = new_access_token()
         token_attrs = dict(client_id=self.client_id, username=self.username,
                            scope=self.scope)
-        token_attrs.update(**self.user_attrs)
+        token_attrs.update(filter_token_attrs(self.user_attrs))
         token_attrs.update(**attrs)
         self.access_token.set(**token_attrs)
         self.access_token.set_expire(self.expire)
-        self.access_token.save()
         return self.access_token
 
 
-class AccessToken(ormist.TaggedAttrsModel):
+class RefreshExchangeRequest(GenericAccessTokenRequest):
+    """
+    Request to exchange refresh token for a new access token, as defined in
+    :rfc:`6749#6`
+
+    Refresh tokens are issued along with access tokens, if ``refresh_tokens``
+    option is turned on with :func:`oauthist.configure`. Every refresh token
+    can be used only once: the exchange issues a new refresh token of the
+    same "family" and invalidates the old one (rotation). If an already
+    used refresh token is presented again by the client it has been issued
+    to, it's considered to be stolen, and the whole family is revoked, so that
+    neither the attacker, nor the legitimate client can use it anymore.
+
+    Refresh tokens keep only essential attributes of the access token
+    (``client_id``, ``scope``, ``user_id`` and ``username``), so other
+    attributes must be passed to :meth:`exchange_for_token` explicitly.
     """
-    Access token object.
 
-    Persistent object, used to manage clients' access to users' resources.
+    @classmethod
+    def from_werkzeug(cls, request):
+        """
+        Create RefreshExchangeRequest instance from Werkzeug/Flask request
 
-    Usually you shouldn't create instances of :class:`AccessToken` directly,
-    using other methods instread.
+        :rtype RefreshExchangeRequest:
+        """
+        arg_names = ('refresh_token', 'client_id', 'client_secret', 'scope',
+                     'grant_type')
+        kwargs = {}
+        for arg_name in arg_names:
+            kwargs[arg_name] = request.form.get(arg_name)
 
-    For example, to create access token from code request, use
-    :meth:`CodeRequest.exchange_for_token`.
+        return cls(**kwargs)
 
-    Access token may have limited lifetime, but by default they're "eternal".
-    You can change the lifetime value with :func:`oauthist.configure`
-    """
+    def __init__(self, refresh_token=None, client_id=None, client_secret=None,
+                 scope=None, expire=None, grant_type='refresh_token'):
+        """
+        Constructor for refresh token exchange request.
 
-    id_length = 64
+        :param refresh_token: refresh token, issued to the client
+        :type refresh_token: str
+
+        :param client_id: client id
+        :type client_id: str
+
+        :param client_secret: client secret, shared between server and client.
+        Required for confidential clients only.
+        :type client_secret: str
+
+        :param scope: space separated list of scopes. If set, it must not
+        include any scope, not originally granted.
+        :type scope: str
+
+        :param expire: if you want to override default expiration timeout,
+        defined in the framework, you can pass the value here. Value may be
+        integer (seconds since now), timedelta or absulute datetime. ``None``
+        means "use ``framework.access_token_timeout``".
+        :type expire: int or datetime.timedelta or datetime.datetime
+        """
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.grant_type = grant_type
+        self.expire = expire or framework.access_token_timeout
+
+        self.error = None
+        self.error_description = None
+        self.access_token = None
+        self.fetch_objects()
+
+    def fetch_objects(self):
+        """
+        Fetch the client and the refresh token from the database with one
+        round trip
+        """
+        self.client_obj, self.refresh_obj = get_objects(
+            (Client, self.client_id), (RefreshToken, self.refresh_token))
+
+    def check_invalid(self):
+        self.check_client()
+        if not self.refresh_obj:
+            # the client is authenticated, so nobody but the client can
+            # revoke the family by presenting the used token
+            detect_refresh_token_reuse(self.refresh_token, self.client_id)
+            raise OauthistValidationError('invalid_grant')
+        self.check_grant()
+
+    def check_client(self):
+        """
+        Validate request parameters and client authentication
+        """
+        if self.grant_type != 'refresh_token':
+            raise OauthistValidationError('invalid_request')
+        # check for missing values
+        if not self.refresh_token:
+            raise OauthistValidationError('invalid_request')
+        if not self.client_id:
+            raise OauthistValidationError('invalid_request')
+        # check for missing objects
+        if not self.client_obj:
+            raise OauthistValidationError('invalid_client')
+        # check for client authentication
+        if (self.client_secret or
+                self.client_obj.client_type in CONFIDENTIAL_CLIENTS):
+            if self.client_secret != self.client_obj.client_secret:
+                raise OauthistValidationError('invalid_client')
+
+    def check_grant(self):
+        """
+        Validate the refresh token, fetched from the database
+        """
+        if text(self.refresh_obj.attrs.get('client_id')) != text(self.client_id):
+            raise OauthistValidationError('invalid_grant')
+        # requested scope can't exceed the original one
+        if self.scope:
+            granted = set((self.refresh_obj.attrs.get('scope') or '').split())
+            if not granted.issuperset(self.scope.split()):
+                raise OauthistValidationError('invalid_scope')
+
+    @instrumented('RefreshExchangeRequest.exchange_for_token')
+    def exchange_for_token(self, **attrs):
+        """
+        Perform action "exchange refresh token for access token".
+
+        The refresh token is destroyed, and a new one is issued along with
+        the access token (see :meth:`AccessToken.get_json_content`).
+
+        :rtype: AccessToken
+        """
+        self.check_invalid()
+        self.build_access_token(**attrs)
+        # only one of concurrent requests, trying to use the same refresh
+        # token, succeeds here, and only if the family hasn't been revoked
+        if not rotate_refresh_token(self.access_token, self.refresh_obj):
+            self.refresh_obj = None
+            raise OauthistValidationError('invalid_grant')
+        self.access_token.save()
+        return self.access_token
+
+    def build_access_token(self, **attrs):
+        """
+        Create (but don't save) access token with attributes, copied from the
+        refresh token
+
+        :rtype: AccessToken
+        """
+        if not self.access_token:
+            self.access_token = new_access_token()
+        token_attrs = self.refresh_obj.attrs.copy()
+        token_attrs.pop('family_id', None)
+        if self.scope:
+            token_attrs['scope'] = self.scope
+        token_attrs.update(attrs)
+        self.access_token.set(**token_attrs)
+        self.access_token.set_expire(self.expire)
+        return self.access_token
+
+
+class AccessTokenResponseMixin(object):
+    """
+    Common code to pass access tokens of different formats to client via HTTP
+    """
 
     def to_werkzeug_response(self):
         """
@@ -352,8 +630,13 @@ class AccessToken(ormist.TaggedAttrsModel):
         to client the most rightful way
         """
         from werkzeug.wrappers import Response
-        content = self.get_json_content()
-        return Response(json.dumps(content), headers=self.get_headers())
+        return Response(self.get_body(), headers=self.get_headers())
+
+    def get_body(self):
+        """
+        Return serialized JSON content of the access token
+        """
+        return encode_json(self.get_json_content())
 
     def get_json_content(self):
         """
@@ -364,11 +647,22 @@ class AccessToken(ormist.TaggedAttrsModel):
             'token_type': 'bearer',
             'scope': self.scope,
         }
-        expires_in = self.ttl()
+        expires_in = self.get_expires_in()
         if expires_in is not None:
             ret['expires_in'] = expires_in
+        # refresh token is attached by build_refresh_token, but not stored
+        refresh_token = self.__dict__.get('refresh_token')
+        if refresh_token:
+            ret['refresh_token'] = refresh_token
         return ret
 
+    def get_expires_in(self):
+        """
+        Return the lifetime of the access token in seconds, or None if the
+        token never expires
+        """
+        return self.ttl()
+
     def get_headers(self):
         """
         Return the dict with headers, according to :rfc:`6749#4.3.3`
@@ -377,6 +671,937 @@ class AccessToken(ormist.TaggedAttrsModel):
         return JSON_HEADERS
 
 
+class AccessToken(AccessTokenResponseMixin, ormist.Model):
+    """
+    Access token object.
+
+    Persistent object, used to manage clients' access to users' resources.
+
+    Usually you shouldn't create instances of :class:`AccessToken` directly,
+    using other methods instread.
+
+    For example, to create access token from code request, use
+    :meth:`CodeRequest.exchange_for_token`.
+
+    Access token may have limited lifetime, but by default they're "eternal".
+    You can change the lifetime value with :func:`oauthist.configure`
+
+    Access tokens are stored by oauthist itself, without ormist tag indexes.
+    Use :meth:`find` to find tokens of a user or a client.
+    """
+
+    id_length = 64
+
+    #: attributes, for which secondary indexes are maintained, so that all
+    #: tokens of a user or a client could be found quickly
+    indexed_attrs = ('user_id', 'client_id')
+
+    def set_expire(self, expire):
+        """
+        Set expiration timeout of the token. The expiration time is
+        remembered, so that the response to the client doesn't require a
+        database query.
+        """
+        self.__dict__['expire_at'] = expire_timestamp(expire)
+        return super(AccessToken, self).set_expire(expire)
+
+    def get_expires_in(self):
+        if 'expire_at' not in self.__dict__:
+            # the token has been fetched from the database
+            return self.ttl()
+        expire_at = self.__dict__['expire_at']
+        if expire_at is None:
+            return None
+        return max(expire_at - int(time.time()), 0)
+
+    @staticmethod
+    def index_key(name, value):
+        """
+        Return the name of Redis set, containing ids of all tokens with
+        the given attribute value. The set expires along with the last of
+        its tokens.
+        """
+        return redis_key('tokens', name, value)
+
+    @instrumented('AccessToken.save')
+    def save(self):
+        """
+        Save the access token and add it to secondary indexes with one round
+        trip
+
+        Access tokens are written by oauthist, not by ormist, and ormist tag
+        indexes are not maintained for them: the token is found by its id,
+        and all tokens of a user or a client are found with secondary
+        indexes (see :func:`revoke_tokens`).
+        """
+        issue_tokens(self)
+        return self
+
+    def get_save_query(self):
+        """
+        Assign the id to the new token, and return keys and arguments, saving
+        the token with :data:`ISSUE_TOKENS_SCRIPT` (see
+        :func:`get_issue_query`)
+        """
+        if not self._id:
+            self._id = ormist.random_string(self.id_length)
+        now = int(time.time())
+        expire_at = self.__dict__.get('expire_at')
+        ttl = 0 if expire_at is None else max(expire_at - now, 1)
+        keys = [object_key(AccessToken, self.id), LAST_USED_KEY]
+        for name in self.indexed_attrs:
+            value = self.attrs.get(name)
+            if value is not None:
+                keys.append(self.index_key(name, value))
+        last_used = now if framework.track_token_usage else 0
+        return keys, [dump_object(self), self.id, ttl, last_used]
+
+    @instrumented('AccessToken.delete')
+    def delete(self, announce=True):
+        """
+        Delete (revoke) the access token
+
+        :param announce: if False, revocation is not announced to other
+                         processes (see :class:`RevocationListener`).
+                         Used when many tokens are revoked at once, and the
+                         announcement is sent for all of them.
+        """
+        pipe = get_redis().pipeline(transaction=False)
+        self.queue_delete(pipe)
+        incr('redis.commands', len(pipe))
+        pipe.execute()
+        if announce:
+            revoke('token', self.id)
+
+    def queue_delete(self, pipe):
+        """
+        Add commands, deleting the token and removing it from secondary
+        indexes, to the pipeline
+        """
+        pipe.delete(object_key(AccessToken, self.id))
+        for name in self.indexed_attrs:
+            value = self.attrs.get(name)
+            if value is not None:
+                pipe.srem(self.index_key(name, value), self.id)
+        pipe.zrem(LAST_USED_KEY, self.id)
+
+    @classmethod
+    def find(cls, user_id=None, client_id=None, batch_size=500):
+        """
+        Return the list of access tokens of the user, of the client, or of
+        the user for the given client
+
+        Tokens are found with secondary indexes, and fetched in pipelined
+        batches. Signed access tokens are not stored in the database, and
+        can't be found this way.
+        """
+        ret = []
+        for tokens, _ in iter_access_tokens(user_id, client_id, batch_size):
+            ret.extend(tokens)
+        return ret
+
+
+# Atomically claim (delete) the authorization code, save the access token
+# and the refresh token. Every part is optional. Returns 0 and writes
+# nothing, if the code has already been claimed.
+#
+# The access token is added to secondary indexes. Index sets expire along
+# with their last token: their TTL is extended, but never shortened, and
+# they never expire, if they contain tokens which never expire. The refresh
+# token is saved along with its family, and the family is added to indexes.
+#
+# KEYS: claimed code (optional); token, sorted set of last use times, token
+# index sets (optional); refresh token, its family, family index sets
+# (optional)
+# ARGV: number of code keys, of token keys and of refresh token keys; token
+# value, token id, TTL in seconds (0 if the token never expires), the time
+# of the last use (0 if usage is not tracked); refresh token value, refresh
+# token id, family id, timeout in seconds (0 if it never expires)
+ISSUE_TOKENS_SCRIPT = LuaScript("""
+local code_keys = tonumber(ARGV[1])
+local token_keys = tonumber(ARGV[2])
+local refresh_keys = tonumber(ARGV[3])
+if code_keys > 0 and redis.call('DEL', KEYS[1]) == 0 then
+    return 0
+end
+local k = code_keys
+if token_keys > 0 then
+    local ttl = tonumber(ARGV[6])
+    if ttl > 0 then
+        redis.call('SET', KEYS[k + 1], ARGV[4], 'EX', ttl)
+    else
+        redis.call('SET', KEYS[k + 1], ARGV[4])
+    end
+    if tonumber(ARGV[7]) > 0 then
+        redis.call('ZADD', KEYS[k + 2], ARGV[7], ARGV[5])
+    end
+    for i = k + 3, k + token_keys do
+        local index_ttl = redis.call('TTL', KEYS[i])
+        redis.call('SADD', KEYS[i], ARGV[5])
+        if ttl == 0 then
+            redis.call('PERSIST', KEYS[i])
+        elseif index_ttl == -2 or (index_ttl >= 0 and index_ttl < ttl) then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+end
+k = k + token_keys
+if refresh_keys > 0 then
+    local timeout = tonumber(ARGV[11])
+    if timeout > 0 then
+        redis.call('SET', KEYS[k + 1], ARGV[8], 'EX', timeout)
+        redis.call('SET', KEYS[k + 2], ARGV[9], 'EX', timeout)
+    else
+        redis.call('SET', KEYS[k + 1], ARGV[8])
+        redis.call('SET', KEYS[k + 2], ARGV[9])
+    end
+    for i = k + 3, k + refresh_keys do
+        redis.call('SADD', KEYS[i], ARGV[10])
+    end
+end
+return 1
+""")
+
+
+def get_issue_query(access_token=None, refresh_token=None, code=None):
+    """
+    Return ``(keys, args)`` for :data:`ISSUE_TOKENS_SCRIPT`
+
+    :param access_token: access token to save. Signed access tokens aren't
+                         stored in the database, and are skipped.
+    :param refresh_token: refresh token of a new family to save
+    :param code: authorization code to claim
+    """
+    code_keys = [object_key(Code, code.id)] if code is not None else []
+    token_keys, token_args = [], [''] * 4
+    if isinstance(access_token, AccessToken):
+        token_keys, token_args = access_token.get_save_query()
+    refresh_keys, refresh_args = [], [''] * 4
+    if refresh_token is not None:
+        family_id = refresh_token.attrs['family_id']
+        refresh_keys = [object_key(RefreshToken, refresh_token.id),
+                        RefreshToken.family_key(family_id)]
+        for name in AccessToken.indexed_attrs:
+            value = refresh_token.attrs.get(name)
+            if value is not None:
+                refresh_keys.append(RefreshToken.index_key(name, value))
+        refresh_args = [dump_object(refresh_token), refresh_token.id,
+                        family_id, framework.refresh_token_timeout or 0]
+    keys = code_keys + token_keys + refresh_keys
+    args = [len(code_keys), len(token_keys), len(refresh_keys)]
+    return keys, args + token_args + refresh_args
+
+
+def issue_tokens(access_token=None, refresh_token=None, code=None):
+    """
+    Atomically claim the authorization code and save tokens with one round
+    trip (see :func:`get_issue_query`)
+
+    :return: False, if the code has already been claimed (and nothing is
+             saved), True otherwise
+    """
+    if isinstance(access_token, SignedAccessToken):
+        access_token.save()  # nothing is written to the database
+    keys, args = get_issue_query(access_token, refresh_token, code)
+    incr('redis.commands')
+    return bool(ISSUE_TOKENS_SCRIPT(get_redis(), keys=keys, args=args))
+
+
+class SignedAccessToken(AccessTokenResponseMixin):
+    """
+    Self-contained access token.
+
+    Transient object, which isn't stored in the database. Instead, all its
+    attributes (client id, scope, user attributes, expiration time) are
+    serialized to JSON and signed with the secret key, and this signed string
+    is used as the token id. Therefore, verification of such tokens doesn't
+    require Redis at all, but all attributes of the token must be
+    JSON-serializable, and they are readable by anyone who has the token.
+
+    Exchange requests issue signed tokens instead of :class:`AccessToken`
+    if the ``access_token_secret`` is set up with :func:`oauthist.configure`.
+
+    Signed tokens can't be revoked, unless ``signed_token_denylist`` option
+    is turned on. In this case, revoked tokens are stored in Redis until they
+    expire, and every verification of the signed token costs one Redis query.
+    The denylist can be distributed across several Redis databases with
+    ``denylist_systems`` option.
+    """
+
+    def __init__(self, _id=None, **attrs):
+        self._id = _id
+        self.attrs = attrs
+        self.jti = None
+        self.expire_at = None
+
+    @classmethod
+    def from_string(cls, value):
+        """
+        Verify the signed access token string and return the token object
+
+        :return: SignedAccessToken instance or None, if signature is invalid,
+                 token has expired or has been revoked
+        """
+        token = cls.decode(value)
+        if token and framework.signed_token_denylist and token.is_revoked():
+            return None
+        return token
+
+    @classmethod
+    def decode(cls, value):
+        """
+        Verify the signature and expiration time of the signed access token
+        string, but don't check whether it has been revoked
+
+        :return: SignedAccessToken instance or None
+        """
+        try:
+            attrs = unsign(value, framework.access_token_secret)
+        except OauthistValidationError:
+            return None
+        jti = attrs.pop('jti', None)
+        expire_at = attrs.pop('exp', None)
+        if expire_at is not None and expire_at <= time.time():
+            return None
+        token = cls(value, **attrs)
+        token.jti = jti
+        token.expire_at = expire_at
+        return token
+
+    def denylist_key(self):
+        """
+        Return the name of Redis key, marking the token as revoked
+        """
+        return redis_key('revoked', self.jti)
+
+    def denylist_system(self):
+        """
+        Return the name of the ormist system, storing the denylist key of the
+        token (see ``denylist_systems`` in :func:`oauthist.configure`), or
+        None, if the denylist is stored in the ``ormist_system``
+        """
+        if framework.denylist_ring is None:
+            return None
+        return framework.denylist_ring.get_node(self.jti)
+
+    def denylist_redis(self):
+        """
+        Return Redis client of the database, storing the denylist key of the
+        token
+        """
+        system = self.denylist_system()
+        if system is None:
+            return get_redis()
+        return ormist.get_redis(system)
+
+    def is_revoked(self):
+        """
+        Return True, if the token is in the denylist
+        """
+        return bool(self.denylist_redis().exists(self.denylist_key()))
+
+    @property
+    def id(self):
+        return self._id
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __eq__(self, other):
+        return isinstance(other, SignedAccessToken) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def set_expire(self, expire):
+        self.expire_at = expire_timestamp(expire)
+
+    def ttl(self):
+        if self.expire_at is None:
+            return None
+        return max(self.expire_at - int(time.time()), 0)
+
+    def save(self):
+        """
+        Sign the token. Nothing is written to the database, but the token id
+        is defined after this call.
+        """
+        payload = dict(self.attrs, jti=ormist.random_string(16))
+        if self.expire_at is not None:
+            payload['exp'] = self.expire_at
+        self.jti = payload['jti']
+        self._id = sign(payload, framework.access_token_secret[0])
+
+    def delete(self):
+        """
+        Revoke the token
+
+        :raise: OauthistRuntimeError if ``signed_token_denylist`` is not
+                turned on
+        """
+        if not framework.signed_token_denylist:
+            raise OauthistRuntimeError('Signed access tokens can be revoked '
+                                       'only with signed_token_denylist '
+                                       'turned on')
+        key = self.denylist_key()
+        expires_in = self.ttl()
+        if expires_in is None:
+            self.denylist_redis().set(key, '1')
+        elif expires_in > 0:
+            self.denylist_redis().setex(key, expires_in, '1')
+        revoke('token', self.id)
+
+
+class RefreshToken(ormist.Model):
+    """
+    Refresh token, as defined in :rfc:`6749#1.5`
+
+    Persistent object, issued along with the access token, if
+    ``refresh_tokens`` option is turned on with :func:`oauthist.configure`,
+    and exchanged for new access tokens with :class:`RefreshExchangeRequest`.
+
+    Refresh token keeps attributes of the access token, it has been issued
+    with, and the id of its family: the chain of refresh tokens, issued one
+    instead of another.
+    """
+
+    id_length = 64
+
+    @staticmethod
+    def family_key(family_id):
+        """
+        Return the name of Redis key, containing the id of the only valid
+        refresh token of the family
+        """
+        return redis_key('refresh_family', family_id)
+
+    @staticmethod
+    def used_key(refresh_token):
+        """
+        Return the name of Redis key, marking refresh token as used. The value
+        is "<family_id>:<client_id>" of the token.
+        """
+        return redis_key('refresh_used', refresh_token)
+
+    @staticmethod
+    def index_key(name, value):
+        """
+        Return the name of Redis set, containing ids of all refresh token
+        families of the user or the client
+        """
+        return redis_key('refresh_families', name, value)
+
+
+def filter_token_attrs(attrs):
+    """
+    Return the dict of attributes, which are allowed to be copied to access
+    tokens with ``token_attrs`` option of :func:`oauthist.configure`
+    """
+    if framework.token_attrs is None:
+        return attrs
+    return dict((key, value) for key, value in attrs.items()
+                if key in ESSENTIAL_TOKEN_ATTRS or key in framework.token_attrs)
+
+
+def new_access_token():
+    """
+    Create a new (not yet saved) access token of the configured type
+
+    :rtype: AccessToken or SignedAccessToken
+    """
+    if framework.access_token_secret:
+        return SignedAccessToken()
+    return AccessToken()
+
+
+def get_access_token(access_token):
+    """
+    Find access token by its id
+
+    If access token cache is turned on with :func:`oauthist.configure`, the
+    token is looked up in the cache first, and the result of the database
+    lookup (including the fact that the token doesn't exist) is stored there.
+    If ``read_systems`` are configured, the token is read from one of them.
+
+    :param access_token: access token string
+    :return: AccessToken instance or None
+    """
+    if (access_token and framework.access_token_secret and
+            '.' in access_token):
+        # signed tokens are verified without database queries
+        return SignedAccessToken.from_string(access_token)
+    cache = framework.access_token_cache
+    if cache is None and not framework.read_systems:
+        token_object = get_object(AccessToken, access_token)
+        touch_access_tokens([token_object])
+        return token_object
+    if cache is not None:
+        found, token_object = cache.lookup(access_token)
+        if found:
+            incr('access_token_cache.hit')
+            return token_object
+        incr('access_token_cache.miss')
+    if framework.read_systems:
+        token_object, ttl = read_objects_with_ttl(AccessToken,
+                                                  [access_token])[0]
+    else:
+        token_object = get_object(AccessToken, access_token)
+        ttl = token_object.ttl() if token_object is not None else None
+    touch_access_tokens([token_object])
+    if cache is not None:
+        # don't keep the token in the cache longer than it lives in Redis
+        cache.set(access_token, token_object, ttl=ttl)
+    return token_object
+
+
+def get_access_tokens(access_tokens):
+    """
+    Find several access tokens with at most one database round trip
+
+    Works like :func:`get_access_token`, but all tokens which are neither
+    signed nor cached are fetched with one pipelined query, along with
+    denylist checks of signed tokens. If the denylist is distributed with
+    ``denylist_systems``, or tokens are read from ``read_systems``, the
+    denylist is checked with one more round trip per database.
+
+    :param access_tokens: list of access token strings
+    :return: dict mapping every access token string to AccessToken instance
+             or None
+    """
+    found, missing = lookup_access_tokens(access_tokens)
+    signed = get_denylist_candidates(found)
+    signed_tokens = [token_object for _, token_object in signed]
+    if (signed and framework.denylist_ring is None and
+            not framework.read_systems):
+        # stored tokens and the denylist live in the same database
+        with timed('storage.get_objects_with_ttl'):
+            pipe = get_redis().pipeline(transaction=False)
+            queue_objects_with_ttl(pipe, AccessToken, missing)
+            queue_denylist_checks(pipe, signed_tokens)
+            incr('redis.commands', len(pipe))
+            values = pipe.execute()
+        results = parse_objects_with_ttl(AccessToken, missing,
+                                         values[:2 * len(missing)])
+        revoked = values[2 * len(missing):]
+    else:
+        revoked = check_denylist(signed_tokens)
+        results = read_objects_with_ttl(AccessToken, missing)
+    for (access_token, _), is_revoked in zip(signed, revoked):
+        if is_revoked:
+            found[access_token] = None
+    touch_access_tokens([token_object for token_object, _ in results])
+    store_access_tokens(found, missing, results)
+    return found
+
+
+def get_denylist_candidates(found):
+    """
+    Return the list of ``(access_token, token_object)`` tuples for signed
+    tokens among found ones, which must be checked against the denylist
+    """
+    if not framework.signed_token_denylist:
+        return []
+    return [(access_token, token_object)
+            for access_token, token_object in found.items()
+            if isinstance(token_object, SignedAccessToken)]
+
+
+def queue_denylist_checks(pipe, tokens):
+    """
+    Add queries, checking whether signed tokens are in the denylist, to the
+    pipeline
+    """
+    for token in tokens:
+        pipe.exists(token.denylist_key())
+
+
+def check_denylist(tokens):
+    """
+    Return the list of flags, whether signed tokens are in the denylist,
+    with one pipelined round trip per denylist database
+    """
+    groups = {}
+    for i, token in enumerate(tokens):
+        groups.setdefault(token.denylist_system(), []).append(i)
+    ret = [False] * len(tokens)
+    for system, indexes in groups.items():
+        redis_client = get_redis() if system is None else ormist.get_redis(system)
+        pipe = redis_client.pipeline(transaction=False)
+        queue_denylist_checks(pipe, [tokens[i] for i in indexes])
+        incr('redis.commands', len(pipe))
+        for i, value in zip(indexes, pipe.execute()):
+            ret[i] = bool(value)
+    return ret
+
+
+def get_usage_mapping(token_objects):
+    """
+    Return the mapping for ZADD command, recording that access tokens, read
+    from the database, have been used just now, or None if there is nothing
+    to record
+    """
+    if not framework.track_token_usage:
+        return None
+    now = int(time.time())
+    mapping = dict((token_object.id, now) for token_object in token_objects
+                   if isinstance(token_object, AccessToken))
+    return mapping or None
+
+
+def touch_access_tokens(token_objects):
+    """
+    Record the time of the last use of access tokens, if
+    ``track_token_usage`` option is turned on with :func:`oauthist.configure`
+
+    :param token_objects: list of AccessToken instances (or Nones), read
+                          from the database
+    """
+    mapping = get_usage_mapping(token_objects)
+    if mapping:
+        with timed('AccessToken.touch'):
+            incr('redis.commands')
+            get_redis().zadd(LAST_USED_KEY, mapping)
+
+
+def lookup_access_tokens(access_tokens):
+    """
+    Find access tokens which can be verified without querying the database:
+    signed tokens and tokens stored in the cache.
+
+    Signed tokens are not checked against the denylist here.
+
+    :param access_tokens: list of access token strings
+    :return: tuple ``(found, missing)``, where ``found`` is the dict mapping
+             access token strings to AccessToken instances or Nones, and
+             ``missing`` is the list of unique tokens to be fetched from the
+             database
+    """
+    found = {}
+    missing = []
+    seen = set()
+    hits = 0
+    cache = framework.access_token_cache
+    for access_token in access_tokens:
+        if access_token in seen:
+            continue
+        seen.add(access_token)
+        if not access_token:
+            found[access_token] = None
+        elif framework.access_token_secret and '.' in access_token:
+            found[access_token] = SignedAccessToken.decode(access_token)
+        else:
+            hit, token_object = False, None
+            if cache is not None:
+                hit, token_object = cache.lookup(access_token)
+            if hit:
+                found[access_token] = token_object
+                hits += 1
+            else:
+                missing.append(access_token)
+    if cache is not None:
+        incr('access_token_cache.hit', hits)
+        incr('access_token_cache.miss', len(missing))
+    return found, missing
+
+
+def store_access_tokens(found, missing, results):
+    """
+    Store access tokens, fetched from the database, in the ``found`` dict and
+    in the cache
+
+    :param found: dict, returned by :func:`lookup_access_tokens`
+    :param missing: list of tokens, returned by :func:`lookup_access_tokens`
+    :param results: list of ``(token_object, ttl)`` tuples for every token of
+                    ``missing`` list
+    """
+    cache = framework.access_token_cache
+    for access_token, (token_object, ttl) in zip(missing, results):
+        found[access_token] = token_object
+        if cache is not None:
+            cache.set(access_token, token_object, ttl=ttl)
+
+
+def get_scope_mask(token_object):
+    """
+    Return the bit mask of access token scopes (see :func:`scope_mask`)
+
+    The value is computed once and stored in the token object, which is
+    helpful when tokens are reused (for example, taken from the cache).
+    """
+    scope = token_object.attrs.get('scope')
+    bits = framework.scope_bits
+    cached = token_object.__dict__.get('_scope_mask')
+    if cached is None or cached[0] != scope or cached[1] is not bits:
+        cached = (scope, bits, scope_mask(scope))
+        # bypass attribute handlers of the model
+        token_object.__dict__['_scope_mask'] = cached
+    return cached[2]
+
+
+def token_index_key(user_id=None, client_id=None):
+    """
+    Return the key of the secondary index, used to find access tokens of
+    the user, of the client, or of the user for the given client
+    """
+    if user_id is None and client_id is None:
+        raise OauthistRuntimeError('Either user_id or client_id must be set')
+    if user_id is not None:
+        return AccessToken.index_key('user_id', user_id)
+    return AccessToken.index_key('client_id', client_id)
+
+
+def iter_access_tokens(user_id=None, client_id=None, batch_size=500):
+    """
+    Iterate over batches of access tokens of the user, of the client, or of
+    the user for the given client
+
+    :return: iterator over ``(tokens, expired)`` tuples, where ``tokens`` is
+             the list of found :class:`AccessToken` instances, and
+             ``expired`` is the list of ids of tokens, which are still in
+             the index, but don't exist anymore
+    """
+    key = token_index_key(user_id, client_id)
+    token_ids = (u(token_id) for token_id in
+                 get_redis().sscan_iter(key, count=batch_size))
+    for ids in chunks(token_ids, batch_size):
+        tokens = get_objects(*[(AccessToken, token_id) for token_id in ids])
+        found, expired = [], []
+        for token_id, token in zip(ids, tokens):
+            if token is None:
+                expired.append(token_id)
+            elif (user_id is None or client_id is None or
+                    text(token.attrs.get('client_id')) == text(client_id)):
+                found.append(token)
+        yield found, expired
+
+
+def revoke_tokens(user_id=None, client_id=None, batch_size=500):
+    """
+    Revoke all access tokens of the user, of the client, or of the user for
+    the given client
+
+    Tokens are found with secondary indexes, and fetched in pipelined
+    batches. Every batch is deleted along with its index entries with one
+    more round trip, and the revocation is announced once for all tokens.
+    Signed access tokens are not stored in the database, and can't be
+    revoked this way. Refresh tokens of the user or the client are revoked
+    too.
+
+    :param user_id: the value of ``user_id`` attribute of tokens
+    :param client_id: the value of ``client_id`` attribute of tokens
+    :param batch_size: number of tokens fetched from the database at once
+    :return: number of revoked tokens
+    """
+    revoked = 0
+    for tokens, expired in iter_access_tokens(user_id, client_id, batch_size):
+        if not tokens and not expired:
+            continue
+        # one round trip per batch: tokens, their index entries and ids of
+        # expired tokens are removed together
+        pipe = get_redis().pipeline(transaction=False)
+        for token in tokens:
+            token.queue_delete(pipe)
+        if expired:
+            pipe.srem(token_index_key(user_id, client_id), *expired)
+        incr('redis.commands', len(pipe))
+        pipe.execute()
+        revoked += len(tokens)
+    revoke_refresh_tokens(user_id, client_id, batch_size)
+
+    if user_id is not None and client_id is not None:
+        revoke('user_client', '%s:%s' % (user_id, client_id))
+    elif user_id is not None:
+        revoke('user', user_id)
+    else:
+        revoke('client', client_id)
+    return revoked
+
+
+def new_refresh_token(attrs, family_id):
+    """
+    Create (but don't save) refresh token of the family with essential
+    attributes of the access token
+
+    :rtype: RefreshToken
+    """
+    attrs = dict((key, value) for key, value in attrs.items()
+                 if key in ESSENTIAL_TOKEN_ATTRS)
+    return RefreshToken(ormist.random_string(RefreshToken.id_length),
+                        family_id=family_id, **attrs)
+
+
+def issue_refresh_token(access_token):
+    """
+    Create and save a refresh token of a new family for the access token
+
+    The refresh token is attached to the access token, and is returned to
+    the client in the response.
+
+    :param access_token: saved access token
+    :rtype: RefreshToken
+    """
+    refresh_token = build_refresh_token(access_token)
+    issue_tokens(refresh_token=refresh_token)
+    return refresh_token
+
+
+def build_refresh_token(access_token):
+    """
+    Create (but don't save) a refresh token of a new family for the access
+    token, and attach it to the access token
+
+    :rtype: RefreshToken
+    """
+    refresh_token = new_refresh_token(access_token.attrs,
+                                      ormist.random_string(16))
+    access_token.__dict__['refresh_token'] = refresh_token.id
+    return refresh_token
+
+
+# Replace the used refresh token with the new one, unless the used token is
+# not the valid token of its family anymore (the family has been revoked, or
+# the token has been used by a concurrent request), and mark the used token.
+# KEYS: used token, family, new token, used token marker
+# ARGV: used token id, new token id, new token value, marker value, timeout
+# in seconds (0 if tokens never expire)
+ROTATE_SCRIPT = LuaScript("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+if redis.call('DEL', KEYS[1]) == 0 then
+    return 0
+end
+local timeout = tonumber(ARGV[5])
+local values = {{KEYS[3], ARGV[3]}, {KEYS[2], ARGV[2]}, {KEYS[4], ARGV[4]}}
+for _, pair in ipairs(values) do
+    if timeout > 0 then
+        redis.call('SET', pair[1], pair[2], 'EX', timeout)
+    else
+        redis.call('SET', pair[1], pair[2])
+    end
+end
+return 1
+""")
+
+
+def get_rotation_query(used_token):
+    """
+    Create the refresh token to replace the used one, and return
+    ``(refresh_token, keys, args)`` for :data:`ROTATE_SCRIPT`
+    """
+    family_id = used_token.attrs['family_id']
+    refresh_token = new_refresh_token(used_token.attrs, family_id)
+    keys = [object_key(RefreshToken, used_token.id),
+            RefreshToken.family_key(family_id),
+            object_key(RefreshToken, refresh_token.id),
+            RefreshToken.used_key(used_token.id)]
+    marker = '%s:%s' % (family_id, used_token.attrs.get('client_id'))
+    args = [used_token.id, refresh_token.id, dump_object(refresh_token),
+            marker, framework.refresh_token_timeout or 0]
+    return refresh_token, keys, args
+
+
+def rotate_refresh_token(access_token, used_token):
+    """
+    Atomically delete the used refresh token and issue the new one of the
+    same family, remembering that the used token must never be presented
+    again
+
+    The new refresh token is attached to the access token.
+
+    :return: new RefreshToken instance, or None if the used token is not
+             valid anymore
+    """
+    refresh_token, keys, args = get_rotation_query(used_token)
+    with timed('RefreshToken.rotate'):
+        incr('redis.commands')
+        if not ROTATE_SCRIPT(get_redis(), keys=keys, args=args):
+            return None
+    access_token.__dict__['refresh_token'] = refresh_token.id
+    return refresh_token
+
+
+def detect_refresh_token_reuse(refresh_token, client_id):
+    """
+    If the refresh token has already been used, and it's presented by the
+    client it has been issued to, revoke its family
+
+    :return: True, if reuse has been detected
+    """
+    marker = get_redis().get(RefreshToken.used_key(refresh_token))
+    if marker is None:
+        return False
+    family_id, _, owner = u(marker).partition(':')
+    if owner != text(client_id):
+        return False
+    revoke_refresh_family(family_id)
+    return True
+
+
+def revoke_refresh_family(family_id):
+    """
+    Revoke the valid refresh token of the family, so that the family can't
+    be used anymore
+    """
+    family_key = RefreshToken.family_key(family_id)
+    # the family key is deleted atomically, so that concurrent rotation
+    # either fails, or issues the token which is revoked here
+    pipe = get_redis().pipeline()
+    pipe.get(family_key)
+    pipe.delete(family_key)
+    current, _ = pipe.execute()
+    if current is not None:
+        claim_object(RefreshToken, u(current))
+
+
+def revoke_refresh_tokens(user_id=None, client_id=None, batch_size=500):
+    """
+    Revoke refresh tokens of the user, of the client, or of the user for the
+    given client. Used by :func:`revoke_tokens`.
+
+    :return: number of revoked refresh token families
+    """
+    if user_id is not None:
+        key = RefreshToken.index_key('user_id', user_id)
+    else:
+        key = RefreshToken.index_key('client_id', client_id)
+    redis_client = get_redis()
+    revoked = 0
+    family_ids = (u(family_id) for family_id in
+                  redis_client.sscan_iter(key, count=batch_size))
+    for ids in chunks(family_ids, batch_size):
+        pipe = redis_client.pipeline(transaction=False)
+        for family_id in ids:
+            pipe.get(RefreshToken.family_key(family_id))
+        current_ids = [u(value) if value is not None else None
+                       for value in pipe.execute()]
+        tokens = get_objects(*[(RefreshToken, current_id)
+                               for current_id in current_ids])
+        expired = []
+        for family_id, token in zip(ids, tokens):
+            if token is None:
+                expired.append(family_id)
+                continue
+            if (user_id is not None and client_id is not None and
+                    text(token.attrs.get('client_id')) != text(client_id)):
+                continue
+            revoke_refresh_family(family_id)
+            expired.append(family_id)
+            revoked += 1
+        if expired:
+            redis_client.srem(key, *expired)
+    return revoked
+
+
 class AccessTokenError(object):
     """
     Object representing error while issuing access token
@@ -394,9 +1619,27 @@ class AccessTokenError(object):
         to client the most rightful way
         """
         from werkzeug.wrappers import Response
-        content = self.get_json_content()
-        return Response(json.dumps(content), headers=self.get_headers(),
-                        status=400)
+        return Response(self.get_body(), headers=self.get_headers(),
+                        status=self.get_status())
+
+    def get_status(self):
+        """
+        Return HTTP status of the error response: 429 for "slow_down" error,
+        and 400 for all others
+        """
+        return ERROR_STATUSES.get(self.error, 400)
+
+    def get_body(self):
+        """
+        Return serialized JSON content of the error. Bodies of standard
+        errors are serialized only once.
+        """
+        body = framework.error_bodies.get(self.error)
+        if body is None:
+            body = encode_json(self.get_json_content())
+            if self.error in ERROR_CODES:
+                framework.error_bodies[self.error] = body
+        return body
 
     def get_json_content(self):
         """
@@ -470,6 +1713,7 @@ class ProtectedResourceRequest(object):
         return cls(active_token)
 
 
+    @instrumented('ProtectedResourceRequest.verify_access_token')
     def verify_access_token(self, *scopes):
         """
         Check if access token is valid to get access to following list of scopes
@@ -482,18 +1726,81 @@ class ProtectedResourceRequest(object):
         :param \*scopes: list of scopes, which token must be valid for. Note that
                          here the "OR"-logic is used. If one or more scope is
                          defined, then the token must be valid for at least one
-                         scope in the list
+                         scope in the list. Instead of the list of strings, you
+                         can pass the only instance of :class:`CompiledScopes`
+                         (see :func:`oauthist.compile_scopes`)
         :return: AccessToken instance
         :rtype: AccessToken
         :raise: InvalidAccessToken
         """
-        token_object = AccessToken.objects.get(self.access_token)
+        token_object = get_access_token(self.access_token)
+        return self.check_access_token(token_object, *scopes)
+
+    @classmethod
+    @instrumented('ProtectedResourceRequest.verify_many')
+    def verify_many(cls, access_tokens, *scopes):
+        """
+        Check several access tokens at once
+
+        Same as :meth:`verify_access_token`, but all tokens are fetched from
+        the database with one round trip. Handy for gateways, verifying
+        batches of requests.
+
+        :param access_tokens: list of access token strings
+        :param \*scopes: list of scopes, which every token must be valid for
+                         (with the same "OR"-logic)
+        :return: list of the same length as ``access_tokens``, where every
+                 item is either AccessToken instance or
+                 :class:`InvalidAccessToken` exception instance
+        """
+        token_objects = get_access_tokens(access_tokens)
+        return cls.check_access_tokens(access_tokens, token_objects, *scopes)
+
+    @classmethod
+    def check_access_tokens(cls, access_tokens, token_objects, *scopes):
+        """
+        Check every access token with :meth:`check_access_token`
+
+        :param access_tokens: list of access token strings
+        :param token_objects: dict mapping access token strings to
+                              AccessToken instances or Nones
+        :return: list of AccessToken or InvalidAccessToken instances
+        """
+        ret = []
+        for access_token in access_tokens:
+            try:
+                token_object = cls.check_access_token(
+                    token_objects[access_token], *scopes)
+            except InvalidAccessToken as e:
+                ret.append(e)
+            else:
+                ret.append(token_object)
+        return ret
+
+    @staticmethod
+    def check_access_token(token_object, *scopes):
+        """
+        Check if access token object, found in the database, is valid for
+        the list of scopes
+
+        :param token_object: AccessToken instance or None
+        :return: AccessToken instance
+        :raise: InvalidAccessToken
+        """
         if not token_object:
             raise InvalidAccessToken()
         if not scopes:
             return token_object
-        token_scopes = set(token_object.scope.split())
-        required_scopes = set(scopes)
-        if required_scopes.intersection(token_scopes):
+        if len(scopes) == 1 and isinstance(scopes[0], CompiledScopes):
+            required_scopes = scopes[0]
+        else:
+            required_scopes = CompiledScopes(scopes)
+        required_mask = required_scopes.mask
+        if required_mask is not None:
+            valid = required_mask & get_scope_mask(token_object)
+        else:
+            token_scopes = (token_object.scope or '').split()
+            valid = not required_scopes.names.isdisjoint(token_scopes)
+        if valid:
             return token_object
         raise InvalidAccessToken()
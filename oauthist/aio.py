@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio API for oauthist
+
+Classes of this module have the same interface, as their synchronous
+counterparts, except that all methods querying the database are coroutines.
+
+.. code-block:: python
+
+    >>> from oauthist import aio
+    >>> aio.setup_redis(host='localhost', port=6379, db=0)
+    >>> req = aio.ProtectedResourceRequest.from_werkzeug(request)
+    >>> token = await req.verify_access_token('user_ro')
+
+All reads (fetching clients, codes and access tokens, verification of
+access tokens) are performed with asynchronous Redis client, which must be
+connected to the same database as the ormist system, configured with
+:func:`oauthist.configure`.
+
+Access tokens and codes are saved with asynchronous Redis client too.
+
+Requires Python 3.7+ and redis-py 4.2+ (``pip install oauthist[aio]``).
+"""
+import asyncio
+import functools
+import inspect
+import redis.asyncio
+from oauthist import access_token, authorization_code
+from oauthist.core import framework
+from oauthist.utils import expire_timeout
+from oauthist.client import Client, ClientCache
+from oauthist.authorization_code import Code
+from oauthist.access_token import (AccessToken, SignedAccessToken, RefreshToken,
+                                   lookup_access_tokens, store_access_tokens,
+                                   build_refresh_token, get_rotation_query,
+                                   get_issue_query, detect_refresh_token_reuse,
+                                   ROTATE_SCRIPT, ISSUE_TOKENS_SCRIPT)
+from oauthist.errors import OauthistValidationError, OauthistRuntimeError
+from oauthist import storage, middleware, ratelimit
+from oauthist.instrumentation import incr
+
+_redis = None
+
+
+def setup_redis(*args, **kwargs):
+    """
+    Set up asynchronous Redis client. Accepts the same arguments as
+    ``redis.asyncio.Redis``.
+    """
+    global _redis
+    _redis = redis.asyncio.Redis(*args, **kwargs)
+
+
+def get_redis():
+    """
+    Return asynchronous Redis client, set up with :func:`setup_redis`
+    """
+    if _redis is None:
+        raise OauthistRuntimeError('Asynchronous Redis client is not set up, '
+                                   'maybe you forgot to call '
+                                   'oauthist.aio.setup_redis()')
+    return _redis
+
+
+async def run_sync(func, *args):
+    """
+    Run blocking function in the default executor
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+#--- storage
+
+async def get_objects(*pairs):
+    """
+    Asynchronous version of :func:`oauthist.storage.get_objects`
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    storage.queue_objects(pipe, pairs)
+    return storage.parse_objects(pairs, await pipe.execute())
+
+
+async def get_client_objects(client_id, *pairs):
+    """
+    Fetch the client and other objects (pairs of model class and id) with
+    one round trip
+
+    If client cache is turned on with :func:`oauthist.configure`, the client
+    is looked up in the cache first. When the cache must be revalidated, the
+    version of clients registry is fetched in the same round trip.
+
+    :return: list of objects, starting with the client
+    """
+    cache = framework.client_cache
+    if cache is None or not client_id:
+        return await get_objects((Client, client_id), *pairs)
+    if not cache.is_stale():
+        found, client = cache.lookup(client_id, revalidate=False)
+        if found:
+            objects = await get_objects(*pairs) if pairs else []
+            return [client] + list(objects)
+    else:
+        incr('client_cache.miss')
+    pairs = ((Client, client_id), ) + pairs
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.get(ClientCache.VERSION_KEY)
+    storage.queue_objects(pipe, pairs)
+    values = await pipe.execute()
+    cache.set_version(values[0])
+    objects = storage.parse_objects(pairs, values[1:])
+    cache.store(client_id, objects[0])
+    return objects
+
+
+async def get_client(client_id):
+    """
+    Asynchronous version of :func:`oauthist.get_client`
+    """
+    client, = await get_client_objects(client_id)
+    return client
+
+
+async def get_objects_with_ttl(model_class, ids):
+    """
+    Asynchronous version of :func:`oauthist.storage.get_objects_with_ttl`
+    """
+    if not ids:
+        return []
+    pipe = get_redis().pipeline(transaction=False)
+    storage.queue_objects_with_ttl(pipe, model_class, ids)
+    return storage.parse_objects_with_ttl(model_class, ids,
+                                          await pipe.execute())
+
+
+async def claim_object(model_class, _id):
+    """
+    Asynchronous version of :func:`oauthist.storage.claim_object`
+    """
+    key = storage.object_key(model_class, _id)
+    return bool(await get_redis().delete(key))
+
+
+async def run_script(script, keys=(), args=()):
+    """
+    Asynchronous version of :class:`oauthist.core.LuaScript` call
+    """
+    params = list(keys) + list(args)
+    try:
+        return await get_redis().evalsha(script.sha, len(keys), *params)
+    except redis.exceptions.NoScriptError:
+        return await get_redis().eval(script.source, len(keys), *params)
+
+
+async def save_object(obj, expire=None):
+    """
+    Asynchronous version of :func:`oauthist.storage.save_object`
+    """
+    storage.assign_id(obj)
+    key = storage.object_key(type(obj), obj.id)
+    await get_redis().set(key, storage.dump_object(obj),
+                          ex=expire_timeout(expire))
+    return obj
+
+
+async def update_object(obj):
+    """
+    Asynchronous version of :func:`oauthist.storage.update_object`
+    """
+    key = storage.object_key(type(obj), obj.id)
+    return bool(await run_script(storage.UPDATE_SCRIPT, keys=[key],
+                                 args=[storage.dump_object(obj)]))
+
+
+async def check_rate_limit(**values):
+    """
+    Asynchronous version of :func:`oauthist.ratelimit.check_rate_limit`
+    """
+    query = ratelimit.get_rate_limit_query(**values)
+    if query is None:
+        return True
+    keys, args = query
+    return bool(await run_script(ratelimit.RATE_LIMIT_SCRIPT, keys=keys,
+                                 args=args))
+
+
+async def issue_tokens(access_token=None, refresh_token=None, code=None):
+    """
+    Asynchronous version of :func:`oauthist.access_token.issue_tokens`
+    """
+    if isinstance(access_token, SignedAccessToken):
+        access_token.save()  # nothing is written to the database
+    keys, args = get_issue_query(access_token, refresh_token, code)
+    return bool(await run_script(ISSUE_TOKENS_SCRIPT, keys=keys, args=args))
+
+
+#--- authorization codes
+
+class CodeRequest(authorization_code.CodeRequest):
+    """
+    Asynchronous version of :class:`oauthist.CodeRequest`
+    """
+
+    def fetch_objects(self):
+        self.client = None
+        self._fetched = False
+
+    async def fetch(self):
+        if not self._fetched:
+            self.client = await get_client(self.client_id)
+            self._fetched = True
+
+    async def is_broken(self):
+        await self.fetch()
+        return super().is_broken()
+
+    async def is_invalid(self):
+        await self.fetch()
+        return super().is_invalid()
+
+    async def save_code(self, **attrs):
+        await self.fetch()
+        self.check_broken()
+        self.check_invalid()
+        code = self.build_code(**attrs)
+        await save_object(code, self.expire)
+        return code
+
+
+async def get_code(code_id):
+    """
+    Find authorization code by its id
+
+    :return: Code instance or None
+    """
+    code, = await get_objects((Code, code_id))
+    return code
+
+
+async def accept_code(code):
+    """
+    Asynchronous version of :meth:`oauthist.Code.accept`
+    """
+    code.set(accepted=True)
+    if not await update_object(code):
+        return code.get_error_redirect(error='access_denied')
+    return code.get_success_redirect()
+
+
+async def decline_code(code, error='access_denied'):
+    """
+    Asynchronous version of :meth:`oauthist.Code.decline`
+    """
+    await claim_object(Code, code.id)
+    return code.get_error_redirect(error=error)
+
+
+#--- access tokens
+
+class CodeExchangeRequest(access_token.CodeExchangeRequest):
+    """
+    Asynchronous version of :class:`oauthist.CodeExchangeRequest`
+    """
+
+    def fetch_objects(self):
+        # objects are fetched asynchronously by fetch()
+        pass
+
+    async def fetch(self):
+        if self._fetched:
+            return
+        try:
+            self.check_params()
+        except OauthistValidationError:
+            return  # the request is rejected without database queries
+        self.client_obj, self.code_obj = await get_client_objects(
+            self.client_id, (Code, self.code))
+        self._fetched = True
+
+    async def is_invalid(self):
+        await self.fetch()
+        return super().is_invalid()
+
+    async def exchange_for_token(self, **attrs):
+        await self.fetch()
+        self.check_invalid()
+        token = self.build_access_token(**attrs)
+        refresh_token = None
+        if framework.refresh_tokens:
+            refresh_token = build_refresh_token(token)
+        if not await issue_tokens(token, refresh_token, self.code_obj):
+            self.code_obj = self.access_token = None
+            raise OauthistValidationError('invalid_grant')
+        return token
+
+
+class PasswordExchangeRequest(access_token.PasswordExchangeRequest):
+    """
+    Asynchronous version of :class:`oauthist.PasswordExchangeRequest`
+
+    ``verify_requisites`` callback may be either a function or a coroutine
+    function.
+    """
+
+    def fetch_objects(self):
+        self.client_obj = None
+        self._fetched = False
+
+    async def fetch(self):
+        if not self._fetched:
+            self.client_obj = await get_client(self.client_id)
+            self._fetched = True
+
+    async def is_invalid(self):
+        try:
+            await self.check_invalid()
+        except OauthistValidationError as e:
+            self.error = str(e)
+            return True
+        else:
+            return False
+
+    async def check_invalid(self):
+        await self.fetch()
+        self.check_request()
+        if self.rate_limit_passed is None:
+            self.rate_limit_passed = await check_rate_limit(
+                client_id=self.client_id, username=self.username,
+                remote_addr=self.remote_addr)
+        if not self.rate_limit_passed:
+            raise OauthistValidationError('slow_down')
+        user_attrs = self.verify_requisites(self.username, self.password)
+        if inspect.isawaitable(user_attrs):
+            user_attrs = await user_attrs
+        self.user_attrs = user_attrs
+        if self.user_attrs is None:  # invalid requisites
+            raise OauthistValidationError('invalid_grant')
+
+    async def exchange_for_token(self, **attrs):
+        await self.check_invalid()
+        token = self.build_access_token(**attrs)
+        refresh_token = None
+        if framework.refresh_tokens:
+            refresh_token = build_refresh_token(token)
+        await issue_tokens(token, refresh_token)
+        return token
+
+
+async def is_revoked(token):
+    """
+    Asynchronous version of :meth:`oauthist.SignedAccessToken.is_revoked`
+
+    If the denylist is distributed across several databases, the check is
+    executed in the default executor.
+    """
+    if framework.denylist_ring is not None:
+        return await run_sync(token.is_revoked)
+    return bool(await get_redis().exists(token.denylist_key()))
+
+
+class RefreshExchangeRequest(access_token.RefreshExchangeRequest):
+    """
+    Asynchronous version of :class:`oauthist.RefreshExchangeRequest`
+    """
+
+    def fetch_objects(self):
+        self.client_obj = None
+        self.refresh_obj = None
+        self._fetched = False
+
+    async def fetch(self):
+        if not self._fetched:
+            self.client_obj, self.refresh_obj = await get_client_objects(
+                self.client_id, (RefreshToken, self.refresh_token))
+            self._fetched = True
+
+    async def is_invalid(self):
+        try:
+            await self.check_invalid()
+        except OauthistValidationError as e:
+            self.error = str(e)
+            return True
+        else:
+            return False
+
+    async def check_invalid(self):
+        await self.fetch()
+        self.check_client()
+        if not self.refresh_obj:
+            await run_sync(detect_refresh_token_reuse, self.refresh_token,
+                           self.client_id)
+            raise OauthistValidationError('invalid_grant')
+        self.check_grant()
+
+    async def exchange_for_token(self, **attrs):
+        await self.check_invalid()
+        token = self.build_access_token(**attrs)
+        refresh_token, keys, args = get_rotation_query(self.refresh_obj)
+        if not await run_script(ROTATE_SCRIPT, keys=keys, args=args):
+            self.refresh_obj = None
+            raise OauthistValidationError('invalid_grant')
+        token.__dict__['refresh_token'] = refresh_token.id
+        await issue_tokens(token)
+        return token
+
+
+async def get_access_tokens(access_tokens):
+    """
+    Asynchronous version of :func:`oauthist.access_token.get_access_tokens`
+    """
+    found, missing = lookup_access_tokens(access_tokens)
+    signed = access_token.get_denylist_candidates(found)
+    signed_tokens = [token_object for _, token_object in signed]
+    revoked = []
+    if framework.denylist_ring is not None:
+        revoked = await run_sync(access_token.check_denylist, signed_tokens)
+    # stored tokens (and the denylist) are read with one round trip
+    pipe = get_redis().pipeline(transaction=False)
+    storage.queue_objects_with_ttl(pipe, AccessToken, missing)
+    if framework.denylist_ring is None:
+        access_token.queue_denylist_checks(pipe, signed_tokens)
+    values = await pipe.execute() if len(pipe) else []
+    results = storage.parse_objects_with_ttl(AccessToken, missing,
+                                             values[:2 * len(missing)])
+    if framework.denylist_ring is None:
+        revoked = values[2 * len(missing):]
+    for (token_string, _), token_revoked in zip(signed, revoked):
+        if token_revoked:
+            found[token_string] = None
+    mapping = access_token.get_usage_mapping(
+        [token_object for token_object, _ in results])
+    if mapping:
+        await get_redis().zadd(access_token.LAST_USED_KEY, mapping)
+    store_access_tokens(found, missing, results)
+    return found
+
+
+class ProtectedResourceRequest(access_token.ProtectedResourceRequest):
+    """
+    Asynchronous version of :class:`oauthist.ProtectedResourceRequest`
+    """
+
+    async def verify_access_token(self, *scopes):
+        token_objects = await get_access_tokens([self.access_token])
+        return self.check_access_token(token_objects[self.access_token],
+                                       *scopes)
+
+    @classmethod
+    async def verify_many(cls, access_tokens, *scopes):
+        token_objects = await get_access_tokens(access_tokens)
+        return cls.check_access_tokens(access_tokens, token_objects, *scopes)
+
+
+#--- middleware
+
+class BearerMiddleware(object):
+    """
+    ASGI version of :class:`oauthist.middleware.BearerMiddleware`
+
+    Verified token is put to the connection scope under ``scope_key``. HTTP
+    requests with invalid tokens get error responses, websocket connections
+    are closed before they are accepted.
+
+    :param app: ASGI application
+    :param scopes: default scope requirements
+    :param routes: list of ``(path_prefix, scopes)`` tuples
+    :param scope_key: the key of the connection scope to put verified token
+                      to
+    """
+
+    def __init__(self, app, scopes=None, routes=None,
+                 scope_key=middleware.ENVIRON_KEY):
+        self.app = app
+        self.route_scopes = middleware.RouteScopes(scopes, routes)
+        self.scope_key = scope_key
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+        scopes = self.route_scopes.match(scope.get('path', ''))
+        if scopes is None:
+            return await self.app(scope, receive, send)
+        authorization = None
+        for name, value in scope.get('headers', ()):
+            if name == b'authorization':
+                authorization = value.decode('latin-1')
+                break
+        access_token = middleware.get_bearer_token(authorization)
+        token_object = None
+        if access_token:
+            token_objects = await get_access_tokens([access_token])
+            token_object = token_objects[access_token]
+        error = middleware.get_auth_error(access_token, token_object, scopes)
+        if error is not None:
+            await self.send_error(scope, send, *error)
+            return
+        scope = dict(scope)
+        scope[self.scope_key] = token_object
+        await self.app(scope, receive, send)
+
+    async def send_error(self, scope, send, status, error):
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        headers, body = middleware.get_error_response(status, error)
+        headers.append(('Content-Length', str(len(body))))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
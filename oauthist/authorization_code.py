@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import ormist
 from oauthist.errors import OauthistValidationError, OauthistRuntimeError
-from oauthist.client import Client
+from oauthist.client import get_client
 from oauthist.core import framework
 from oauthist.utils import add_arguments
+from oauthist.instrumentation import instrumented
+from oauthist.storage import (update_object, claim_object, save_object,
+                              get_object)
 
 
 class CodeRequest(object):
@@ -67,7 +70,6 @@ class CodeRequest(object):
         """
         self.response_type = response_type
         self.client_id = client_id
-        self.client = Client.objects.get(client_id)
         self.redirect_uri = redirect_uri
         self.expire = expire or framework.authorization_code_timeout
         self.scope = scope
@@ -77,7 +79,15 @@ class CodeRequest(object):
         self.error = None
         # self.code is defined on save_code method
         self.code = None
+        self.fetch_objects()
 
+    def fetch_objects(self):
+        """
+        Fetch the client from the database
+        """
+        self.client = get_client(self.client_id)
+
+    @instrumented('CodeRequest.is_broken')
     def is_broken(self):
         """
         Return True if it doesn't make any sense to check the request further
@@ -104,6 +114,7 @@ class CodeRequest(object):
             raise OauthistValidationError('invalid_client_id')
         self.redirect_uri = self.client.check_redirect_uri(self.redirect_uri)
 
+    @instrumented('CodeRequest.is_invalid')
     def is_invalid(self):
         """
         Return True, if code request is invalid, but it is safe to redirect user back
@@ -131,7 +142,7 @@ class CodeRequest(object):
         scope_list = (self.scope or '').strip().split()
         if not scope_list:
             raise OauthistValidationError('missing_scope')
-        if not set(scope_list).issubset(set(framework.scopes)):
+        if not framework.scope_set.issuperset(scope_list):
             raise OauthistValidationError('invalid_scope')
 
     def get_redirect(self, error=None):
@@ -159,6 +170,7 @@ class CodeRequest(object):
         return add_arguments(self.redirect_uri, args)
 
 
+    @instrumented('CodeRequest.save_code')
     def save_code(self, **attrs):
         """
         If eveything is okay, then create and return a new :class:`Code` instance
@@ -173,16 +185,36 @@ class CodeRequest(object):
         """
         self.check_broken()
         self.check_invalid()
+        self.build_code(**attrs)
+        save_object(self.code, self.expire)
+        return self.code
+
+    def build_code(self, **attrs):
+        """
+        Create (but don't save) a new :class:`Code` instance
+        """
         if not self.code:
             self.code = Code()
         self.code.set(client_id=self.client_id, redirect_uri=self.redirect_uri,
                       scope=self.scope, state=self.state)
         self.code.set(**attrs)
         self.code.set_expire(self.expire)
-        self.code.save()
         return self.code
 
 
+def get_code(code_id):
+    """
+    Find authorization code by its id
+
+    Use it instead of ``Code.objects.get``: codes can be stored with
+    ``object_serializer`` (see :func:`oauthist.configure`), which ormist
+    can't read.
+
+    :return: Code instance or None
+    """
+    return get_object(Code, code_id)
+
+
 class Code(ormist.Model):
     """
     Authorization code as defined in :rfc:`6749#1.3.1`
@@ -212,17 +244,22 @@ class Code(ormist.Model):
         else:
             return self.get_success_redirect()
 
+    @instrumented('Code.accept')
     def accept(self):
         """
         Accept code and return redirect URL
 
         Behind the scenes, the `accepted=True` is stored as the value of the
-        instance attribute.
+        instance attribute. The code is updated in place, keeping its
+        remaining lifetime.
 
-        If everything is okay, return success redirect with the code
+        If everything is okay, return success redirect with the code. If the
+        code has expired (or has been declined) in the meantime, return error
+        redirect with "access_denied" error instead.
         """
         self.set(accepted=True)
-        self.save()
+        if not update_object(self):
+            return self.get_error_redirect(error='access_denied')
         return self.get_success_redirect()
 
     def get_success_redirect(self):
@@ -238,6 +275,7 @@ class Code(ormist.Model):
 
         return add_arguments(redirect_uri, args)
 
+    @instrumented('Code.decline')
     def decline(self, error='access_denied'):
         """
         Decline code request and return corresponding callback URL
@@ -250,7 +288,7 @@ class Code(ormist.Model):
 
         :return: redirect URL where client should be redirected to
         """
-        self.delete()
+        claim_object(Code, self.id)
         return self.get_error_redirect(error=error)
 
     def get_error_redirect(self, error='access_denied'):
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from oauthist.compat import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded in-process cache with least-recently-used eviction policy and
+    per-entry expiration.
+
+    Transient object, which lives in the memory of a single process and
+    is used to avoid Redis round trips for objects which are read much more
+    often than they are changed (such as verified access tokens).
+
+    The cache stores ``None`` values as well, which makes it possible to
+    use it for negative caching ("there is no such object in the database").
+
+    :param max_size: maximum number of entries. When exceeded, least recently
+                     used entries are evicted.
+    :param ttl: maximum lifetime of the entry in seconds
+    :param negative_ttl: lifetime of the ``None`` entry in seconds
+    """
+
+    def __init__(self, max_size=10000, ttl=60, negative_ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key):
+        """
+        Find the value in cache
+
+        :return: tuple ``(found, value)``. If ``found`` is False, the key is
+                 either not in the cache, or its entry has expired.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return False, None
+            expire_at, value = entry
+            if expire_at <= time.time():
+                return False, None
+            # move the entry to the end of the queue (most recently used)
+            self._data[key] = entry
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store the value in cache
+
+        :param ttl: lifetime of the entry in seconds. Can't exceed the lifetime,
+                    defined for the cache itself, but can be shorter (for
+                    example, if the object is going to expire in the database
+                    sooner). ``None`` means "use cache defaults".
+        """
+        max_ttl = self.negative_ttl if value is None else self.ttl
+        if ttl is None or ttl > max_ttl:
+            ttl = max_ttl
+        if ttl <= 0:
+            self.delete(key)
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove the value from cache, if it's there
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """
+        Remove all values for which ``predicate(value)`` returns True
+        """
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items()
+                    if predicate(value)]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        """
+        Remove all values from cache
+        """
+        with self._lock:
+            self._data.clear()
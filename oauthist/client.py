@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
+import time
 import ormist
-from oauthist.utils import check_url
+from oauthist.utils import check_url, normalize_url
+from oauthist.compat import urlparse, unquote
 from oauthist.errors import OauthistValidationError
 from oauthist.core import CLIENT_ID_LENGTH, CLIENT_TYPES, CONFIDENTIAL_CLIENTS, CLIENT_SECRET_LENGTH
+from oauthist.core import framework, get_redis, redis_key
 from oauthist.compat import text, binary
+from oauthist.cache import LRUCache
+from oauthist.revocation import revoke
+from oauthist.storage import read_object
+from oauthist.instrumentation import instrumented, incr
 
 
 class Client(ormist.TaggedAttrsModel):
@@ -67,7 +74,10 @@ class Client(ormist.TaggedAttrsModel):
             redirect_urls = [redirect_urls, ]
         for url in redirect_urls:
             check_url(url)
+            if '#' in url:
+                raise OauthistValidationError('%r contains a fragment' % url)
         self.attrs['redirect_urls'] = redirect_urls
+        self.__dict__.pop('_redirect_uri_index', None)
 
         # check for client secret
         client_secret = self.attrs.get('client_secret')
@@ -75,6 +85,35 @@ class Client(ormist.TaggedAttrsModel):
             client_secret = ormist.random_string(CLIENT_SECRET_LENGTH)
         self.attrs['client_secret'] = client_secret
 
+    @instrumented('Client.save')
+    def save(self, *args, **kwargs):
+        """
+        Validate and save the client
+
+        Saving costs one extra round trip: the version of clients registry is
+        increased (see :class:`ClientCache`). It's done even if the client
+        cache is turned off in this process, as other processes (for
+        example, API servers, when the client is edited with the command
+        line tool) can cache clients.
+        """
+        ret = super(Client, self).save(*args, **kwargs)
+        ClientCache.bump_version()
+        if framework.client_cache is not None:
+            framework.client_cache.delete(self.id)
+        return ret
+
+    @instrumented('Client.delete')
+    def delete(self):
+        """
+        Delete the client
+
+        As with :meth:`save`, the version of clients registry is increased
+        with one extra round trip.
+        """
+        super(Client, self).delete()
+        ClientCache.bump_version()
+        revoke('client', self.id)
+
     def check_redirect_uri(self, redirect_uri):
         """
         Check redirect uri for correctness
@@ -92,6 +131,9 @@ class Client(ormist.TaggedAttrsModel):
            contents of the database. If the match is found, then return the
            uri, otherwise raise invalid_redirect_uri exception
 
+        Redirect URIs with a fragment are never accepted (see
+        :rfc:`6749#3.1.2`).
+
         :param redirect_uri: string with redirect URI
         :return: validated reedirect URL, either the same as passed, or the
                  one read from object property
@@ -103,7 +145,196 @@ class Client(ormist.TaggedAttrsModel):
             else:
                 raise OauthistValidationError('missing_redirect_uri')
 
-        if redirect_uri not in self.redirect_urls:
+        index = self.get_redirect_uri_index()
+        if not index.match(redirect_uri, framework.redirect_uri_matching):
             raise OauthistValidationError('invalid_redirect_uri')
         return redirect_uri
 
+    def get_redirect_uri_index(self):
+        """
+        Return :class:`RedirectURIIndex` of client redirect URLs
+
+        The index is built once per object, and rebuilt when the client is
+        saved.
+        """
+        # bypass attribute handlers of the model
+        index = self.__dict__.get('_redirect_uri_index')
+        if index is None:
+            index = RedirectURIIndex(self.redirect_urls)
+            self.__dict__['_redirect_uri_index'] = index
+        return index
+
+
+class RedirectURIIndex(object):
+    """
+    Index of client redirect URLs
+
+    Transient object, making it possible to check redirect URI, passed by
+    client, in constant time, no matter how many redirect URLs the client has.
+    """
+
+    def __init__(self, redirect_urls):
+        self.urls = frozenset(normalize_url(url) for url in redirect_urls)
+        self.origins = frozenset(self.get_origin(url) for url in self.urls)
+
+    @staticmethod
+    def get_origin(url):
+        chunks = urlparse(url)
+        return '%s://%s' % (chunks[0], chunks[1])
+
+    def match(self, redirect_uri, matching='exact'):
+        """
+        Return True if redirect URI matches one of registered URLs
+
+        :param matching: "exact", "prefix" or "host"
+        """
+        if '#' in redirect_uri:
+            return False
+        url = normalize_url(redirect_uri)
+        if url in self.urls:
+            return True
+        if matching == 'host':
+            return self.get_origin(url) in self.origins
+        if matching == 'prefix':
+            return self.match_prefix(url)
+        return False
+
+    def match_prefix(self, url):
+        origin = self.get_origin(url)
+        if origin not in self.origins:
+            return False
+        path = urlparse(url)[2]
+        if not self.is_safe_path(path):
+            return False
+        segments = path.split('/')
+        # try every path prefix, from the longest to the shortest
+        for i in range(len(segments), 0, -1):
+            path = '/'.join(segments[:i])
+            if origin + path in self.urls or origin + path + '/' in self.urls:
+                return True
+        return False
+
+    @staticmethod
+    def is_safe_path(path):
+        """
+        Return False if browsers can resolve the path to a location outside
+        of its own prefix
+
+        Dot segments are looked for in the percent-decoded path, so that
+        "%2e%2e" is rejected as well as "..". Backslashes (treated as
+        slashes by browsers), encoded slashes and double encoding are
+        rejected too.
+        """
+        if '\\' in path:
+            return False
+        decoded = unquote(path)
+        if '\\' in decoded or '%' in decoded:
+            return False
+        if decoded.count('/') != path.count('/'):
+            return False
+        segments = decoded.split('/')
+        return '..' not in segments and '.' not in segments
+
+
+class ClientCache(object):
+    """
+    In-process cache of clients with versioned invalidation.
+
+    Transient object, created by :func:`oauthist.configure` if
+    ``client_cache_size`` is set.
+
+    Every time a client is saved or deleted, the global version counter is
+    increased in Redis. Every process checks the counter at most once per
+    ``staleness`` seconds, and drops its cache if the counter has changed.
+    The counter is increased by every process, whether it has the cache or
+    not, which costs one INCR per change of a client. Clients are changed
+    rarely, so the extra round trip doesn't matter in practice.
+
+    Cached clients are shared between requests, and must not be modified.
+    """
+
+    VERSION_KEY = redis_key('clients', 'version')
+
+    def __init__(self, max_size=1000, ttl=300, staleness=1):
+        self.cache = LRUCache(max_size, ttl, ttl)
+        self.staleness = staleness
+        self.version = None
+        self.checked_at = 0
+
+    @staticmethod
+    def bump_version():
+        """
+        Increase the version of clients registry
+        """
+        get_redis().incr(ClientCache.VERSION_KEY)
+
+    def is_stale(self):
+        """
+        Return True, if the version of clients registry must be checked
+        again
+        """
+        return time.time() - self.checked_at >= self.staleness
+
+    def set_version(self, version):
+        """
+        Remember the version of clients registry, fetched from Redis, and
+        drop the cache if it has been changed since the last check
+        """
+        self.checked_at = time.time()
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+
+    def revalidate(self):
+        """
+        Drop the cache if clients registry has been changed since the last
+        check
+        """
+        if self.is_stale():
+            self.set_version(get_redis().get(ClientCache.VERSION_KEY))
+
+    def lookup(self, client_id, revalidate=True):
+        """
+        Find the client in the cache
+
+        :param revalidate: if False, the version of clients registry is not
+                           checked (the caller is responsible for it)
+        :return: tuple ``(found, client)``
+        """
+        if revalidate:
+            self.revalidate()
+        found, client = self.cache.lookup(client_id)
+        incr('client_cache.hit' if found else 'client_cache.miss')
+        return found, client
+
+    def store(self, client_id, client):
+        """
+        Store the client (or None, if client is not found) in the cache
+        """
+        self.cache.set(client_id, client)
+
+    def delete(self, client_id):
+        """
+        Remove the client from the cache
+        """
+        self.cache.delete(client_id)
+
+
+def get_client(client_id):
+    """
+    Find client by its id
+
+    If client cache is turned on with :func:`oauthist.configure`, the client
+    is looked up in the cache first. If ``read_systems`` are configured, the
+    client is read from one of them.
+
+    :return: Client instance or None
+    """
+    cache = framework.client_cache
+    if cache is None or not client_id:
+        return read_object(Client, client_id)
+    found, client = cache.lookup(client_id)
+    if not found:
+        client = read_object(Client, client_id)
+        cache.store(client_id, client)
+    return client
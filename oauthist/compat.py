@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import sys
 
+from collections import OrderedDict
+
 #--- py3k compatibility (copied and inspired by six)
 PY3 = sys.version_info[0] == 3
 if PY3:
-    from urllib.parse import urlparse, urlunparse, urlencode, parse_qsl
+    from urllib.parse import urlparse, urlunparse, urlencode, parse_qsl, unquote_plus, unquote
     xrange = range
     text = str
     binary = bytes
@@ -12,14 +14,27 @@ if PY3:
         return s.encode("latin-1")
 else:
     from urlparse import urlparse, urlunparse, parse_qsl
-    from urllib import urlencode
+    from urllib import urlencode, unquote_plus, unquote
     xrange = xrange
     text = unicode
     binary = str
     def b(s):
         return str(s)
 
+string_types = (text, binary)
+
 def u(b):
     if isinstance(b, binary):
         return b.decode('latin-1')
     return b
+
+try:
+    from hmac import compare_digest
+except ImportError:  # python < 2.7.7
+    def compare_digest(a, b):
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(bytearray(a), bytearray(b)):
+            result |= x ^ y
+        return result == 0
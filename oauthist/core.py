@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
+import json
 import redis
+import hashlib
 import ormist
+import itertools
+from oauthist.cache import LRUCache
+from oauthist.utils import HashRing
+from oauthist.compat import string_types, binary
 
 CLIENT_ID_LENGTH = 16
 CLIENT_SECRET_LENGTH = 64
@@ -16,13 +22,43 @@ PUBLIC_CLIENTS = ('user-agent', 'native')
 # are thread-safe.
 class framework(object):
     scopes = None
+    scope_set = frozenset()
+    scope_bits = {}
     authorization_code_timeout = None
     access_token_timeout = None
     ormist_system = 'default'
+    access_token_cache = None
+    client_cache = None
+    introspection_cache = None
+    redirect_uri_matching = 'exact'
+    revocation_channel = None
+    access_token_secret = None
+    signed_token_denylist = False
+    denylist_ring = None
+    read_systems = None
+    refresh_tokens = False
+    refresh_token_timeout = None
+    json_encoder = None
+    rate_limits = None
+    error_bodies = {}
+    read_counter = itertools.count()
+    token_attrs = None
+    track_token_usage = False
+    object_serializer = None
 
 
 def configure(ormist_system='default', scopes=None, authorization_code_timeout=3600,
-              access_token_timeout=None):
+              access_token_timeout=None, access_token_cache_size=None,
+              access_token_cache_ttl=60, access_token_cache_negative_ttl=5,
+              revocation_channel=None, access_token_secret=None,
+              signed_token_denylist=False, client_cache_size=None,
+              client_cache_ttl=300, client_cache_staleness=1,
+              redirect_uri_matching='exact', introspection_cache_size=None,
+              introspection_cache_ttl=5, token_attrs=None,
+              denylist_systems=None, read_systems=None, refresh_tokens=False,
+              refresh_token_timeout=30 * 86400, json_encoder=None,
+              rate_limits=None, track_token_usage=False,
+              object_serializer=None):
 
     """
     Configure oauthist framework
@@ -35,28 +71,364 @@ def configure(ormist_system='default', scopes=None, authorization_code_timeout=3
     :param access_code_timeout: expiration timeout of access token
                                 (by default ``None`` which means that token
                                 never expires unless explicitly revoked)
+    :param access_token_cache_size: if set, verified access tokens are cached
+                                    in the memory of the process. The value
+                                    defines the maximum number of cached
+                                    tokens (by default ``None`` which means
+                                    that the cache is turned off)
+    :param access_token_cache_ttl: maximum time in seconds the access token
+                                   is kept in the cache. Tokens which expire
+                                   in the database earlier leave the cache
+                                   earlier too.
+    :param access_token_cache_negative_ttl: time in seconds the information
+                                            about non-existent token is kept
+                                            in the cache
+    :param revocation_channel: name of the Redis pub/sub channel. If set,
+                               every deleted access token or client is
+                               announced there, so that
+                               :class:`RevocationListener` instances in other
+                               processes could evict them from their caches
+    :param access_token_secret: if set, access tokens are issued as
+                                self-contained signed strings
+                                (:class:`SignedAccessToken`) instead of opaque
+                                ids of objects stored in Redis. Can be a
+                                string or a list of strings: the first secret
+                                is used to sign new tokens, all of them are
+                                accepted while verifying (handy to rotate
+                                secrets).
+    :param signed_token_denylist: if True, revoked signed tokens are recorded
+                                  in Redis, and every verification of the
+                                  signed token checks for them. By default
+                                  signed tokens are verified without Redis,
+                                  and can't be revoked before they expire.
+    :param denylist_systems: list of names of ormist systems to distribute
+                             the denylist of revoked signed tokens across.
+                             Every token is assigned to one of them by
+                             consistent hashing of its unique id. By default
+                             the denylist is stored in the ``ormist_system``.
+                             Only the denylist is distributed: clients,
+                             codes, stored access tokens and refresh tokens
+                             always live in the ``ormist_system``.
+    :param read_systems: list of names of ormist systems (usually, Redis
+                         replicas), which are used in round-robin fashion to
+                         read access tokens and clients. Objects not found
+                         in the replica (for example, because they have just
+                         been created) are read from the ``ormist_system``.
+                         Keep in mind that a replica lagging behind can
+                         report a just deleted token as valid.
+    :param refresh_tokens: if True, refresh tokens are issued along with
+                           access tokens (see
+                           :class:`RefreshExchangeRequest`). Makes sense with
+                           short-lived access tokens.
+    :param refresh_token_timeout: expiration timeout of refresh tokens in
+                                  seconds (30 days by default). ``None``
+                                  means that refresh tokens never expire.
+    :param json_encoder: function serializing response content to JSON
+                         (string or bytes), for example ``ujson.dumps`` or
+                         ``orjson.dumps``. By default ``json.dumps`` is
+                         used.
+    :param rate_limits: dict, defining rate limits of password exchange
+                        requests (see :mod:`oauthist.ratelimit`). Keys are
+                        "client_id", "username" and "remote_addr", values
+                        are ``(limit, window)`` tuples: maximum number of
+                        requests with the same value of the attribute per
+                        window of the given number of seconds. By default
+                        requests aren't rate limited.
+    :param client_cache_size: if set, clients are cached in the memory of the
+                              process. The value defines the maximum number
+                              of cached clients (by default ``None`` which
+                              means that the cache is turned off)
+    :param client_cache_ttl: maximum time in seconds the client is kept in
+                             the cache
+    :param client_cache_staleness: every time the client is saved or deleted,
+                                   the version of clients registry is
+                                   increased in Redis, and processes drop
+                                   their caches. Processes check the version
+                                   at most once per this number of seconds.
+                                   In other words, it's the time during which
+                                   outdated clients can be used. The version
+                                   is increased by every process, even with
+                                   the cache turned off, so saving or
+                                   deleting the client always costs one
+                                   extra round trip.
+    :param redirect_uri_matching: how the redirect URI, passed by client, is
+                                  matched against registered redirect URLs:
+                                  "exact" (URLs must be equal after
+                                  normalization), "prefix" (registered URL
+                                  must be a prefix of the path of redirect
+                                  URI) or "host" (scheme, host and port must
+                                  match)
+    :param introspection_cache_size: if set, responses of
+                                     :class:`IntrospectionRequest` are cached
+                                     in the memory of the process. The value
+                                     defines the maximum number of cached
+                                     responses (by default ``None`` which
+                                     means that the cache is turned off)
+    :param introspection_cache_ttl: maximum time in seconds the
+                                    introspection response is kept in the
+                                    cache
+    :param token_attrs: list of names of extra attributes, which are copied to
+                        access tokens from authorization codes and from user
+                        attributes, returned by ``verify_requisites``. Every
+                        attribute takes memory in Redis for every live token,
+                        so it makes sense to keep only those which protected
+                        resources actually use. By default ``None`` which
+                        means that all attributes are copied. Attributes
+                        ``client_id``, ``scope``, ``user_id`` and
+                        ``username``, as well as attributes passed
+                        explicitly to ``exchange_for_token``, are always
+                        stored.
+    :param track_token_usage: if True, the time of the last use of every
+                              access token is recorded in Redis (on issue
+                              and every time the token is read from the
+                              database), so that tokens, which are not
+                              used anymore, can be deleted with
+                              :func:`oauthist.reaper.reap`. With the access
+                              token cache, reads are recorded on cache
+                              misses only, so the time is precise to
+                              ``access_token_cache_ttl``.
+    :param object_serializer: object with ``dumps(attrs)`` and
+                              ``loads(value)`` methods, serializing
+                              attributes of access tokens, refresh tokens
+                              and authorization codes, for example
+                              :class:`oauthist.storage.CompactSerializer`.
+                              By default objects are pickled. Pickled
+                              objects stay readable after the serializer is
+                              set up.
     """
     framework.scopes = scopes
+    framework.scope_set = frozenset(scopes or ())
+    framework.scope_bits = dict((scope, 1 << i)
+                                for i, scope in enumerate(scopes or ()))
     framework.authorization_code_timeout = authorization_code_timeout
     framework.access_token_timeout = access_token_timeout
     framework.ormist_system = ormist_system
-    from oauthist.client import Client
+    if access_token_cache_size:
+        framework.access_token_cache = LRUCache(access_token_cache_size,
+                                                access_token_cache_ttl,
+                                                access_token_cache_negative_ttl)
+    else:
+        framework.access_token_cache = None
+    framework.revocation_channel = revocation_channel
+    if isinstance(access_token_secret, (list, tuple)):
+        framework.access_token_secret = tuple(access_token_secret)
+    elif access_token_secret:
+        framework.access_token_secret = (access_token_secret, )
+    else:
+        framework.access_token_secret = None
+    framework.signed_token_denylist = signed_token_denylist
+    framework.refresh_tokens = refresh_tokens
+    framework.json_encoder = json_encoder
+    framework.rate_limits = rate_limits
+    framework.track_token_usage = track_token_usage
+    framework.object_serializer = object_serializer
+    framework.error_bodies = {}
+    framework.refresh_token_timeout = refresh_token_timeout
+    if read_systems:
+        framework.read_systems = tuple(read_systems)
+    else:
+        framework.read_systems = None
+    if denylist_systems:
+        framework.denylist_ring = HashRing(denylist_systems)
+    else:
+        framework.denylist_ring = None
+    framework.redirect_uri_matching = redirect_uri_matching
+    if token_attrs is None:
+        framework.token_attrs = None
+    else:
+        framework.token_attrs = frozenset(token_attrs)
+    if introspection_cache_size:
+        framework.introspection_cache = LRUCache(introspection_cache_size,
+                                                 introspection_cache_ttl,
+                                                 introspection_cache_ttl)
+    else:
+        framework.introspection_cache = None
+    from oauthist.client import Client, ClientCache
+    if client_cache_size:
+        framework.client_cache = ClientCache(client_cache_size,
+                                             client_cache_ttl,
+                                             client_cache_staleness)
+    else:
+        framework.client_cache = None
     from oauthist.authorization_code import Code
-    from oauthist.access_token import AccessToken
+    from oauthist.access_token import AccessToken, RefreshToken
     Client.objects.set_system(ormist_system)
     Code.objects.set_system(ormist_system)
     AccessToken.objects.set_system(ormist_system)
+    RefreshToken.objects.set_system(ormist_system)
+
+
+#--- scopes
+
+def scope_mask(scopes):
+    """
+    Convert the list of scopes to integer bit mask
+
+    Every scope, passed to :func:`configure`, is assigned its own bit. Scopes,
+    unknown to the framework, are ignored.
+
+    :param scopes: space separated string or a list of scopes
+    :return: integer
+    """
+    if isinstance(scopes, string_types):
+        scopes = scopes.split()
+    mask = 0
+    bits = framework.scope_bits
+    for scope in scopes or ():
+        mask |= bits.get(scope, 0)
+    return mask
+
+
+class CompiledScopes(object):
+    """
+    List of scopes, precompiled to the bit mask.
+
+    Transient object, which you create once per API endpoint with
+    :func:`compile_scopes` and pass to
+    :meth:`ProtectedResourceRequest.verify_access_token`, so that scope checks
+    are performed with one integer operation.
+
+    .. code-block:: python
+
+        >>> USER_SCOPES = oauthist.compile_scopes('user_ro', 'user_rw')
+        >>> req.verify_access_token(USER_SCOPES)
+    """
+
+    def __init__(self, scopes):
+        self.names = frozenset(scopes)
+        self._bits = None
+        self._mask = None
+
+    @property
+    def mask(self):
+        """
+        Integer bit mask, or None, if some scopes are unknown to the framework
+        and can't be represented as bits
+        """
+        # recompile if the framework has been reconfigured since then
+        if self._bits is not framework.scope_bits:
+            self._bits = framework.scope_bits
+            if self.names.issubset(self._bits):
+                self._mask = scope_mask(self.names)
+            else:
+                self._mask = None
+        return self._mask
+
+
+def compile_scopes(*scopes):
+    """
+    Precompile the list of scopes to check access tokens against
+
+    :rtype: CompiledScopes
+    """
+    return CompiledScopes(scopes)
 
 
 #--- utility functions
 
+def get_redis():
+    """
+    Return Redis client of the ormist system which stores OAuth 2.0 objects
+    """
+    return ormist.get_redis(framework.ormist_system)
+
+
+def get_read_redis():
+    """
+    Return Redis client to read OAuth 2.0 objects from: the next one of
+    ``read_systems`` or the client of the primary ormist system, if they are
+    not configured
+    """
+    if not framework.read_systems:
+        return get_redis()
+    index = next(framework.read_counter) % len(framework.read_systems)
+    return ormist.get_redis(framework.read_systems[index])
+
+
+def encode_json(content):
+    """
+    Serialize content to JSON with the encoder, configured with
+    :func:`configure`
+
+    :return: bytes
+    """
+    body = (framework.json_encoder or json.dumps)(content)
+    if not isinstance(body, binary):
+        body = body.encode('utf-8')
+    return body
+
+
+class LuaScript(object):
+    """
+    Lua script, executed with EVALSHA
+
+    Create the script once, at the module level, and call it with the Redis
+    client of any ormist system (see also :func:`oauthist.aio.run_script`).
+    The script is sent to Redis with EVAL only if Redis doesn't have it in
+    its script cache (the first call, or the first call after restart).
+
+    .. code-block:: python
+
+        >>> INCR_SCRIPT = LuaScript("return redis.call('INCR', KEYS[1])")
+        >>> INCR_SCRIPT(get_redis(), keys=['counter'])
+        1
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def __call__(self, redis_client, keys=(), args=()):
+        params = list(keys) + list(args)
+        try:
+            return redis_client.evalsha(self.sha, len(keys), *params)
+        except redis.exceptions.NoScriptError:
+            return redis_client.eval(self.source, len(keys), *params)
+
+
+def redis_key(*chunks):
+    """
+    Return the name of Redis key, used by oauthist to store auxiliary data
+    (not ormist objects)
+
+    .. code-block:: python
+
+        >>> redis_key('revoked', '1234')
+        'oauthist:revoked:1234'
+    """
+    return ':'.join(('oauthist', ) + tuple(str(chunk) for chunk in chunks))
+
+
 def full_cleanup():
     """
-    Cleanup the Redis database completely
+    Cleanup the Redis database completely: remove ormist objects and all
+    auxiliary keys (see :func:`redis_key`), including the denylist in
+    ``denylist_systems``
     """
     from oauthist.client import Client
     from oauthist.authorization_code import Code
-    from oauthist.access_token import AccessToken
+    from oauthist.access_token import AccessToken, RefreshToken
     Client.objects.full_cleanup()
     Code.objects.full_cleanup()
     AccessToken.objects.full_cleanup()
+    RefreshToken.objects.full_cleanup()
+    systems = [framework.ormist_system]
+    if framework.denylist_ring is not None:
+        systems += [system for system in framework.denylist_ring.nodes
+                    if system not in systems]
+    for system in systems:
+        delete_keys(ormist.get_redis(system), redis_key('*'))
+
+
+def delete_keys(redis_client, pattern, batch_size=500):
+    """
+    Delete all keys, matching the pattern, with SCAN and batched DEL
+    """
+    batch = []
+    for key in redis_client.scan_iter(match=pattern, count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            redis_client.delete(*batch)
+            batch = []
+    if batch:
+        redis_client.delete(*batch)
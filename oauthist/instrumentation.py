@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation hooks
+
+oauthist reports timings of its operations, number of Redis commands it
+issues and cache hits to listeners, registered with :func:`add_listener`.
+
+Listener is a callable accepting three arguments: kind of the event
+("timing" or "count"), name of the operation or counter, and the value
+(duration in seconds for timings, increment for counters).
+
+This is how you can send everything to statsd:
+
+.. code-block:: python
+
+    >>> def statsd_listener(kind, name, value):
+    ...     if kind == 'timing':
+    ...         statsd.timing('oauthist.' + name, value * 1000)
+    ...     else:
+    ...         statsd.incr('oauthist.' + name, value)
+    >>> oauthist.add_listener(statsd_listener)
+
+Reported timings are named after the class and the method
+(``AccessToken.save``, ``CodeExchangeRequest.exchange_for_token``,
+``Client.get``, etc). Counters are ``redis.commands``,
+``access_token_cache.hit``, ``access_token_cache.miss``,
+``client_cache.hit``, ``client_cache.miss``, ``introspection_cache.hit``,
+``introspection_cache.miss`` and ``ratelimit.rejected``.
+
+Only the Redis commands, issued by oauthist itself and by ormist lookups of
+single objects, are counted. Commands, issued by ormist while saving and
+deleting objects, are not.
+
+When there are no listeners, instrumentation costs almost nothing.
+"""
+import functools
+import contextlib
+import timeit
+
+_listeners = []
+timer = timeit.default_timer
+
+
+def add_listener(listener):
+    """
+    Register a listener for instrumentation events
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """
+    Unregister a listener, registered with :func:`add_listener`
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def emit(kind, name, value):
+    for listener in _listeners:
+        listener(kind, name, value)
+
+
+def incr(name, value=1):
+    """
+    Report a counter increment
+    """
+    if _listeners:
+        emit('count', name, value)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Context manager, reporting the time spent in its block
+    """
+    if not _listeners:
+        yield
+        return
+    started = timer()
+    try:
+        yield
+    finally:
+        emit('timing', name, timer() - started)
+
+
+def instrumented(name):
+    """
+    Decorator, reporting the time spent in the function
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _listeners:
+                return func(*args, **kwargs)
+            started = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                emit('timing', name, timer() - started)
+        return wrapper
+    return decorator
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import base64
+import hashlib
+from oauthist.core import framework, encode_json
+from oauthist.client import get_client
+from oauthist.storage import read_objects_with_ttl
+from oauthist.access_token import (AccessToken, GenericAccessTokenRequest,
+                                   AccessTokenError, lookup_access_tokens,
+                                   store_access_tokens, touch_access_tokens,
+                                   get_denylist_candidates, check_denylist)
+from oauthist.errors import OauthistValidationError
+from oauthist.instrumentation import instrumented, incr
+from oauthist.compat import b, u, unquote_plus
+
+INTROSPECTION_HEADERS = {
+    'Content-Type': 'application/json;charset=UTF-8',
+    'Cache-Control': 'no-cache',
+}
+
+INVALID_CLIENT_HEADERS = dict(INTROSPECTION_HEADERS, **{
+    'WWW-Authenticate': 'Basic realm="oauthist"',
+})
+
+
+class IntrospectionRequest(GenericAccessTokenRequest):
+    """
+    Token introspection request, as defined in :rfc:`7662`
+
+    Transient object, used by protected resources (usually, non-Python
+    services) to ask the authorization server whether access token is
+    active, and what its scope, client and owner are.
+
+    The caller must authenticate itself as a registered client, either with
+    HTTP Basic authentication, or with ``client_id`` and ``client_secret``
+    parameters in the request body.
+
+    .. code-block:: python
+
+        @app.route('/introspect', methods=['POST'])
+        def introspect():
+            req = IntrospectionRequest.from_werkzeug(request)
+            if req.is_invalid():
+                return req.get_error().to_werkzeug_response()
+            return req.to_werkzeug_response(
+                if_none_match=request.headers.get('If-None-Match'))
+
+    If ``introspection_cache_size`` is set with :func:`oauthist.configure`,
+    response bodies are cached in the memory of the process for a short time
+    (``introspection_cache_ttl``), and are served with ETag header, so that
+    callers can use conditional requests.
+    """
+
+    @classmethod
+    def from_werkzeug(cls, request):
+        """
+        Create IntrospectionRequest instance from Werkzeug/Flask request
+
+        :rtype IntrospectionRequest:
+        """
+        client_id = request.form.get('client_id')
+        client_secret = request.form.get('client_secret')
+        authorization = request.headers.get('Authorization')
+        if authorization:
+            client_id, client_secret = parse_basic_auth(authorization)
+        return cls(token=request.form.get('token'),
+                   token_type_hint=request.form.get('token_type_hint'),
+                   client_id=client_id, client_secret=client_secret)
+
+    def __init__(self, token=None, token_type_hint=None, client_id=None,
+                 client_secret=None):
+        """
+        Constructor for introspection request
+
+        :param token: access token string to introspect
+        :param token_type_hint: optional hint about the type of the token.
+                                Ignored, as only access tokens can be
+                                introspected.
+        :param client_id: id of the client, performing the request
+        :param client_secret: secret of the client, performing the request
+        """
+        self.token = token
+        self.token_type_hint = token_type_hint
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.error = None
+        self.valid = None
+
+    def check_invalid(self):
+        """
+        Raise :class:`OauthistValidationError`, if the request is invalid
+
+        The request is validated only once, and the result is remembered, so
+        that :meth:`get_response_body` doesn't look up the client again
+        after :meth:`is_invalid`.
+        """
+        if self.valid is None:
+            try:
+                self.validate()
+            except OauthistValidationError as e:
+                self.valid, self.error = False, str(e)
+            else:
+                self.valid = True
+        if not self.valid:
+            raise OauthistValidationError(self.error)
+
+    def validate(self):
+        if not self.token:
+            raise OauthistValidationError('invalid_request')
+        if not self.client_id or not self.client_secret:
+            raise OauthistValidationError('invalid_client')
+        client = get_client(self.client_id)
+        if not client or client.client_secret != self.client_secret:
+            raise OauthistValidationError('invalid_client')
+
+    def get_error(self):
+        """
+        Create and return IntrospectionError instance to pass to the caller
+        via HTTP
+
+        :rtype IntrospectionError:
+        """
+        return IntrospectionError(
+            super(IntrospectionRequest, self).get_error().error)
+
+    def get_json_content(self):
+        """
+        Return JSON content of the introspection response, as defined in
+        :rfc:`7662#2.2`
+        """
+        return json.loads(self.get_response_body()[0].decode('utf-8'))
+
+    @instrumented('IntrospectionRequest.get_response_body')
+    def get_response_body(self):
+        """
+        Return the tuple ``(body, etag)`` of the introspection response
+
+        The body is taken from the cache, if the cache is turned on.
+        """
+        self.check_invalid()
+        cache = framework.introspection_cache
+        if cache is not None:
+            found, entry = cache.lookup(self.token)
+            if found:
+                incr('introspection_cache.hit')
+                return entry[1], entry[2]
+            incr('introspection_cache.miss')
+
+        token_object, ttl = get_token_with_ttl(self.token)
+        content = get_introspection_content(token_object, ttl)
+        body = encode_json(content)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if cache is not None:
+            ttl = None
+            if 'exp' in content:
+                ttl = content['exp'] - int(time.time())
+            cache.set(self.token, (token_object, body, etag), ttl=ttl)
+        return body, etag
+
+    def to_werkzeug_response(self, if_none_match=None):
+        """
+        Return Werkzeug/Flask response object with introspection response
+
+        :param if_none_match: the value of If-None-Match request header. If
+                              it matches the ETag of the response, empty
+                              response with status 304 is returned.
+        """
+        from werkzeug.wrappers import Response
+        body, etag = self.get_response_body()
+        headers = dict(INTROSPECTION_HEADERS, ETag=etag)
+        if if_none_match and etag in [tag.strip() for tag in
+                                      if_none_match.split(',')]:
+            return Response(status=304, headers=headers)
+        return Response(body, headers=headers)
+
+
+class IntrospectionError(AccessTokenError):
+    """
+    Error of the introspection request
+
+    Failed client authentication ("invalid_client") is reported with status
+    401 and WWW-Authenticate header, as required by :rfc:`6749#5.2`, other
+    errors are reported with status 400.
+    """
+
+    def get_status(self):
+        if self.error == 'invalid_client':
+            return 401
+        return super(IntrospectionError, self).get_status()
+
+    def get_headers(self):
+        if self.error == 'invalid_client':
+            return INVALID_CLIENT_HEADERS
+        return super(IntrospectionError, self).get_headers()
+
+
+def get_token_with_ttl(access_token):
+    """
+    Find access token along with its TTL
+
+    Stored tokens are fetched along with their TTLs with one round trip.
+    Only tokens, taken from the access token cache, cost an extra query to
+    find out their TTL.
+
+    :return: tuple ``(token_object, ttl)``. ttl is None if the token is not
+             found or never expires.
+    """
+    found, missing = lookup_access_tokens([access_token])
+    if missing:
+        results = read_objects_with_ttl(AccessToken, missing)
+        touch_access_tokens([token_object for token_object, _ in results])
+        store_access_tokens(found, missing, results)
+        return results[0]
+    token_object = found[access_token]
+    signed = [signed_token for _, signed_token in get_denylist_candidates(found)]
+    if token_object is None or any(check_denylist(signed)):
+        return None, None
+    return token_object, token_object.ttl()
+
+
+def get_introspection_content(token_object, ttl=None):
+    """
+    Return JSON content of the introspection response for the access token
+    object (or None, if token is not found)
+
+    :param ttl: number of seconds the token expires in, or None if it never
+                expires
+    """
+    if token_object is None:
+        return {'active': False}
+    content = {
+        'active': True,
+        'token_type': 'bearer',
+        'scope': token_object.attrs.get('scope'),
+        'client_id': token_object.attrs.get('client_id'),
+    }
+    if token_object.attrs.get('username') is not None:
+        content['username'] = token_object.attrs['username']
+    if token_object.attrs.get('user_id') is not None:
+        content['sub'] = str(token_object.attrs['user_id'])
+    if ttl is not None:
+        content['exp'] = int(time.time()) + ttl
+    return content
+
+
+def parse_basic_auth(authorization):
+    """
+    Parse the value of Authorization header with HTTP Basic credentials, as
+    described in :rfc:`6749#2.3.1`
+
+    :return: tuple ``(client_id, client_secret)`` or ``(None, None)``
+    """
+    chunks = authorization.split(' ', 1)
+    if len(chunks) != 2 or chunks[0] != 'Basic':
+        return None, None
+    try:
+        credentials = u(base64.b64decode(b(chunks[1].strip())))
+    except (TypeError, ValueError):
+        return None, None
+    client_id, sep, client_secret = credentials.partition(':')
+    if not sep:
+        return None, None
+    return unquote_plus(client_id), unquote_plus(client_secret)
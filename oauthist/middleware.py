@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+WSGI middleware for bearer token authentication
+
+The middleware verifies access tokens, passed in the ``Authorization:``
+header (see :rfc:`6750#2.1`), before the request reaches the application, and
+puts verified :class:`AccessToken` to the WSGI environ. The header is parsed
+straight from the environ, without building a request object.
+
+.. code-block:: python
+
+    >>> app = BearerMiddleware(app, scopes=[], routes=[
+    ...     ('/static/', None),
+    ...     ('/api/projects/', ['projects_ro', 'projects_rw']),
+    ... ])
+
+    >>> def view(environ, start_response):
+    ...     token = environ['oauthist.access_token']
+
+Scope requirements are defined per route, as a list of ``(path_prefix,
+scopes)`` tuples. The longest matching prefix wins. Paths which don't match
+any route use the default ``scopes``. Scopes can be:
+
+- ``None``: the route is public, tokens aren't verified at all
+- empty list: a valid token is required, whatever its scope is
+- list of scopes: the token must be valid for at least one of them
+
+Requests without a token get "401 Unauthorized" response, requests with
+invalid tokens get "401 Unauthorized" with "invalid_token" error, and
+requests with tokens which aren't valid for the route scopes get
+"403 Forbidden" with "insufficient_scope" error.
+
+See :class:`oauthist.aio.BearerMiddleware` for the ASGI version.
+"""
+from oauthist.core import compile_scopes, encode_json
+from oauthist.access_token import get_access_token, ProtectedResourceRequest
+from oauthist.errors import InvalidAccessToken
+
+ENVIRON_KEY = 'oauthist.access_token'
+
+STATUS_LINES = {
+    401: '401 Unauthorized',
+    403: '403 Forbidden',
+}
+
+
+def get_bearer_token(authorization):
+    """
+    Extract access token string from the value of ``Authorization:`` header
+
+    :return: access token string or None
+    """
+    if not authorization:
+        return None
+    chunks = authorization.split(' ', 1)
+    if len(chunks) != 2 or chunks[0] != 'Bearer':
+        return None
+    return chunks[1].strip() or None
+
+
+def compile_route_scopes(scopes):
+    """
+    Convert scope requirements of the route to the tuple of arguments for
+    :meth:`ProtectedResourceRequest.check_access_token` (or None for public
+    routes)
+    """
+    if scopes is None:
+        return None
+    if not scopes:
+        return ()
+    return (compile_scopes(*scopes), )
+
+
+def get_auth_error(access_token, token_object, scopes):
+    """
+    Check the access token for the route
+
+    :param access_token: access token string or None
+    :param token_object: access token object, found by the string, or None
+    :param scopes: compiled scopes of the route
+    :return: None, if the token is valid, or ``(status, error)`` tuple
+    """
+    if not access_token:
+        return 401, None
+    if token_object is None:
+        return 401, 'invalid_token'
+    try:
+        ProtectedResourceRequest.check_access_token(token_object, *scopes)
+    except InvalidAccessToken:
+        return 403, 'insufficient_scope'
+    return None
+
+
+def get_error_response(status, error):
+    """
+    Return ``(headers, body)`` of the response, as defined in
+    :rfc:`6750#3`. Headers are the list of ``(name, value)`` tuples.
+    """
+    if error is None:
+        return [('WWW-Authenticate', 'Bearer')], b''
+    headers = [
+        ('WWW-Authenticate', 'Bearer error="%s"' % error),
+        ('Content-Type', 'application/json;charset=UTF-8'),
+    ]
+    return headers, encode_json({'error': error})
+
+
+class RouteScopes(object):
+    """
+    Scope requirements of routes, matched by path prefixes
+
+    :param scopes: default scope requirements
+    :param routes: list of ``(path_prefix, scopes)`` tuples
+    """
+
+    def __init__(self, scopes=None, routes=None):
+        self.default = compile_route_scopes(scopes)
+        self.routes = sorted(((prefix, compile_route_scopes(route_scopes))
+                              for prefix, route_scopes in (routes or ())),
+                             key=lambda route: -len(route[0]))
+
+    def match(self, path):
+        """
+        Return compiled scopes of the route for the path
+        """
+        for prefix, scopes in self.routes:
+            if path.startswith(prefix):
+                return scopes
+        return self.default
+
+
+class BearerMiddleware(object):
+    """
+    WSGI middleware, verifying bearer tokens
+
+    :param app: WSGI application
+    :param scopes: default scope requirements (by default, None, which means
+                   that routes are public unless they are listed in
+                   ``routes``)
+    :param routes: list of ``(path_prefix, scopes)`` tuples
+    :param environ_key: the key of WSGI environ to put verified token to
+    """
+
+    def __init__(self, app, scopes=None, routes=None, environ_key=ENVIRON_KEY):
+        self.app = app
+        self.route_scopes = RouteScopes(scopes, routes)
+        self.environ_key = environ_key
+
+    def __call__(self, environ, start_response):
+        scopes = self.route_scopes.match(environ.get('PATH_INFO', ''))
+        if scopes is None:
+            return self.app(environ, start_response)
+        access_token = get_bearer_token(environ.get('HTTP_AUTHORIZATION'))
+        token_object = None
+        if access_token:
+            token_object = get_access_token(access_token)
+        error = get_auth_error(access_token, token_object, scopes)
+        if error is not None:
+            status, error_code = error
+            headers, body = get_error_response(status, error_code)
+            headers.append(('Content-Length', str(len(body))))
+            start_response(STATUS_LINES[status], headers)
+            return [body]
+        environ[self.environ_key] = token_object
+        return self.app(environ, start_response)
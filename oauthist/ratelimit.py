@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Rate limiting of the token endpoint
+
+Password exchange requests are counted in sliding windows, stored in Redis
+as sorted sets of request timestamps. There is a window for every rate
+limited attribute of the request (``client_id``, ``username`` and
+``remote_addr``), and limits are set up with ``rate_limits`` option of
+:func:`oauthist.configure`:
+
+.. code-block:: python
+
+    >>> oauthist.configure(rate_limits={
+    ...     'username': (5, 60),        # 5 attempts per minute per user
+    ...     'remote_addr': (100, 60),   # 100 attempts per minute per IP
+    ... })
+
+All windows of the request are checked and updated with one Lua script, so
+the check costs one round trip. Requests rejected by the limiter are not
+counted.
+"""
+import time
+import ormist
+from oauthist.core import framework, get_redis, redis_key, LuaScript
+from oauthist.instrumentation import timed, incr
+
+#: attributes of the request which can be rate limited
+RATE_LIMITED_ATTRS = ('client_id', 'username', 'remote_addr')
+
+# KEYS: sorted sets of request timestamps, one per window
+# ARGV: current time (ms), unique member, and (limit, window in ms) pairs
+RATE_LIMIT_SCRIPT = LuaScript("""
+local now = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i + 1])
+    local window = tonumber(ARGV[2 * i + 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        return 0
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, ARGV[2 * i + 2])
+end
+return 1
+""")
+
+
+def get_rate_limit_query(**values):
+    """
+    Return ``(keys, args)`` for the rate limit script, or None, if none of
+    the values is rate limited
+
+    :param values: values of rate limited attributes of the request
+    """
+    if not framework.rate_limits:
+        return None
+    keys = []
+    limits = []
+    for name in RATE_LIMITED_ATTRS:
+        value = values.get(name)
+        if not value or name not in framework.rate_limits:
+            continue
+        limit, window = framework.rate_limits[name]
+        keys.append(redis_key('ratelimit', name, value))
+        limits += [limit, int(window * 1000)]
+    if not keys:
+        return None
+    now = int(time.time() * 1000)
+    member = '%s:%s' % (now, ormist.random_string(8))
+    return keys, [now, member] + limits
+
+
+def check_rate_limit(**values):
+    """
+    Count the request and return True, if it doesn't exceed rate limits
+
+    :param values: values of rate limited attributes of the request
+                   (``client_id``, ``username``, ``remote_addr``)
+    """
+    query = get_rate_limit_query(**values)
+    if query is None:
+        return True
+    keys, args = query
+    with timed('ratelimit.check_rate_limit'):
+        incr('redis.commands')
+        allowed = bool(RATE_LIMIT_SCRIPT(get_redis(), keys=keys, args=args))
+    if not allowed:
+        incr('ratelimit.rejected')
+    return allowed
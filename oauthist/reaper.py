@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental cleanup of the database
+
+Access tokens, which never expire, stay in Redis even when their client is
+deleted, and ids of expired objects stay in secondary indexes of oauthist
+(see :func:`oauthist.revoke_tokens`). The reaper walks the database in small
+steps ("ticks") and removes such leftovers:
+
+- access tokens, refresh tokens and authorization codes of deleted clients
+- access tokens, which haven't been used for ``max_idle`` seconds. Requires
+  ``track_token_usage`` option of :func:`oauthist.configure`, idle tokens
+  are taken from the sorted set of the last use times, without the walk.
+- entries of secondary indexes, pointing to objects which don't exist
+  anymore
+
+Every tick inspects about ``budget`` keys or index entries with SCAN, SSCAN
+and ZSCAN commands, so Redis is never blocked for a long time. The position
+of the walk is stored in Redis, so the walk is resumed by the next tick,
+even if it's performed by another process.
+
+.. code-block:: python
+
+    >>> oauthist.configure(track_token_usage=True)
+    >>> while True:
+    ...     stats = reap(budget=1000, max_idle=90 * 86400)
+    ...     time.sleep(1)
+
+Only indexes, which oauthist maintains itself, are cleaned up: sets of
+access tokens and refresh token families of users and clients, and the
+sorted set of the last use times of access tokens. Tag indexes of clients
+are maintained by ormist, and are never touched.
+"""
+import time
+from oauthist.core import framework, get_redis, redis_key
+from oauthist.compat import u, text
+from oauthist.errors import OauthistRuntimeError
+from oauthist.storage import object_key, get_objects, claim_object
+from oauthist.client import Client
+from oauthist.authorization_code import Code
+from oauthist.access_token import (AccessToken, RefreshToken, LAST_USED_KEY,
+                                   revoke_refresh_family)
+
+STATE_KEY = redis_key('reaper', 'state')
+PENDING_KEY = redis_key('reaper', 'pending')
+
+#: models, objects of which are deleted along with their clients, in the
+#: order they are walked through
+CLIENT_MODELS = (AccessToken, RefreshToken, Code)
+
+PHASES = tuple(model_class.__name__ for model_class in CLIENT_MODELS) + (
+    'indexes', )
+
+
+def reap(budget=1000, max_idle=None):
+    """
+    Perform one tick of the cleanup
+
+    Idle tokens are deleted first. The rest of the budget is spent on the
+    walk, which consists of several phases: objects of every model of
+    :data:`CLIENT_MODELS` are inspected one model after another, then all
+    secondary indexes. When all phases are finished, the next tick starts the
+    walk from the beginning.
+
+    :param budget: approximate number of keys (or index entries) inspected
+                   by the tick
+    :param max_idle: if set, access tokens which haven't been used for this
+                     number of seconds are deleted
+    :return: dict with the number of ``inspected`` keys and index entries,
+             ``deleted`` objects and ``unindexed`` index entries, and
+             ``completed`` flag, which is True if the tick has finished the
+             walk
+    :raise: OauthistRuntimeError if ``max_idle`` is set, but
+            ``track_token_usage`` is not turned on
+    """
+    stats = {'inspected': 0, 'deleted': 0, 'unindexed': 0, 'completed': False}
+    if max_idle is not None:
+        if not framework.track_token_usage:
+            raise OauthistRuntimeError('Idle tokens can be reaped only with '
+                                       'track_token_usage turned on')
+        budget -= reap_idle_tokens(max_idle, budget, stats)
+        if budget <= 0:
+            return stats
+
+    redis_client = get_redis()
+    state = dict((u(key), u(value)) for key, value in
+                 redis_client.hgetall(STATE_KEY).items())
+    phase = state.get('phase', PHASES[0])
+    if phase not in PHASES:
+        phase, state = PHASES[0], {}
+    if phase == 'indexes':
+        if reap_indexes(state, budget, stats):
+            state = {'phase': PHASES[0], 'cursor': 0}
+            stats['completed'] = True
+    else:
+        model_class = CLIENT_MODELS[PHASES.index(phase)]
+        cursor = reap_objects(model_class, int(state.get('cursor', 0)),
+                              budget, stats)
+        if cursor == 0:
+            state = {'phase': PHASES[PHASES.index(phase) + 1], 'cursor': 0}
+        else:
+            state = dict(state, phase=phase, cursor=cursor)
+    pipe = redis_client.pipeline()
+    pipe.delete(STATE_KEY)
+    pipe.hset(STATE_KEY, mapping=state)
+    pipe.execute()
+    return stats
+
+
+def reset_reaper():
+    """
+    Forget the position of the walk, so that the next tick starts it from
+    the beginning
+    """
+    get_redis().delete(STATE_KEY, PENDING_KEY)
+
+
+def reap_idle_tokens(max_idle, budget, stats):
+    """
+    Delete access tokens, which haven't been used for ``max_idle`` seconds
+
+    :return: number of inspected tokens
+    """
+    redis_client = get_redis()
+    ids = [u(_id) for _id in redis_client.zrangebyscore(
+        LAST_USED_KEY, '-inf', int(time.time()) - max_idle, start=0,
+        num=budget)]
+    if not ids:
+        return 0
+    stats['inspected'] += len(ids)
+    tokens = get_objects(*[(AccessToken, _id) for _id in ids])
+    expired = []
+    for _id, token in zip(ids, tokens):
+        if token is None:
+            expired.append(_id)
+        else:
+            token.delete()
+            stats['deleted'] += 1
+    if expired:
+        redis_client.zrem(LAST_USED_KEY, *expired)
+        stats['unindexed'] += len(expired)
+    return len(ids)
+
+
+def reap_objects(model_class, cursor, budget, stats):
+    """
+    Inspect the next batch of objects of the model, and delete objects of
+    deleted clients
+
+    :return: new SCAN cursor (0, if all objects have been inspected)
+    """
+    prefix = object_key(model_class, '')
+    cursor, keys = get_redis().scan(cursor, match=prefix + '*', count=budget)
+    ids = [_id for _id in (u(key)[len(prefix):] for key in keys)
+           if _id and ':' not in _id]
+    if not ids:
+        return int(cursor)
+    stats['inspected'] += len(ids)
+    objects = [obj for obj in get_objects(*[(model_class, _id) for _id in ids])
+               if obj is not None]
+    missing_clients = find_missing_clients(
+        obj.attrs.get('client_id') for obj in objects)
+    for obj in objects:
+        client_id = obj.attrs.get('client_id')
+        if client_id is not None and text(client_id) in missing_clients:
+            delete_object(obj)
+            stats['deleted'] += 1
+    return int(cursor)
+
+
+def delete_object(obj):
+    """
+    Delete the object of the deleted client. Revocation of the client has
+    already been announced, so deletion is not announced.
+    """
+    if isinstance(obj, AccessToken):
+        obj.delete(announce=False)
+        return
+    if isinstance(obj, RefreshToken):
+        revoke_refresh_family(obj.attrs['family_id'])
+    claim_object(type(obj), obj.id)
+
+
+def find_missing_clients(client_ids):
+    """
+    Return the set of ids of clients which don't exist
+    """
+    client_ids = list(set(text(client_id) for client_id in client_ids
+                          if client_id is not None))
+    if not client_ids:
+        return set()
+    pipe = get_redis().pipeline(transaction=False)
+    for client_id in client_ids:
+        pipe.exists(object_key(Client, client_id))
+    return set(client_id for client_id, exists in
+               zip(client_ids, pipe.execute()) if not exists)
+
+
+def get_index_model(index_key):
+    """
+    Return the model, ids of objects of which are stored in the index with
+    the given key, or None, if the key is not an index of oauthist
+    """
+    if index_key == LAST_USED_KEY:
+        return AccessToken
+    if index_key.startswith(redis_key('tokens', '')):
+        return AccessToken
+    if index_key.startswith(redis_key('refresh_families', '')):
+        return RefreshToken
+    return None
+
+
+def get_member_key(index_key, member):
+    """
+    Return the name of the key which must exist for the member of the index
+    """
+    model_class = get_index_model(index_key)
+    if model_class is RefreshToken:
+        # refresh token indexes store ids of families
+        return RefreshToken.family_key(member)
+    return object_key(model_class, member)
+
+
+def find_indexes(keys):
+    """
+    Return the list of indexes (sets and sorted sets) among the keys,
+    returned by SCAN. Keys are returned as is, without decoding.
+    """
+    candidates = [key for key in keys if get_index_model(u(key)) is not None]
+    if not candidates:
+        return []
+    pipe = get_redis().pipeline(transaction=False)
+    for key in candidates:
+        pipe.type(key)
+    return [key for key, key_type in zip(candidates, pipe.execute())
+            if u(key_type) in ('set', 'zset')]
+
+
+def reap_indexes(state, budget, stats):
+    """
+    Inspect the next entries of secondary indexes, and remove entries of
+    objects which don't exist
+
+    Indexes are found with SCAN and put to the list of pending indexes,
+    which are then inspected one by one with SSCAN (or ZSCAN).
+
+    :param state: the state of the walk, updated in place
+    :return: True if all indexes have been inspected
+    """
+    redis_client = get_redis()
+    remaining = budget
+    while remaining > 0:
+        index_key = redis_client.lindex(PENDING_KEY, 0)
+        if index_key is None:
+            if state.get('scanned'):
+                return True
+            cursor, keys = redis_client.scan(int(state.get('cursor', 0)),
+                                             match=redis_key('*'),
+                                             count=remaining)
+            remaining -= max(len(keys), 1)
+            indexes = find_indexes(keys)
+            if indexes:
+                redis_client.rpush(PENDING_KEY, *indexes)
+            state['cursor'] = int(cursor)
+            if int(cursor) == 0:
+                state['scanned'] = 1
+            continue
+
+        index_cursor = int(state.get('index_cursor', 0))
+        if index_cursor == 0:
+            state['index_type'] = u(redis_client.type(index_key))
+        if state['index_type'] == 'zset':
+            index_cursor, pairs = redis_client.zscan(index_key, index_cursor,
+                                                     count=remaining)
+            members = [member for member, _ in pairs]
+        else:
+            index_cursor, members = redis_client.sscan(index_key, index_cursor,
+                                                       count=remaining)
+        remaining -= max(len(members), 1)
+        if members:
+            stats['inspected'] += len(members)
+            pipe = redis_client.pipeline(transaction=False)
+            for member in members:
+                pipe.exists(get_member_key(u(index_key), u(member)))
+            dead = [member for member, exists in
+                    zip(members, pipe.execute()) if not exists]
+            if dead:
+                if state['index_type'] == 'zset':
+                    redis_client.zrem(index_key, *dead)
+                else:
+                    redis_client.srem(index_key, *dead)
+                stats['unindexed'] += len(dead)
+        state['index_cursor'] = int(index_cursor)
+        if int(index_cursor) == 0:
+            redis_client.lpop(PENDING_KEY)
+    return False
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import redis
+from oauthist.core import framework, get_redis
+from oauthist.compat import u, text
+
+
+def revoke(kind, object_id):
+    """
+    Evict deleted object from the local cache and announce that it has been
+    deleted, so that other processes could evict it from their caches too.
+
+    Announcement is not sent unless ``revocation_channel`` is set up with
+    :func:`oauthist.configure`.
+
+    :param kind: type of revoked object: "token", "client" (all tokens
+                 of the client), "user" (all tokens of the user) or
+                 "user_client" (all tokens of the user for the client, the
+                 object id is "<user_id>:<client_id>")
+    :param object_id: id of the revoked object
+    """
+    evict(kind, object_id)
+    if framework.revocation_channel:
+        message = '%s:%s' % (kind, object_id)
+        get_redis().publish(framework.revocation_channel, message)
+
+
+def evict(kind, object_id):
+    """
+    Evict revoked object from local caches
+    """
+    object_id = text(object_id)
+    if kind == 'client' and framework.client_cache is not None:
+        framework.client_cache.delete(object_id)
+    if framework.access_token_cache is not None:
+        evict_tokens(framework.access_token_cache, kind, object_id,
+                     lambda value: value)
+    if framework.introspection_cache is not None:
+        # introspection cache stores (token, body, etag) tuples
+        evict_tokens(framework.introspection_cache, kind, object_id,
+                     lambda value: value[0])
+
+
+def evict_tokens(cache, kind, object_id, get_token):
+    """
+    Evict revoked tokens from the cache, where keys are token strings
+
+    :param get_token: function returning token object (or None) by the cache
+                      value
+    """
+    if kind == 'token':
+        cache.delete(object_id)
+        return
+    if kind == 'client':
+        get_owner = lambda token: text(token.attrs.get('client_id'))
+    elif kind == 'user':
+        get_owner = lambda token: text(token.attrs.get('user_id'))
+    elif kind == 'user_client':
+        get_owner = lambda token: '%s:%s' % (token.attrs.get('user_id'),
+                                             token.attrs.get('client_id'))
+    else:
+        return
+
+    def predicate(value):
+        token = get_token(value)
+        return token is not None and get_owner(token) == object_id
+    cache.delete_matching(predicate)
+
+
+def handle_revocation(message):
+    """
+    Handle the message, sent by :func:`revoke` from another process
+    """
+    kind, _, object_id = u(message).partition(':')
+    evict(kind, object_id)
+
+
+class RevocationListener(threading.Thread):
+    """
+    Background thread, listening for revocation messages and evicting revoked
+    objects from the local cache.
+
+    Start one listener per process, after the framework is configured.
+
+    .. code-block:: python
+
+        >>> oauthist.configure(access_token_cache_size=10000,
+        ...                    revocation_channel='oauthist:revocations')
+        >>> oauthist.RevocationListener().start()
+
+    If connection to Redis gets lost, the listener reconnects and drops the
+    whole local cache, as it could miss some messages in the meantime.
+
+    :param poll_timeout: how often (in seconds) the listener checks whether
+                         it was asked to stop
+    :param reconnect_timeout: how long (in seconds) to wait before
+                              reconnecting to Redis
+    """
+
+    def __init__(self, poll_timeout=1.0, reconnect_timeout=1.0):
+        super(RevocationListener, self).__init__(name='oauthist-revocations')
+        self.daemon = True
+        self.poll_timeout = poll_timeout
+        self.reconnect_timeout = reconnect_timeout
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """
+        Ask the listener to stop
+        """
+        self._stopped.set()
+
+    def run(self):
+        if not framework.revocation_channel:
+            return
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except redis.ConnectionError:
+                if framework.access_token_cache is not None:
+                    framework.access_token_cache.clear()
+                if framework.introspection_cache is not None:
+                    framework.introspection_cache.clear()
+                time.sleep(self.reconnect_timeout)
+
+    def listen(self):
+        pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(framework.revocation_channel)
+        try:
+            while not self._stopped.is_set():
+                message = pubsub.get_message(timeout=self.poll_timeout)
+                if message and message['type'] == 'message':
+                    handle_revocation(message['data'])
+        finally:
+            pubsub.close()
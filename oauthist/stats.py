@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Memory footprint of objects, stored in Redis
+
+Keyspaces of models are iterated over with SCAN (see
+:func:`oauthist.storage.scan_ids`) and inspected in pipelined batches, so
+that Redis is never blocked for a long time. Memory usage is sampled with
+``MEMORY USAGE`` command (requires Redis 4.0+) for every n-th key only.
+
+.. code-block:: python
+
+    >>> stats = collect_stats(AccessToken, owner_attrs=('client_id', ))
+    >>> stats.count, stats.estimated_memory()
+    (1000000, 112000000)
+    >>> stats.top_owners('client_id', 3)
+    [('client1', 700000), ('client2', 200000), ('client3', 100000)]
+
+Objects are counted by owners with :class:`SpaceSavingCounter`, so memory
+consumption doesn't depend on the number of distinct owners (users can be
+counted in millions). Counts of the largest owners are exact as long as
+there are no more than ``max_owners`` distinct owners, and are slightly
+overestimated otherwise.
+"""
+from oauthist.core import get_redis
+from oauthist.storage import object_key, scan_ids, load_object
+from oauthist.utils import chunks
+
+# upper bounds (in seconds) of TTL distribution buckets
+TTL_BUCKETS = (
+    (60, '<1m'),
+    (3600, '<1h'),
+    (86400, '<1d'),
+    (7 * 86400, '<7d'),
+    (30 * 86400, '<30d'),
+)
+TTL_BUCKET_LABELS = [label for _, label in TTL_BUCKETS] + ['>=30d', 'eternal']
+
+
+class SpaceSavingCounter(object):
+    """
+    Counter of the most frequent items in the stream, which keeps at most
+    ``capacity`` items (the "space-saving" algorithm by Metwally et al.)
+
+    When a new item comes and the counter is full, the item with the
+    smallest count is replaced, and the new item inherits its count. Thus
+    any item, occurring more than ``total / capacity`` times, is never
+    lost, and counts are never underestimated. Overestimation of every item
+    is recorded in :attr:`errors`. Every operation takes constant time.
+
+    .. code-block:: python
+
+        >>> counter = SpaceSavingCounter(capacity=2)
+        >>> for item in 'aabbbc':
+        ...     counter.add(item)
+        >>> counter.most_common()
+        [('b', 3), ('c', 3)]
+        >>> counter.errors['c']
+        2
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # items, grouped by their counts
+        self.buckets = {}
+        self.min_count = 0
+
+    def add(self, item):
+        count = self.counts.get(item)
+        if count is not None:
+            self._discard(item, count)
+        elif len(self.counts) < self.capacity:
+            count = 0
+            self.errors[item] = 0
+        else:
+            count = self.min_count
+            victim = next(iter(self.buckets[count]))
+            self._discard(victim, count)
+            del self.counts[victim]
+            del self.errors[victim]
+            self.errors[item] = count
+        self.counts[item] = count + 1
+        self.buckets.setdefault(count + 1, set()).add(item)
+        if count == 0:
+            self.min_count = 1
+        elif count == self.min_count and count not in self.buckets:
+            self.min_count = count + 1
+
+    def _discard(self, item, count):
+        bucket = self.buckets[count]
+        bucket.discard(item)
+        if not bucket:
+            del self.buckets[count]
+
+    def most_common(self, top=None):
+        """
+        Return the list of ``(item, count)`` tuples for items with the
+        largest counts
+        """
+        items = sorted(self.counts.items(), key=lambda item: -item[1])
+        return items if top is None else items[:top]
+
+
+class KeyspaceStats(object):
+    """
+    Statistics of objects of one model, gathered by :func:`collect_stats`
+
+    :param name: name of the model
+    :param owner_attrs: names of attributes to count objects by
+    :param max_owners: maximum number of distinct owners tracked for every
+                       attribute (see :class:`SpaceSavingCounter`)
+    """
+
+    def __init__(self, name, owner_attrs=(), max_owners=1000):
+        self.name = name
+        self.count = 0
+        self.sizes = []
+        self.ttls = dict((label, 0) for label in TTL_BUCKET_LABELS)
+        self.owners = dict((attr, SpaceSavingCounter(max_owners))
+                           for attr in owner_attrs)
+
+    def add(self, ttl, size=None, obj=None):
+        """
+        Take into account one object
+
+        :param ttl: remaining time to live of the object in seconds, or None
+                    if the object never expires
+        :param size: memory usage of the object in bytes, if it's sampled
+        :param obj: the object itself, if objects are counted by owners
+        """
+        self.count += 1
+        self.ttls[ttl_bucket(ttl)] += 1
+        if size is not None:
+            self.sizes.append(size)
+        if obj is not None:
+            for attr, counts in self.owners.items():
+                owner = obj.attrs.get(attr)
+                if owner is not None:
+                    counts.add(owner)
+
+    def average_size(self):
+        """
+        Return average size of sampled objects in bytes (or None)
+        """
+        if not self.sizes:
+            return None
+        return float(sum(self.sizes)) / len(self.sizes)
+
+    def percentile_size(self, percent):
+        """
+        Return the given percentile of sizes of sampled objects (or None)
+        """
+        if not self.sizes:
+            return None
+        sizes = sorted(self.sizes)
+        index = int(round(percent / 100.0 * len(sizes))) - 1
+        return sizes[min(max(index, 0), len(sizes) - 1)]
+
+    def estimated_memory(self):
+        """
+        Return estimated memory usage of all objects in bytes (or None)
+        """
+        average = self.average_size()
+        if average is None:
+            return None
+        return int(average * self.count)
+
+    def top_owners(self, attr, top=10):
+        """
+        Return the list of ``(owner, count)`` tuples for owners with the
+        largest number of objects
+        """
+        if attr not in self.owners:
+            return []
+        return self.owners[attr].most_common(top)
+
+    def to_dict(self, top=10):
+        """
+        Return statistics as a JSON-serializable dict
+        """
+        return {
+            'model': self.name,
+            'count': self.count,
+            'sampled': len(self.sizes),
+            'size': {
+                'avg': self.average_size(),
+                'p50': self.percentile_size(50),
+                'p90': self.percentile_size(90),
+                'p99': self.percentile_size(99),
+                'max': max(self.sizes) if self.sizes else None,
+            },
+            'estimated_memory': self.estimated_memory(),
+            'ttl': self.ttls,
+            'owners': dict((attr, self.top_owners(attr, top))
+                           for attr in self.owners),
+        }
+
+
+def ttl_bucket(ttl):
+    """
+    Return the label of TTL distribution bucket for the TTL in seconds
+    """
+    if ttl is None:
+        return 'eternal'
+    for limit, label in TTL_BUCKETS:
+        if ttl < limit:
+            return label
+    return '>=30d'
+
+
+def collect_stats(model_class, owner_attrs=(), batch_size=1000,
+                  sample_every=100, max_owners=1000):
+    """
+    Gather statistics of all objects of the model
+
+    :param model_class: model class (Client, Code, AccessToken, etc)
+    :param owner_attrs: names of attributes to count objects by (for
+                        example, ``('client_id', 'user_id')`` for access
+                        tokens). If set, all objects are fetched from the
+                        database.
+    :param batch_size: number of keys, inspected with one pipelined round
+                       trip
+    :param sample_every: memory usage is queried for every n-th key
+    :param max_owners: maximum number of distinct owners tracked for every
+                       attribute. The memory used by the statistics doesn't
+                       depend on the number of objects.
+    :rtype: KeyspaceStats
+    """
+    stats = KeyspaceStats(model_class.__name__, owner_attrs, max_owners)
+    redis_client = get_redis()
+    seen = 0
+    for ids in chunks(scan_ids(model_class, count=batch_size), batch_size):
+        pipe = redis_client.pipeline(transaction=False)
+        sampled = []
+        for _id in ids:
+            key = object_key(model_class, _id)
+            pipe.ttl(key)
+            is_sampled = seen % sample_every == 0
+            if is_sampled:
+                pipe.memory_usage(key)
+            if owner_attrs:
+                pipe.get(key)
+            sampled.append(is_sampled)
+            seen += 1
+        values = iter(pipe.execute())
+        for _id, is_sampled in zip(ids, sampled):
+            ttl = next(values)
+            size = next(values) if is_sampled else None
+            obj = None
+            if owner_attrs:
+                obj = load_object(model_class, _id, next(values))
+            if ttl == -2 or (owner_attrs and obj is None):
+                continue  # expired in the meantime
+            stats.add(ttl if ttl >= 0 else None, size, obj)
+    return stats
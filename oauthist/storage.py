@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Low-level access to objects stored by ormist.
+
+ormist performs a separate Redis query for every object it reads. Functions
+of this module read ormist objects directly from Redis, making it possible
+to fetch several objects (possibly of different models) with one pipelined
+round trip.
+
+Only read operations and updates and deletions of untagged objects are
+performed here. Tagged objects are saved by ormist, as it maintains tag
+indexes for them. Access tokens are the exception: they are saved by
+:meth:`oauthist.AccessToken.save` without tag indexes.
+
+Objects written by oauthist (access tokens, refresh tokens and authorization
+codes) are serialized with ``object_serializer`` (see
+:func:`oauthist.configure`), if it's set up, and pickled otherwise. Values
+written by the serializer start with the zero byte, which never starts a
+pickle, so both formats are read transparently, and the serializer can be
+turned on for the existing database. Clients are always saved by ormist, and
+therefore pickled.
+"""
+import json
+import pickle
+import ormist
+from oauthist.core import framework, get_redis, get_read_redis, LuaScript
+from oauthist.compat import u
+from oauthist.errors import OauthistRuntimeError
+from oauthist.utils import chunks, expire_timeout
+from oauthist.instrumentation import timed, incr
+
+
+def object_key(model_class, _id):
+    """
+    Return the name of the Redis key, which ormist uses to store the object
+    """
+    return model_class.objects.get_key(_id)
+
+
+#: the first byte of values, written by ``object_serializer``
+SERIALIZER_MARKER = b'\x00'
+
+#: names of attributes, which :class:`CompactSerializer` stores as numbers
+INTERNED_ATTRS = ('client_id', 'scope', 'user_id', 'username', 'redirect_uri',
+                  'state', 'accepted', 'family_id')
+
+
+class CompactSerializer(object):
+    """
+    Serializer of object attributes, which takes less memory than pickle
+
+    Attributes are stored as a flat JSON list of names and values. Names of
+    well-known attributes are replaced by their positions in
+    ``interned_attrs``.
+
+    .. code-block:: python
+
+        >>> oauthist.configure(object_serializer=CompactSerializer())
+
+    Values of attributes must be JSON-serializable. Strings are restored as
+    unicode strings, and tuples as lists.
+
+    The list of interned attributes can be extended by appending new names,
+    but existing names must never be removed or reordered, as their
+    positions are stored in the database.
+
+    Any object with the same ``dumps(attrs)`` and ``loads(value)`` methods
+    (for example, a msgpack-based one) can be used as ``object_serializer``
+    instead.
+    """
+
+    def __init__(self, interned_attrs=INTERNED_ATTRS):
+        self.names = tuple(interned_attrs)
+        self.positions = dict((name, i) for i, name in enumerate(self.names))
+
+    def dumps(self, attrs):
+        items = []
+        for name, value in attrs.items():
+            items.append(self.positions.get(name, name))
+            items.append(value)
+        return json.dumps(items, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, value):
+        items = json.loads(value.decode('utf-8'))
+        attrs = {}
+        for i in range(0, len(items), 2):
+            name = items[i]
+            if isinstance(name, int):
+                name = self.names[name]
+            attrs[name] = items[i + 1]
+        return attrs
+
+
+def dump_attrs(attrs):
+    """
+    Serialize attributes with ``object_serializer``, or pickle them, as
+    ormist does, if the serializer isn't set up
+    """
+    if framework.object_serializer is None:
+        return pickle.dumps(attrs)
+    return SERIALIZER_MARKER + framework.object_serializer.dumps(attrs)
+
+
+def load_attrs(value):
+    """
+    Restore attributes, serialized by :func:`dump_attrs` or by ormist
+    """
+    if value[:1] != SERIALIZER_MARKER:
+        return pickle.loads(value)
+    if framework.object_serializer is None:
+        raise OauthistRuntimeError('Object is stored with object_serializer, '
+                                   'which is not set up')
+    return framework.object_serializer.loads(value[1:])
+
+
+def load_object(model_class, _id, value):
+    """
+    Restore object from the raw value, as it's stored by ormist or by
+    oauthist
+
+    :return: model instance or None, if value is None
+    """
+    if value is None:
+        return None
+    return model_class(_id, **load_attrs(value))
+
+
+def get_object(model_class, _id):
+    """
+    Fetch the object
+
+    :return: model instance or None
+    """
+    if not _id:
+        return None
+    with timed('%s.get' % model_class.__name__):
+        incr('redis.commands')
+        value = get_redis().get(object_key(model_class, _id))
+        return load_object(model_class, _id, value)
+
+
+def get_objects(*pairs, **kwargs):
+    """
+    Fetch several objects with one round trip
+
+    .. code-block:: python
+
+        >>> client, code = get_objects((Client, client_id), (Code, code_id))
+
+    :param pairs: list of ``(model_class, object_id)`` tuples. Object id can be
+                  None, then the object is not fetched.
+    :param redis_client: Redis client to read objects from (by default, the
+                         client of the ormist system)
+    :return: list of model instances (or Nones for missing objects) in the
+             same order as pairs
+    """
+    redis_client = kwargs.get('redis_client') or get_redis()
+    with timed('storage.get_objects'):
+        pipe = redis_client.pipeline(transaction=False)
+        queue_objects(pipe, pairs)
+        incr('redis.commands', len(pipe))
+        return parse_objects(pairs, pipe.execute())
+
+
+def queue_objects(pipe, pairs):
+    """
+    Add queries, fetching objects, to the pipeline. Used by
+    :func:`get_objects`.
+    """
+    for model_class, _id in pairs:
+        if _id:
+            pipe.get(object_key(model_class, _id))
+
+
+def parse_objects(pairs, values):
+    """
+    Restore objects from values, returned by the pipeline, filled in with
+    :func:`queue_objects`.
+    """
+    values = iter(values)
+    ret = []
+    for model_class, _id in pairs:
+        if _id:
+            ret.append(load_object(model_class, _id, next(values)))
+        else:
+            ret.append(None)
+    return ret
+
+
+def get_objects_with_ttl(model_class, ids, redis_client=None):
+    """
+    Fetch several objects of the same model along with their TTLs with one
+    round trip
+
+    :param ids: list of object ids
+    :param redis_client: Redis client to read objects from (by default, the
+                         client of the ormist system)
+    :return: list of ``(object, ttl)`` tuples in the same order as ids. If
+             object is not found, the tuple is ``(None, None)``. If object
+             never expires, ttl is None.
+    """
+    if not ids:
+        return []
+    redis_client = redis_client or get_redis()
+    with timed('storage.get_objects_with_ttl'):
+        pipe = redis_client.pipeline(transaction=False)
+        queue_objects_with_ttl(pipe, model_class, ids)
+        incr('redis.commands', len(pipe))
+        return parse_objects_with_ttl(model_class, ids, pipe.execute())
+
+
+def queue_objects_with_ttl(pipe, model_class, ids):
+    """
+    Add queries, fetching objects and their TTLs, to the pipeline. Used by
+    :func:`get_objects_with_ttl`.
+    """
+    for _id in ids:
+        key = object_key(model_class, _id)
+        pipe.get(key)
+        pipe.ttl(key)
+
+
+def parse_objects_with_ttl(model_class, ids, values):
+    """
+    Restore objects and their TTLs from values, returned by the pipeline,
+    filled in with :func:`queue_objects_with_ttl`.
+    """
+    ret = []
+    for i, _id in enumerate(ids):
+        value, ttl = values[2 * i], values[2 * i + 1]
+        if ttl is not None and ttl < 0:
+            ttl = None
+        ret.append((load_object(model_class, _id, value), ttl))
+    return ret
+
+
+def read_object(model_class, _id):
+    """
+    Fetch the object from one of ``read_systems`` (see
+    :func:`oauthist.configure`), falling back to the ormist system, if the
+    object is not found there
+
+    :return: model instance or None
+    """
+    if not framework.read_systems or not _id:
+        return get_object(model_class, _id)
+    obj, = get_objects((model_class, _id), redis_client=get_read_redis())
+    if obj is None:
+        obj = get_object(model_class, _id)
+    return obj
+
+
+def read_objects_with_ttl(model_class, ids):
+    """
+    Fetch several objects with their TTLs from one of ``read_systems`` (see
+    :func:`oauthist.configure`), falling back to the ormist system for
+    objects which are not found there
+
+    :return: list of ``(object, ttl)`` tuples, as
+             :func:`get_objects_with_ttl` does
+    """
+    if not framework.read_systems:
+        return get_objects_with_ttl(model_class, ids)
+    results = get_objects_with_ttl(model_class, ids,
+                                   redis_client=get_read_redis())
+    missing = [i for i, (obj, _) in enumerate(results) if obj is None]
+    if missing:
+        fallback = get_objects_with_ttl(model_class,
+                                        [ids[i] for i in missing])
+        for i, result in zip(missing, fallback):
+            results[i] = result
+    return results
+
+
+def scan_ids(model_class, count=1000, unique=False):
+    """
+    Iterate over ids of all objects of the model
+
+    Uses SCAN command, so the database isn't blocked, and memory consumption
+    doesn't depend on the number of objects. As with any SCAN-based
+    iteration, objects added or removed during the iteration may be missed,
+    and the same id can be returned more than once (for example, if the
+    hash table is resized during the iteration).
+
+    :param count: hint for the number of keys, returned by every SCAN call
+    :param unique: if True, ids returned before are skipped. All ids are
+                   kept in memory then, so it's meant for models with a
+                   moderate number of objects, such as clients.
+    """
+    prefix = object_key(model_class, '')
+    seen = set()
+    for key in get_redis().scan_iter(match=prefix + '*', count=count):
+        _id = u(key)[len(prefix):]
+        # skip auxiliary keys (such as tag indexes), sharing the same prefix
+        if not _id or ':' in _id:
+            continue
+        if unique:
+            if _id in seen:
+                continue
+            seen.add(_id)
+        yield _id
+
+
+def iter_objects(model_class, batch_size=1000, unique=False):
+    """
+    Iterate over all objects of the model
+
+    Ids are scanned with :func:`scan_ids`, and objects are fetched in
+    pipelined batches of ``batch_size`` objects.
+
+    :param unique: if True, every object is returned once (see
+                   :func:`scan_ids`)
+    """
+    ids = scan_ids(model_class, count=batch_size, unique=unique)
+    for ids in chunks(ids, batch_size):
+        for obj in get_objects(*[(model_class, _id) for _id in ids]):
+            if obj is not None:
+                yield obj
+
+
+def claim_object(model_class, _id):
+    """
+    Atomically delete the object and return True, if it was deleted by this
+    call.
+
+    When several processes try to claim the same object concurrently (for
+    example, to exchange the same authorization code for access tokens), it's
+    guaranteed that only one of them succeeds.
+
+    Must not be used for tagged models, as it doesn't update tag indexes.
+    """
+    with timed('storage.claim_object'):
+        incr('redis.commands')
+        return bool(get_redis().delete(object_key(model_class, _id)))
+
+
+# Overwrite the value of the key, keeping its TTL. Does nothing and returns 0,
+# if the key doesn't exist (has expired or has been deleted).
+UPDATE_SCRIPT = LuaScript("""
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl == -2 then
+    return 0
+end
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return 1
+""")
+
+
+def dump_object(obj):
+    """
+    Serialize object attributes (see :func:`dump_attrs`)
+    """
+    return dump_attrs(obj.attrs)
+
+
+def assign_id(obj):
+    """
+    Assign the random id to the new object, the same way ormist does
+    """
+    if not obj._id:
+        obj._id = ormist.random_string(obj.id_length)
+
+
+def save_object(obj, expire=None):
+    """
+    Save the object, assigning the id to the new one
+
+    Unlike ``obj.save()``, attributes are serialized with
+    ``object_serializer``, if it's set up.
+
+    Must not be used for tagged models, as it doesn't update tag indexes.
+
+    :param expire: expiration timeout: integer (seconds since now), timedelta
+                   or absolute datetime (by default the object never
+                   expires)
+    """
+    with timed('storage.save_object'):
+        assign_id(obj)
+        incr('redis.commands')
+        get_redis().set(object_key(type(obj), obj.id), dump_object(obj),
+                        ex=expire_timeout(expire))
+        return obj
+
+
+def update_object(obj):
+    """
+    Atomically overwrite attributes of the existing object, preserving its
+    remaining time to live, and return True, if the object has been updated.
+
+    Unlike ``obj.save()``, the object is never re-created, if it has expired
+    or has been deleted concurrently, and its expiration time is never reset.
+
+    Must not be used for tagged models, as it doesn't update tag indexes.
+    """
+    with timed('storage.update_object'):
+        incr('redis.commands')
+        key = object_key(type(obj), obj.id)
+        return bool(UPDATE_SCRIPT(get_redis(), keys=[key],
+                                  args=[dump_object(obj)]))
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 import re
-from oauthist.compat import urlparse, urlencode, parse_qsl, urlunparse
-from oauthist.errors import OauthistValidationError
+import hmac
+import json
+import time
+import base64
+import bisect
+import hashlib
+import datetime
+from oauthist.compat import (urlparse, urlencode, parse_qsl, urlunparse,
+                             compare_digest, text, b, u)
+from oauthist.errors import OauthistValidationError, OauthistRuntimeError
 
 def add_arguments(url, args):
     """
@@ -31,16 +39,183 @@ def add_fragment(url, args):
     return urlunparse(chunks)
 
 
+URL_REGEX = re.compile(
+    r'^https?://' # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
+    r'localhost|' #localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
+    r'(?::\d+)?' # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
 def check_url(url):
     """
     Validate string for URL
     """
-    regex = re.compile(
-        r'^https?://' # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
-        r'localhost|' #localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
-        r'(?::\d+)?' # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    if not regex.match(url):
+    if not URL_REGEX.match(url):
         raise OauthistValidationError('%r is invalid URL' % url)
+
+
+def normalize_url(url):
+    """
+    Normalize URL, so that equivalent URLs could be compared as strings
+
+    Scheme and host name are converted to lower case, default port is
+    removed, empty path is replaced with "/", and the fragment is dropped.
+
+    .. code-block:: python
+
+       >>> normalize_url('HTTP://Example.com:80?foo=bar#baz')
+       'http://example.com/?foo=bar'
+    """
+    chunks = list(urlparse(url))
+    chunks[0] = chunks[0].lower()
+    netloc = chunks[1].lower()
+    default_port = DEFAULT_PORTS.get(chunks[0])
+    if default_port and netloc.endswith(':' + default_port):
+        netloc = netloc[:-len(default_port) - 1]
+    chunks[1] = netloc
+    chunks[2] = chunks[2] or '/'
+    chunks[5] = ''
+    return urlunparse(chunks)
+
+
+def chunks(iterable, size):
+    """
+    Split iterable to lists of ``size`` items (the last one can be shorter)
+
+    .. code-block:: python
+
+       >>> list(chunks(range(5), 2))
+       [[0, 1], [2, 3], [4]]
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def expire_timestamp(expire):
+    """
+    Convert expiration timeout to absolute unix timestamp
+
+    :param expire: integer (seconds since now), timedelta, absolute datetime
+                   or None
+    :return: integer timestamp or None, if expire is None
+    """
+    if expire is None:
+        return None
+    if isinstance(expire, datetime.datetime):
+        return int(time.mktime(expire.timetuple()))
+    if isinstance(expire, datetime.timedelta):
+        expire = expire.days * 86400 + expire.seconds
+    return int(time.time()) + int(expire)
+
+
+def expire_timeout(expire):
+    """
+    Convert expiration timeout to the number of seconds since now, suitable
+    for Redis EX option
+
+    :param expire: integer (seconds since now), timedelta, absolute datetime
+                   or None
+    :return: positive integer or None, if expire is None
+    """
+    expire_at = expire_timestamp(expire)
+    if expire_at is None:
+        return None
+    return max(expire_at - int(time.time()), 1)
+
+
+class HashRing(object):
+    """
+    Consistent hashing ring, mapping keys to nodes
+
+    When a node is added to or removed from the ring, only about
+    ``1 / len(nodes)`` of keys move to other nodes.
+
+    .. code-block:: python
+
+       >>> ring = HashRing(['shard1', 'shard2', 'shard3'])
+       >>> ring.get_node('foo')
+       'shard2'
+
+    :param nodes: list of node names
+    :param replicas: number of points of every node on the ring
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise OauthistRuntimeError('HashRing requires at least one node')
+        points = sorted((_hash('%s:%s' % (node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key):
+        """
+        Return the node, the key belongs to
+        """
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+def _hash(value):
+    return int(hashlib.md5(b(value)).hexdigest()[:8], 16)
+
+
+def _b64encode(value):
+    return u(base64.urlsafe_b64encode(value).rstrip(b('=')))
+
+
+def _b64decode(value):
+    value = b(value)
+    return base64.urlsafe_b64decode(value + b('=') * (-len(value) % 4))
+
+
+def _signature(message, secret):
+    if isinstance(secret, text):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, b(message), hashlib.sha256).digest()
+
+
+def sign(payload, secret):
+    """
+    Serialize payload to JSON and sign it with HMAC-SHA256
+
+    :param payload: JSON-serializable dict
+    :param secret: secret key string
+    :return: string "<base64 payload>.<base64 signature>"
+    """
+    content = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    message = _b64encode(content.encode('utf-8'))
+    return '%s.%s' % (message, _b64encode(_signature(message, secret)))
+
+
+def unsign(value, secrets):
+    """
+    Check the signature of the string, created by :func:`sign`, and return
+    the payload
+
+    :param value: signed string
+    :param secrets: list of secret keys, any of them is accepted
+    :return: payload dict
+    :raise: OauthistValidationError if the string is malformed, or the
+            signature doesn't match
+    """
+    message, _, signature = value.partition('.')
+    try:
+        signature = _b64decode(signature)
+        for secret in secrets:
+            if compare_digest(_signature(message, secret), signature):
+                return json.loads(_b64decode(message).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        pass
+    raise OauthistValidationError('invalid signature')
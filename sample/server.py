@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import json
 from flask import Flask, render_template, request, redirect, abort, make_response
-from oauthist import (configure, Client, CodeRequest, Code, CodeExchangeRequest,
+from oauthist import (configure, Client, CodeRequest, get_code, CodeExchangeRequest,
                       InvalidAccessToken, ProtectedResourceRequest, AccessTokenError, PasswordExchangeRequest)
 
 app = Flask(__name__)
@@ -74,7 +74,7 @@ def authorize_confirmation():
         abort(400)
     code_id = request.form.get('code')
     resolution = request.form.get('resolution')
-    code = Code.objects.get(code_id)
+    code = get_code(code_id)
     if not code or resolution not in ('accept', 'decline'):
         return render_template('server/authorize_broken.html',
                                error='malformed_request')
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import os
-import sys
 from setuptools import setup
 
 def read(fname):
@@ -9,9 +8,9 @@ def read(fname):
     except IOError:
         return ''
 
-requirements = ['redis', 'ormist>=0.1,==dev']
-if sys.version_info[0] == 2 and sys.version_info[1] < 7:
-    requirements.append('argparse')
+# redis-py 3.5+ (HSET with mapping, ZADD with mapping, MEMORY USAGE)
+# supports Python 2.7 and 3.5+
+requirements = ['redis>=3.5', 'ormist>=0.1,==dev']
 
 setup(
     name = 'oauthist',
@@ -28,6 +27,11 @@ setup(
     scripts = ['bin/oauthist'],
     long_description = read('README.rst'),
     install_requires = requirements,
+    python_requires = '>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*',
+    # oauthist.aio requires Python 3.7+ and redis.asyncio
+    extras_require = {
+        'aio': ['redis>=4.2; python_version >= "3.7"'],
+    },
     # see here for more details on syntax
     # https://groups.google.com/d/msg/python-virtualenv/CwcGLlecT0o/4_JClCuYSjEJ
     # Version must be defined explicitly
@@ -36,8 +40,14 @@ setup(
     ],
     classifiers = [
         'Development Status :: 4 - Beta',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Framework :: AsyncIO',
         'Topic :: Internet',
         'Topic :: Software Development :: Libraries',
         'License :: OSI Approved :: BSD License',
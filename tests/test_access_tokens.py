@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 import pytest
 import oauthist
 from .conftest import (WEB_CALLBACK, setup_module, teardown_function,
@@ -64,3 +65,72 @@ def test_from_werkzeug_more_than_one_way_of_sending_parameter(access_token):
         args={'access_token': access_token.id})
     req = oauthist.ProtectedResourceRequest.from_werkzeug(http_req)
     assert req.access_token is None
+
+
+def test_cached_token_verification(access_token):
+    oauthist.configure(access_token_cache_size=100)
+    try:
+        req = oauthist.ProtectedResourceRequest(access_token.id)
+        assert req.verify_access_token('foo') == access_token
+        # once verified, token is served from the cache
+        assert oauthist.framework.access_token_cache.lookup(access_token.id) == (True, access_token)
+        assert req.verify_access_token('foo') == access_token
+        # revoked token is evicted from the cache
+        access_token.delete()
+        with pytest.raises(oauthist.InvalidAccessToken):
+            req.verify_access_token('foo')
+    finally:
+        setup_module()
+
+
+def test_verify_many(access_token):
+    other_token = AccessToken(scope='spam egg')
+    other_token.save()
+    tokens = [access_token.id, 'foo', other_token.id, access_token.id]
+    results = oauthist.ProtectedResourceRequest.verify_many(tokens, 'foo')
+    assert results[0] == access_token
+    assert isinstance(results[1], oauthist.InvalidAccessToken)
+    assert isinstance(results[2], oauthist.InvalidAccessToken)
+    assert results[3] == access_token
+
+
+def test_compiled_scopes():
+    token = AccessToken(scope='user_ro projects_ro')
+    token.save()
+    req = oauthist.ProtectedResourceRequest(token.id)
+    assert req.verify_access_token(oauthist.compile_scopes('user_ro', 'user_rw')) == token
+    with pytest.raises(oauthist.InvalidAccessToken):
+        req.verify_access_token(oauthist.compile_scopes('user_rw', 'projects_rw'))
+    # unknown scopes are checked too
+    with pytest.raises(oauthist.InvalidAccessToken):
+        req.verify_access_token(oauthist.compile_scopes('foo'))
+
+
+def test_scope_mask():
+    assert oauthist.scope_mask('user_ro user_rw') == 0b11
+    assert oauthist.scope_mask(['projects_rw', 'foo']) == 0b1000
+
+
+def test_expires_in_without_ttl_query(monkeypatch):
+    token = AccessToken(scope='foo')
+    token.set_expire(60)
+    token.save()
+    def ttl(self):
+        raise AssertionError('unexpected TTL query')
+    monkeypatch.setattr(AccessToken, 'ttl', ttl)
+    assert 0 < token.get_json_content()['expires_in'] <= 60
+
+
+def test_error_body():
+    body = oauthist.AccessTokenError('invalid_grant').get_body()
+    assert json.loads(body.decode('utf-8')) == {'error': 'invalid_grant'}
+    # standard error bodies are serialized once
+    assert oauthist.AccessTokenError('invalid_grant').get_body() is body
+
+
+def test_custom_json_encoder():
+    oauthist.configure(json_encoder=lambda content: 'custom')
+    try:
+        assert oauthist.AccessTokenError('invalid_grant').get_body() == b'custom'
+    finally:
+        setup_module()
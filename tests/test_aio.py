@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import pytest
+import oauthist
+from oauthist import aio
+from .conftest import WEB_CALLBACK, setup_module, teardown_function
+
+
+def setup_function(func):
+    aio.setup_redis()
+
+
+def success(username, password):
+    return {'user_id': 1}
+
+
+async def async_success(username, password):
+    return {'user_id': 1}
+
+
+def test_code_flow(web_client):
+    async def flow():
+        req = aio.CodeRequest(client_id=web_client.id,
+                              redirect_uri=WEB_CALLBACK,
+                              state='1234',
+                              scope='user_ro user_rw')
+        assert not await req.is_broken()
+        assert not await req.is_invalid()
+        code = await req.save_code(user_id=1)
+        await aio.accept_code(await aio.get_code(code.id))
+
+        exchange_req = aio.CodeExchangeRequest(
+            code=code.id, client_id=web_client.id,
+            client_secret=web_client.client_secret,
+            redirect_uri=WEB_CALLBACK, state='1234')
+        assert not await exchange_req.is_invalid()
+        token = await exchange_req.exchange_for_token()
+
+        req = aio.ProtectedResourceRequest(token.id)
+        received = await req.verify_access_token('user_ro')
+        assert received.user_id == 1
+        with pytest.raises(oauthist.InvalidAccessToken):
+            await req.verify_access_token('projects_ro')
+    asyncio.run(flow())
+
+
+@pytest.mark.parametrize('verify_requisites', [success, async_success])
+def test_password_flow(web_client, verify_requisites):
+    async def flow():
+        req = aio.PasswordExchangeRequest(username='user1',
+                                          password='password',
+                                          scope='user_ro',
+                                          client_id=web_client.id,
+                                          client_secret=web_client.client_secret,
+                                          verify_requisites=verify_requisites)
+        token = await req.exchange_for_token()
+        results = await aio.ProtectedResourceRequest.verify_many(
+            [token.id, 'foo'], 'user_ro')
+        assert results[0] == token
+        assert isinstance(results[1], oauthist.InvalidAccessToken)
+    asyncio.run(flow())
+
+
+def test_invalid_password_request(web_client):
+    async def flow():
+        req = aio.PasswordExchangeRequest(username='user1',
+                                          password='password',
+                                          client_id=web_client.id,
+                                          client_secret='foo',
+                                          verify_requisites=success)
+        assert await req.is_invalid()
+        assert req.error == 'invalid_client'
+    asyncio.run(flow())
+
+
+def test_bearer_middleware():
+    token = oauthist.AccessToken(scope='user_ro')
+    token.save()
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': []})
+        await send({'type': 'http.response.body',
+                    'body': scope['oauthist.access_token'].id.encode('ascii')})
+
+    async def call(access_token, path='/'):
+        messages = []
+        async def send(message):
+            messages.append(message)
+        headers = [(b'authorization', ('Bearer %s' % access_token).encode('ascii'))]
+        scope = {'type': 'http', 'path': path, 'headers': headers}
+        middleware = aio.BearerMiddleware(app, scopes=['user_ro'],
+                                          routes=[('/projects/', ['projects_ro'])])
+        await middleware(scope, None, send)
+        return messages
+
+    async def flow():
+        messages = await call(token.id)
+        assert messages[0]['status'] == 200
+        assert messages[1]['body'] == token.id.encode('ascii')
+        messages = await call('foo')
+        assert messages[0]['status'] == 401
+        messages = await call(token.id, '/projects/')
+        assert messages[0]['status'] == 403
+    asyncio.run(flow())
+
+
+def test_client_cache(web_client):
+    scopes = ['user_ro', 'user_rw', 'projects_ro', 'projects_rw']
+    oauthist.configure(scopes=scopes, client_cache_size=10)
+    try:
+        async def flow():
+            assert await aio.get_client(web_client.id) == web_client
+            # the cached client is returned without a database query
+            oauthist.get_redis().delete(
+                oauthist.storage.object_key(oauthist.Client, web_client.id))
+            assert await aio.get_client(web_client.id) == web_client
+            assert await aio.get_client('foo') is None
+        asyncio.run(flow())
+    finally:
+        setup_module()
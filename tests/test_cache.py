@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import time
+from oauthist.cache import LRUCache
+
+
+def test_set_lookup():
+    cache = LRUCache(max_size=10)
+    cache.set('foo', 'bar')
+    assert cache.lookup('foo') == (True, 'bar')
+    assert cache.lookup('spam') == (False, None)
+
+
+def test_negative_entries():
+    """
+    None values are stored too, to make negative caching possible
+    """
+    cache = LRUCache(max_size=10)
+    cache.set('foo', None)
+    assert cache.lookup('foo') == (True, None)
+
+
+def test_least_recently_used_evicted():
+    cache = LRUCache(max_size=2)
+    cache.set('foo', 1)
+    cache.set('bar', 2)
+    cache.lookup('foo')
+    cache.set('baz', 3)
+    assert len(cache) == 2
+    assert cache.lookup('bar') == (False, None)
+    assert cache.lookup('foo') == (True, 1)
+
+
+def test_entries_expire(monkeypatch):
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set('foo', 1)
+    cache.set('bar', 2, ttl=10)
+    cache.set('baz', 3, ttl=3600)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 30)
+    assert cache.lookup('foo') == (True, 1)
+    assert cache.lookup('bar') == (False, None)
+    # entry ttl can't exceed cache ttl
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert cache.lookup('baz') == (False, None)
+
+
+def test_delete():
+    cache = LRUCache(max_size=10)
+    cache.set('foo', 1)
+    cache.delete('foo')
+    cache.delete('bar')
+    assert cache.lookup('foo') == (False, None)
@@ -49,3 +49,60 @@ def test_client_attrs_unset(web_client):
     # nothing is stored in the database
     same_client = oauthist.Client.objects.get(web_client.id)
     assert not 'name' in same_client.attrs
+
+
+def test_client_cache(web_client):
+    oauthist.configure(client_cache_size=100, client_cache_staleness=0)
+    try:
+        cache = oauthist.framework.client_cache
+        assert oauthist.get_client(web_client.id) == web_client
+        assert cache.lookup(web_client.id) == (True, web_client)
+        # any change in the registry invalidates the cache
+        web_client.set(name='my web client')
+        web_client.save()
+        assert cache.lookup(web_client.id) == (False, None)
+        assert oauthist.get_client(web_client.id).name == 'my web client'
+        # deleted client is not returned anymore
+        web_client.delete()
+        assert oauthist.get_client(web_client.id) is None
+    finally:
+        setup_module()
+
+
+@pytest.mark.parametrize(('redirect_uri', 'matching', 'is_valid'), [
+    ('HTTP://web.example.com:80/oauth2cb', 'exact', True),
+    ('http://web.example.com/oauth2cb/foo', 'exact', False),
+    ('http://web.example.com/oauth2cb/foo', 'prefix', True),
+    ('http://web.example.com/oauth2cb/../foo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/%2e%2e/foo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/%2E./foo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/foo/%2e', 'prefix', False),
+    ('http://web.example.com/oauth2cb/..\\foo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/foo%5c..%5cbar', 'prefix', False),
+    ('http://web.example.com/oauth2cb/..%2f..%2ffoo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/%252e%252e/foo', 'prefix', False),
+    ('http://web.example.com/oauth2cb/foo%20bar', 'prefix', True),
+    ('http://web.example.com/oauth2cbfoo', 'prefix', False),
+    ('http://web.example.com/oauth2cb#foo', 'exact', False),
+    ('http://web.example.com/oauth2cb#', 'exact', False),
+    ('http://web.example.com/oauth2cb/foo#bar', 'prefix', False),
+    ('http://web.example.com/foo#bar', 'host', False),
+    ('http://web.example.com/foo', 'host', True),
+    ('https://web.example.com/oauth2cb', 'host', False),
+])
+def test_redirect_urls_with_fragment_are_invalid(web_client):
+    web_client.attrs['redirect_urls'] = [WEB_CALLBACK + '#foo']
+    with pytest.raises(OauthistValidationError):
+        web_client.save()
+
+
+def test_check_redirect_uri(web_client, redirect_uri, matching, is_valid):
+    oauthist.configure(redirect_uri_matching=matching)
+    try:
+        if is_valid:
+            assert web_client.check_redirect_uri(redirect_uri) == redirect_uri
+        else:
+            with pytest.raises(OauthistValidationError):
+                web_client.check_redirect_uri(redirect_uri)
+    finally:
+        setup_module()
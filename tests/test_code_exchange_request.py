@@ -94,3 +94,117 @@ def test_parameters_mismatch(web_client, invalid_param):
     exchange_req = oauthist.CodeExchangeRequest()
     with pytest.raises(oauthist.OauthistValidationError):
         exchange_req.exchange_for_token()
+
+
+def test_concurrent_exchange(web_client):
+    """
+    If two requests try to exchange the same code simultaneously, only one
+    of them succeeds
+    """
+    req = oauthist.CodeRequest(client_id=web_client.id,
+                               redirect_uri=WEB_CALLBACK,
+                               state='1234',
+                               scope='user_ro user_rw')
+    code = req.save_code()
+    code.accept()
+
+    params = dict(code=code.id, client_id=web_client.id,
+                  client_secret=web_client.client_secret,
+                  redirect_uri=WEB_CALLBACK, state='1234')
+    # both requests have read the code from the database
+    exchange_req1 = oauthist.CodeExchangeRequest(**params)
+    exchange_req2 = oauthist.CodeExchangeRequest(**params)
+    assert not exchange_req1.is_invalid()
+    assert not exchange_req2.is_invalid()
+    exchange_req1.exchange_for_token()
+    with pytest.raises(OauthistValidationError):
+        exchange_req2.exchange_for_token()
+
+
+
+def test_lost_race_saves_nothing(web_client):
+    """
+    If the code is claimed by a concurrent request, neither access token nor
+    refresh token is saved
+    """
+    oauthist.configure(refresh_tokens=True)
+    try:
+        req = oauthist.CodeRequest(client_id=web_client.id,
+                                   redirect_uri=WEB_CALLBACK,
+                                   state='1234', scope='user_ro')
+        code = req.save_code(user_id=1)
+        code.accept()
+        exchange_req = oauthist.CodeExchangeRequest(
+            code=code.id, client_id=web_client.id,
+            client_secret=web_client.client_secret,
+            redirect_uri=WEB_CALLBACK, state='1234')
+        assert not exchange_req.is_invalid()
+        code.decline()  # the code is gone after validation
+        with pytest.raises(OauthistValidationError):
+            exchange_req.exchange_for_token()
+        assert oauthist.AccessToken.find(user_id=1) == []
+        assert not oauthist.get_redis().exists(
+            oauthist.RefreshToken.index_key('user_id', 1))
+    finally:
+        setup_module()
+
+
+def test_exchange_with_refresh_token(web_client):
+    oauthist.configure(refresh_tokens=True)
+    try:
+        req = oauthist.CodeRequest(client_id=web_client.id,
+                                   redirect_uri=WEB_CALLBACK,
+                                   state='1234', scope='user_ro')
+        code = req.save_code(user_id=1)
+        code.accept()
+        exchange_req = oauthist.CodeExchangeRequest(
+            code=code.id, client_id=web_client.id,
+            client_secret=web_client.client_secret,
+            redirect_uri=WEB_CALLBACK, state='1234')
+        token = exchange_req.exchange_for_token()
+        assert oauthist.get_code(code.id) is None
+        assert [t.id for t in oauthist.AccessToken.find(user_id=1)] == [token.id]
+        refresh_id = token.get_json_content()['refresh_token']
+        assert oauthist.RefreshToken.objects.get(refresh_id) is not None
+    finally:
+        setup_module()
+
+
+def test_code_of_another_client(web_client):
+    """
+    Code, issued to one client, can't be exchanged by another one
+    """
+    req = oauthist.CodeRequest(client_id=web_client.id,
+                               redirect_uri=WEB_CALLBACK,
+                               state='1234',
+                               scope='user_ro user_rw')
+    code = req.save_code()
+    code.accept()
+
+    other_client = oauthist.Client(client_type='web', redirect_urls=[WEB_CALLBACK])
+    other_client.save()
+    exchange_req = oauthist.CodeExchangeRequest(
+        code=code.id, client_id=other_client.id,
+        client_secret=other_client.client_secret, redirect_uri=WEB_CALLBACK,
+        state='1234')
+    assert exchange_req.is_invalid()
+    assert exchange_req.error == 'invalid_grant'
+
+
+def test_invalid_params_no_queries():
+    """
+    Requests with missing parameters are rejected without database queries
+    """
+    counts = []
+    def listener(kind, name, value):
+        if name == 'redis.commands':
+            counts.append(value)
+    oauthist.add_listener(listener)
+    try:
+        exchange_req = oauthist.CodeExchangeRequest(client_id='foo',
+                                                    client_secret='bar')
+        assert exchange_req.is_invalid()
+        assert exchange_req.error == 'invalid_request'
+    finally:
+        oauthist.remove_listener(listener)
+    assert counts == []
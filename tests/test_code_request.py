@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import datetime
 import pytest
 import oauthist
 from .conftest import (WEB_CALLBACK, setup_module, teardown_function,
@@ -126,3 +127,60 @@ def test_is_valid(web_client):
     code = req.save_code(foo='bar')
     assert req.get_redirect() == ('http://web.example.com/oauth2cb?code=%s&'
                                   'state=1234' % code.id)
+
+
+#--- Accept and decline codes
+
+def test_accept_keeps_ttl(web_client):
+    req = oauthist.CodeRequest(client_id=web_client.id,
+                               redirect_uri=WEB_CALLBACK,
+                               state='1234',
+                               scope='user_ro user_rw')
+    code = req.save_code()
+    assert code.accept() == ('http://web.example.com/oauth2cb?code=%s&'
+                             'state=1234' % code.id)
+    stored = oauthist.Code.objects.get(code.id)
+    assert stored.attrs['accepted'] is True
+    assert 0 < stored.ttl() <= 3600
+
+
+@pytest.mark.parametrize('expire', [
+    600,
+    datetime.timedelta(seconds=600),
+    datetime.datetime.now() + datetime.timedelta(seconds=600),
+])
+def test_save_code_expire(web_client, expire):
+    req = oauthist.CodeRequest(client_id=web_client.id,
+                               redirect_uri=WEB_CALLBACK,
+                               scope='user_ro', expire=expire)
+    code = req.save_code()
+    stored = oauthist.get_code(code.id)
+    assert stored.attrs['client_id'] == web_client.id
+    assert 0 < stored.ttl() <= 600
+
+
+def test_get_code_with_serializer(web_client):
+    oauthist.configure(object_serializer=oauthist.CompactSerializer())
+    try:
+        req = oauthist.CodeRequest(client_id=web_client.id,
+                                   redirect_uri=WEB_CALLBACK,
+                                   scope='user_ro')
+        code = req.save_code(user_id=1)
+        stored = oauthist.get_code(code.id)
+        assert stored.attrs['user_id'] == 1
+        assert oauthist.get_code('foo') is None
+    finally:
+        setup_module()
+
+
+def test_accept_deleted_code(web_client):
+    req = oauthist.CodeRequest(client_id=web_client.id,
+                               redirect_uri=WEB_CALLBACK,
+                               state='1234',
+                               scope='user_ro user_rw')
+    code = req.save_code()
+    code.decline()
+    assert code.accept() == ('http://web.example.com/oauth2cb?'
+                             'error=access_denied&state=1234')
+    # the code is not re-created
+    assert oauthist.Code.objects.get(code.id) is None
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import oauthist
+from oauthist import AccessToken
+from .conftest import setup_module, teardown_function
+
+
+def pytest_funcarg__events(request):
+    events = []
+
+    def listener(kind, name, value):
+        events.append((kind, name, value))
+
+    oauthist.add_listener(listener)
+    request.addfinalizer(lambda: oauthist.remove_listener(listener))
+    return events
+
+
+def test_timings_and_counters(events):
+    oauthist.configure(access_token_cache_size=100)
+    try:
+        token = AccessToken(scope='foo')
+        token.save()
+        req = oauthist.ProtectedResourceRequest(token.id)
+        req.verify_access_token('foo')
+        req.verify_access_token('foo')
+    finally:
+        setup_module()
+    names = [(kind, name) for kind, name, _ in events]
+    assert ('timing', 'AccessToken.save') in names
+    assert ('timing', 'AccessToken.get') in names
+    assert names.count(('timing', 'ProtectedResourceRequest.verify_access_token')) == 2
+    assert ('count', 'access_token_cache.miss', 1) in events
+    assert ('count', 'access_token_cache.hit', 1) in events
+    assert ('count', 'redis.commands', 1) in events
+
+
+def test_remove_listener():
+    events = []
+    listener = lambda kind, name, value: events.append(name)
+    oauthist.add_listener(listener)
+    oauthist.remove_listener(listener)
+    oauthist.ProtectedResourceRequest.verify_many(['foo', 'bar'])
+    assert events == []
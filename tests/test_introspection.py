@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import base64
+import pytest
+import oauthist
+from .conftest import (WEB_CALLBACK, setup_module, teardown_function,
+                       fake_werkzeug_request)
+from oauthist import AccessToken, IntrospectionRequest
+from oauthist.introspection import parse_basic_auth
+
+
+def pytest_funcarg__access_token(request):
+    web_client = request.getfuncargvalue('web_client')
+    token = AccessToken(scope='user_ro', client_id=web_client.id, user_id=1,
+                        username='john')
+    token.save()
+    token.set_expire(3600)
+    request.addfinalizer(token.delete)
+    return token
+
+
+def introspect(client, token):
+    return IntrospectionRequest(token=token, client_id=client.id,
+                                client_secret=client.client_secret)
+
+
+def test_active_token(web_client, access_token):
+    content = introspect(web_client, access_token.id).get_json_content()
+    assert content['active'] is True
+    assert content['scope'] == 'user_ro'
+    assert content['client_id'] == web_client.id
+    assert content['username'] == 'john'
+    assert content['sub'] == '1'
+    assert content['exp'] > 0
+
+
+def test_inactive_token(web_client):
+    content = introspect(web_client, 'foo').get_json_content()
+    assert content == {'active': False}
+
+
+def test_invalid_client(web_client, access_token):
+    req = IntrospectionRequest(token=access_token.id, client_id=web_client.id,
+                               client_secret='foo')
+    assert req.is_invalid()
+    assert req.get_error().error == 'invalid_client'
+
+
+def test_missing_token(web_client):
+    req = introspect(web_client, None)
+    assert req.is_invalid()
+    assert req.get_error().error == 'invalid_request'
+
+
+def test_from_werkzeug_basic_auth(web_client, access_token):
+    credentials = '%s:%s' % (web_client.id, web_client.client_secret)
+    authorization = 'Basic %s' % base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+    http_req = fake_werkzeug_request(form={'token': access_token.id},
+                                     headers={'Authorization': authorization})
+    req = IntrospectionRequest.from_werkzeug(http_req)
+    assert not req.is_invalid()
+    assert req.client_id == web_client.id
+
+
+def test_parse_basic_auth():
+    assert parse_basic_auth('Basic Zm9vOmJhcg==') == ('foo', 'bar')
+    assert parse_basic_auth('Basic Zm9v') == (None, None)
+    assert parse_basic_auth('Bearer Zm9vOmJhcg==') == (None, None)
+
+
+def test_cached_introspection(web_client, access_token):
+    oauthist.configure(introspection_cache_size=100)
+    try:
+        body, etag = introspect(web_client, access_token.id).get_response_body()
+        found, entry = oauthist.framework.introspection_cache.lookup(access_token.id)
+        assert found and entry[1:] == (body, etag)
+        assert introspect(web_client, access_token.id).get_response_body() == (body, etag)
+        # revoked token is evicted from the cache
+        access_token.delete()
+        content = introspect(web_client, access_token.id).get_json_content()
+        assert content == {'active': False}
+    finally:
+        setup_module()
+
+
+def test_client_is_checked_once(monkeypatch, web_client, access_token):
+    calls = []
+    def get_client(client_id):
+        calls.append(client_id)
+        return web_client
+    monkeypatch.setattr(oauthist.introspection, 'get_client', get_client)
+    req = introspect(web_client, access_token.id)
+    assert not req.is_invalid()
+    assert req.get_json_content()['active'] is True
+    assert calls == [web_client.id]
+
+
+def test_invalid_request_is_not_served(web_client, access_token):
+    req = IntrospectionRequest(token=access_token.id, client_id=web_client.id,
+                               client_secret='foo')
+    assert req.is_invalid()
+    with pytest.raises(oauthist.OauthistValidationError):
+        req.get_response_body()
+
+
+def test_non_ascii_username(web_client):
+    token = AccessToken(scope='user_ro', client_id=web_client.id, user_id=2,
+                        username=u'jöhn')
+    token.save()
+    try:
+        content = introspect(web_client, token.id).get_json_content()
+        assert content['username'] == u'jöhn'
+    finally:
+        token.delete()
+
+
+def test_invalid_client_status(web_client, access_token):
+    req = IntrospectionRequest(token=access_token.id, client_id=web_client.id,
+                               client_secret='foo')
+    assert req.is_invalid()
+    error = req.get_error()
+    assert error.get_status() == 401
+    assert error.get_headers()['WWW-Authenticate'].startswith('Basic ')
+    req = introspect(web_client, None)
+    assert req.is_invalid()
+    assert req.get_error().get_status() == 400
+    assert 'WWW-Authenticate' not in req.get_error().get_headers()
+
+
+def test_ttl_is_fetched_with_token(monkeypatch, web_client, access_token):
+    def ttl(self):
+        raise AssertionError('extra round trip')
+    monkeypatch.setattr(AccessToken, 'ttl', ttl)
+    content = introspect(web_client, access_token.id).get_json_content()
+    assert content['active'] is True
+    assert content['exp'] > 0
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+import oauthist
+from oauthist import AccessToken, BearerMiddleware
+from oauthist.middleware import get_bearer_token
+from .conftest import setup_module, teardown_function
+
+
+def pytest_funcarg__access_token(request):
+    token = AccessToken(scope='user_ro')
+    token.save()
+    request.addfinalizer(token.delete)
+    return token
+
+
+def app(environ, start_response):
+    start_response('200 OK', [])
+    return [environ.get('oauthist.access_token')]
+
+
+def call(middleware, path, access_token=None):
+    environ = {'PATH_INFO': path}
+    if access_token:
+        environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % access_token
+    response = {}
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    response['body'] = middleware(environ, start_response)[0]
+    return response
+
+
+def pytest_funcarg__middleware(request):
+    return BearerMiddleware(app, scopes=[], routes=[
+        ('/public/', None),
+        ('/projects/', ['projects_ro', 'projects_rw']),
+    ])
+
+
+def test_get_bearer_token():
+    assert get_bearer_token('Bearer foo') == 'foo'
+    assert get_bearer_token('Basic foo') is None
+    assert get_bearer_token('Bearer') is None
+    assert get_bearer_token(None) is None
+
+
+def test_valid_token(middleware, access_token):
+    response = call(middleware, '/user/', access_token.id)
+    assert response['status'] == '200 OK'
+    assert response['body'] == access_token
+
+
+def test_public_route(middleware):
+    response = call(middleware, '/public/foo')
+    assert response['status'] == '200 OK'
+    assert response['body'] is None
+
+
+def test_missing_token(middleware):
+    response = call(middleware, '/user/')
+    assert response['status'] == '401 Unauthorized'
+    assert response['headers']['WWW-Authenticate'] == 'Bearer'
+
+
+def test_invalid_token(middleware):
+    response = call(middleware, '/user/', 'foo')
+    assert response['status'] == '401 Unauthorized'
+    assert response['headers']['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+    assert json.loads(response['body'].decode('utf-8')) == {'error': 'invalid_token'}
+
+
+def test_insufficient_scope(middleware, access_token):
+    response = call(middleware, '/projects/1', access_token.id)
+    assert response['status'] == '403 Forbidden'
+    assert response['headers']['WWW-Authenticate'] == 'Bearer error="insufficient_scope"'
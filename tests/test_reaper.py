@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+import oauthist
+from oauthist.core import get_redis
+from oauthist.storage import object_key
+from oauthist.access_token import LAST_USED_KEY
+from oauthist.reaper import reap, reset_reaper
+from .conftest import WEB_CALLBACK, setup_module, teardown_function
+
+
+def reap_all(**kwargs):
+    reset_reaper()
+    total = {'deleted': 0, 'unindexed': 0}
+    for _ in range(1000):
+        stats = reap(**kwargs)
+        total['deleted'] += stats['deleted']
+        total['unindexed'] += stats['unindexed']
+        if stats['completed']:
+            return total
+    raise AssertionError('The walk has not been completed')
+
+
+def test_tokens_of_deleted_client():
+    client = oauthist.Client(client_type='web', redirect_urls=[WEB_CALLBACK])
+    client.save()
+    token = oauthist.AccessToken(client_id=client.id, user_id=1)
+    token.save()
+    client.delete()
+    assert reap_all(budget=2)['deleted'] == 1
+    assert oauthist.get_access_token(token.id) is None
+    assert not get_redis().smembers(
+        oauthist.AccessToken.index_key('user_id', 1))
+
+
+def test_tokens_of_existing_client(web_client):
+    token = oauthist.AccessToken(client_id=web_client.id, user_id=1)
+    token.save()
+    assert reap_all(budget=2)['deleted'] == 0
+    assert oauthist.get_access_token(token.id) is not None
+
+
+def test_idle_tokens(web_client):
+    oauthist.configure(track_token_usage=True)
+    try:
+        used = oauthist.AccessToken(client_id=web_client.id, user_id=1)
+        used.save()
+        idle = oauthist.AccessToken(client_id=web_client.id, user_id=1)
+        idle.save()
+        # both tokens are 2 hours old, but one of them has just been used
+        last_used = int(time.time()) - 7200
+        get_redis().zadd(LAST_USED_KEY, {used.id: last_used, idle.id: last_used})
+        assert oauthist.get_access_token(used.id) == used
+        assert reap_all(max_idle=3600)['deleted'] == 1
+        assert oauthist.get_access_token(used.id) == used
+        assert oauthist.get_access_token(idle.id) is None
+        assert get_redis().zscore(LAST_USED_KEY, idle.id) is None
+    finally:
+        setup_module()
+
+
+def test_idle_tokens_require_tracking():
+    with pytest.raises(oauthist.OauthistRuntimeError):
+        reap(max_idle=3600)
+
+
+def test_codes_and_refresh_tokens_of_deleted_client():
+    oauthist.configure(refresh_tokens=True)
+    try:
+        client = oauthist.Client(client_type='web', redirect_urls=[WEB_CALLBACK])
+        client.save()
+        code = oauthist.CodeRequest(client_id=client.id,
+                                    redirect_uri=WEB_CALLBACK,
+                                    scope='user_ro').save_code()
+        token = oauthist.AccessToken(client_id=client.id, user_id=1)
+        token.save()
+        refresh_token = oauthist.issue_refresh_token(token)
+        client.delete()
+        assert reap_all(budget=2)['deleted'] == 3
+        assert oauthist.Code.objects.get(code.id) is None
+        assert oauthist.RefreshToken.objects.get(refresh_token.id) is None
+        family_id = refresh_token.attrs['family_id']
+        assert not get_redis().exists(oauthist.RefreshToken.family_key(family_id))
+    finally:
+        setup_module()
+
+
+def test_unrelated_sets_are_not_touched(web_client):
+    key = object_key(oauthist.Client, '%s:foo:bar' % web_client.id)
+    get_redis().sadd(key, 'missing')
+    try:
+        assert reap_all(budget=10)['unindexed'] == 0
+        assert get_redis().sismember(key, 'missing')
+    finally:
+        get_redis().delete(key)
+
+
+def test_orphaned_index_entries(web_client):
+    tokens = [oauthist.AccessToken(client_id=web_client.id, user_id=1)
+              for _ in range(5)]
+    for token in tokens:
+        token.save()
+    # delete tokens without updating indexes, as if they expired
+    for token in tokens[:3]:
+        get_redis().delete(object_key(oauthist.AccessToken, token.id))
+    # ids are removed from indexes by user_id and by client_id
+    assert reap_all(budget=2)['unindexed'] == 6
+    index_key = oauthist.AccessToken.index_key('user_id', 1)
+    assert get_redis().scard(index_key) == 2
+
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import pytest
+import oauthist
+from .conftest import setup_module, teardown_function
+from oauthist import (OauthistValidationError, PasswordExchangeRequest,
+                      RefreshExchangeRequest, RefreshToken)
+
+
+def setup_function(func):
+    oauthist.configure(scopes=['user_ro', 'user_rw'], access_token_timeout=60,
+                       refresh_tokens=True)
+
+
+def success(username, password):
+    return {'user_id': 1, 'name': 'John Doe'}
+
+
+def issue_token(client):
+    req = PasswordExchangeRequest(username='user1', password='password',
+                                  scope='user_ro user_rw',
+                                  client_id=client.id,
+                                  client_secret=client.client_secret,
+                                  verify_requisites=success)
+    return req.exchange_for_token()
+
+
+def refresh(client, refresh_token, scope=None):
+    return RefreshExchangeRequest(refresh_token=refresh_token,
+                                  client_id=client.id,
+                                  client_secret=client.client_secret,
+                                  scope=scope)
+
+
+def test_issue_refresh_token(web_client):
+    token = issue_token(web_client)
+    content = token.get_json_content()
+    refresh_token = RefreshToken.objects.get(content['refresh_token'])
+    assert refresh_token.attrs['user_id'] == 1
+    assert refresh_token.attrs['scope'] == 'user_ro user_rw'
+    assert 0 < refresh_token.ttl() <= 30 * 86400
+    # only essential attributes are stored
+    assert 'name' not in refresh_token.attrs
+    assert token.name == 'John Doe'
+
+
+def test_refresh(web_client):
+    token = issue_token(web_client)
+    refresh_token = token.get_json_content()['refresh_token']
+    new_token = refresh(web_client, refresh_token).exchange_for_token()
+    content = new_token.get_json_content()
+    assert new_token != token
+    assert new_token.user_id == 1
+    assert 0 < content['expires_in'] <= 60
+    # refresh token is rotated
+    assert content['refresh_token'] != refresh_token
+    assert RefreshToken.objects.get(refresh_token) is None
+
+
+def test_refresh_narrow_scope(web_client):
+    token = issue_token(web_client)
+    refresh_token = token.get_json_content()['refresh_token']
+    new_token = refresh(web_client, refresh_token, scope='user_ro').exchange_for_token()
+    assert new_token.scope == 'user_ro'
+    # the new refresh token keeps the original scope
+    new_refresh_token = RefreshToken.objects.get(new_token.get_json_content()['refresh_token'])
+    assert new_refresh_token.attrs['scope'] == 'user_ro user_rw'
+
+
+def test_refresh_wider_scope(web_client):
+    token = issue_token(web_client)
+    req = refresh(web_client, token.get_json_content()['refresh_token'],
+                  scope='user_ro projects_rw')
+    assert req.is_invalid()
+    assert req.error == 'invalid_scope'
+
+
+def test_refresh_another_client(web_client, native_client):
+    token = issue_token(web_client)
+    req = refresh(native_client, token.get_json_content()['refresh_token'])
+    assert req.is_invalid()
+    assert req.error == 'invalid_grant'
+
+
+def test_reuse_revokes_family(web_client):
+    token = issue_token(web_client)
+    stolen = token.get_json_content()['refresh_token']
+    new_token = refresh(web_client, stolen).exchange_for_token()
+    latest = new_token.get_json_content()['refresh_token']
+    # the used token is presented again
+    with pytest.raises(OauthistValidationError):
+        refresh(web_client, stolen).exchange_for_token()
+    # ... and the legitimate client can't use the family anymore
+    with pytest.raises(OauthistValidationError):
+        refresh(web_client, latest).exchange_for_token()
+
+
+def test_revoke_tokens_revokes_refresh_tokens(web_client):
+    token = issue_token(web_client)
+    refresh_token = token.get_json_content()['refresh_token']
+    oauthist.revoke_tokens(user_id=1)
+    assert RefreshToken.objects.get(refresh_token) is None
+
+
+def test_reuse_by_another_client(web_client, native_client):
+    token = issue_token(web_client)
+    used = token.get_json_content()['refresh_token']
+    new_token = refresh(web_client, used).exchange_for_token()
+    latest = new_token.get_json_content()['refresh_token']
+    # the used token is presented by another (or not authenticated) client
+    assert refresh(native_client, used).is_invalid()
+    req = RefreshExchangeRequest(refresh_token=used, client_id=web_client.id,
+                                 client_secret='foo')
+    assert req.is_invalid()
+    assert req.error == 'invalid_client'
+    # ... and the family is not revoked
+    assert not refresh(web_client, latest).is_invalid()
+
+
+def test_revoked_family_is_not_restored(web_client):
+    token = issue_token(web_client)
+    refresh_token = token.get_json_content()['refresh_token']
+    req = refresh(web_client, refresh_token)
+    assert not req.is_invalid()
+    # the family is revoked after the request has been validated
+    family_id = req.refresh_obj.attrs['family_id']
+    oauthist.revoke_refresh_family(family_id)
+    with pytest.raises(OauthistValidationError):
+        req.exchange_for_token()
+    assert not oauthist.get_redis().exists(RefreshToken.family_key(family_id))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import time
+import oauthist
+from oauthist import AccessToken
+from oauthist.revocation import handle_revocation
+from .conftest import setup_module, teardown_function
+
+
+def setup_function(func):
+    oauthist.configure(access_token_cache_size=100,
+                       revocation_channel='oauthist:test_revocations')
+
+
+def pytest_funcarg__access_token(request):
+    token = AccessToken(scope='foo bar baz', client_id='client1')
+    token.save()
+    return token
+
+
+def test_handle_token_revocation(access_token):
+    cache = oauthist.framework.access_token_cache
+    cache.set(access_token.id, access_token)
+    handle_revocation(('token:%s' % access_token.id).encode('latin-1'))
+    assert cache.lookup(access_token.id) == (False, None)
+
+
+def test_handle_client_revocation(access_token):
+    cache = oauthist.framework.access_token_cache
+    cache.set(access_token.id, access_token)
+    handle_revocation('client:client2')
+    assert cache.lookup(access_token.id) == (True, access_token)
+    handle_revocation('client:client1')
+    assert cache.lookup(access_token.id) == (False, None)
+
+
+def test_listener(access_token):
+    cache = oauthist.framework.access_token_cache
+    listener = oauthist.RevocationListener(poll_timeout=0.1)
+    listener.start()
+    try:
+        time.sleep(0.2)  # wait for subscription
+        # the token is deleted "on another node", thus local cache isn't
+        # updated until the message is received
+        cache.set(access_token.id, access_token)
+        oauthist.get_redis().publish('oauthist:test_revocations',
+                                     'token:%s' % access_token.id)
+        time.sleep(0.2)
+        assert cache.lookup(access_token.id) == (False, None)
+    finally:
+        listener.stop()
+        listener.join()
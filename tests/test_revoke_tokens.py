@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import oauthist
+from oauthist import AccessToken, revoke_tokens
+from .conftest import setup_module, teardown_function
+
+
+def issue_tokens():
+    tokens = {}
+    for user_id in (1, 2):
+        for client_id in ('client1', 'client2'):
+            token = AccessToken(scope='foo', user_id=user_id, client_id=client_id)
+            token.save()
+            tokens[user_id, client_id] = token
+    return tokens
+
+
+def exists(token):
+    return AccessToken.objects.get(token.id) is not None
+
+
+def test_revoke_user_tokens():
+    tokens = issue_tokens()
+    assert revoke_tokens(user_id=1) == 2
+    assert not exists(tokens[1, 'client1'])
+    assert not exists(tokens[1, 'client2'])
+    assert exists(tokens[2, 'client1'])
+
+
+def test_revoke_client_tokens():
+    tokens = issue_tokens()
+    assert revoke_tokens(client_id='client1', batch_size=1) == 2
+    assert not exists(tokens[1, 'client1'])
+    assert not exists(tokens[2, 'client1'])
+    assert exists(tokens[1, 'client2'])
+
+
+def test_revoke_user_client_tokens():
+    tokens = issue_tokens()
+    assert revoke_tokens(user_id=2, client_id='client2') == 1
+    assert not exists(tokens[2, 'client2'])
+    assert exists(tokens[2, 'client1'])
+
+
+def test_revoked_tokens_evicted_from_cache():
+    oauthist.configure(access_token_cache_size=100)
+    try:
+        tokens = issue_tokens()
+        token = tokens[1, 'client1']
+        oauthist.ProtectedResourceRequest(token.id).verify_access_token()
+        revoke_tokens(user_id=1)
+        cache = oauthist.framework.access_token_cache
+        assert cache.lookup(token.id) == (False, None)
+    finally:
+        setup_module()
+
+
+def test_index_expires_with_tokens():
+    redis_client = oauthist.get_redis()
+    key = AccessToken.index_key('user_id', 1)
+    short = AccessToken(user_id=1)
+    short.set_expire(60)
+    short.save()
+    assert 0 < redis_client.ttl(key) <= 60
+    # the index lives as long as the longest living token
+    long = AccessToken(user_id=1)
+    long.set_expire(600)
+    long.save()
+    assert 60 < redis_client.ttl(key) <= 600
+    short.set_expire(30)
+    short.save()
+    assert 60 < redis_client.ttl(key) <= 600
+    # ... and never expires, if some tokens never expire
+    AccessToken(user_id=1).save()
+    assert redis_client.ttl(key) == -1
+    assert redis_client.scard(key) == 3
+
+
+def test_find_tokens():
+    tokens = issue_tokens()
+    found = AccessToken.find(user_id=1)
+    assert sorted(token.id for token in found) == sorted(
+        [tokens[1, 'client1'].id, tokens[1, 'client2'].id])
+    found = AccessToken.find(user_id=2, client_id='client1')
+    assert [token.id for token in found] == [tokens[2, 'client1'].id]
+
+
+def test_revoke_tokens_in_batch(monkeypatch):
+    announcements = []
+    monkeypatch.setattr(oauthist.access_token, 'revoke',
+                        lambda kind, object_id: announcements.append((kind, object_id)))
+    tokens = issue_tokens()
+    assert revoke_tokens(user_id=1) == 2
+    # index entries are removed along with tokens, revocation is announced once
+    redis_client = oauthist.get_redis()
+    assert not redis_client.exists(AccessToken.index_key('user_id', 1))
+    assert not redis_client.sismember(AccessToken.index_key('client_id', 'client1'),
+                                      tokens[1, 'client1'].id)
+    assert announcements == [('user', 1)]
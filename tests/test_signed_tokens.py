@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import pytest
+import oauthist
+from .conftest import setup_module, teardown_function, WEB_CALLBACK
+from oauthist import InvalidAccessToken, SignedAccessToken, ProtectedResourceRequest
+
+
+def setup_function(func):
+    oauthist.configure(access_token_secret=['secret', 'old secret'],
+                       signed_token_denylist=True)
+
+
+def success(username, password):
+    return {'user_id': 1}
+
+
+def issue_token(client, scope='user_ro user_rw', expire=None):
+    req = oauthist.PasswordExchangeRequest(username='user1',
+                                           password='password',
+                                           scope=scope,
+                                           client_id=client.id,
+                                           client_secret=client.client_secret,
+                                           expire=expire,
+                                           verify_requisites=success)
+    return req.exchange_for_token()
+
+
+def test_issue_signed_token(web_client):
+    token = issue_token(web_client, expire=3600)
+    assert isinstance(token, SignedAccessToken)
+    content = token.get_json_content()
+    assert content['access_token'] == token.id
+    assert 0 < content['expires_in'] <= 3600
+
+
+def test_verify_signed_token(web_client):
+    token = issue_token(web_client)
+    received = ProtectedResourceRequest(token.id).verify_access_token('user_ro')
+    assert received == token
+    assert received.user_id == 1
+    assert received.client_id == web_client.id
+    with pytest.raises(InvalidAccessToken):
+        ProtectedResourceRequest(token.id).verify_access_token('projects_ro')
+
+
+def test_tampered_signed_token(web_client):
+    token = issue_token(web_client)
+    with pytest.raises(InvalidAccessToken):
+        ProtectedResourceRequest(token.id[:-2]).verify_access_token()
+
+
+def test_expired_signed_token(web_client):
+    token = issue_token(web_client, expire=-1)
+    with pytest.raises(InvalidAccessToken):
+        ProtectedResourceRequest(token.id).verify_access_token()
+
+
+def test_revoke_signed_token(web_client):
+    token = issue_token(web_client)
+    token.delete()
+    with pytest.raises(InvalidAccessToken):
+        ProtectedResourceRequest(token.id).verify_access_token()
+
+
+def test_revoke_without_denylist(web_client):
+    oauthist.configure(access_token_secret='secret')
+    token = issue_token(web_client)
+    with pytest.raises(oauthist.OauthistRuntimeError):
+        token.delete()
+
+
+def test_revoke_signed_token_sharded_denylist(web_client):
+    oauthist.configure(access_token_secret='secret', signed_token_denylist=True,
+                       denylist_systems=['default'])
+    token = issue_token(web_client)
+    assert not token.is_revoked()
+    token.delete()
+    assert token.is_revoked()
+    with pytest.raises(InvalidAccessToken):
+        ProtectedResourceRequest(token.id).verify_access_token()
+
+
+@pytest.mark.parametrize('denylist_systems', [None, ['default']])
+def test_get_access_tokens_checks_denylist(web_client, denylist_systems):
+    oauthist.configure(access_token_secret='secret', signed_token_denylist=True,
+                       denylist_systems=denylist_systems)
+    active, revoked = issue_token(web_client), issue_token(web_client)
+    revoked.delete()
+    found = oauthist.get_access_tokens([active.id, revoked.id, 'unknown'])
+    assert found[active.id] == active
+    assert found[revoked.id] is None
+    assert found['unknown'] is None
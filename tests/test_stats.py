@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import oauthist
+from oauthist.stats import (collect_stats, ttl_bucket, KeyspaceStats,
+                            SpaceSavingCounter)
+from .conftest import setup_module, teardown_function
+
+
+def test_ttl_bucket():
+    assert ttl_bucket(None) == 'eternal'
+    assert ttl_bucket(10) == '<1m'
+    assert ttl_bucket(3599) == '<1h'
+    assert ttl_bucket(86400) == '<7d'
+    assert ttl_bucket(365 * 86400) == '>=30d'
+
+
+def test_size_percentiles():
+    stats = KeyspaceStats('AccessToken')
+    for size in range(1, 101):
+        stats.add(None, size)
+    assert stats.count == 100
+    assert stats.average_size() == 50.5
+    assert stats.percentile_size(50) == 50
+    assert stats.percentile_size(99) == 99
+    assert stats.estimated_memory() == 5050
+
+
+def test_collect_stats(web_client):
+    for user_id in (1, 1, 2):
+        token = oauthist.AccessToken(client_id=web_client.id, user_id=user_id)
+        token.save()
+        token.set_expire(600)
+    oauthist.AccessToken(client_id=web_client.id, user_id=3).save()
+    stats = collect_stats(oauthist.AccessToken,
+                          owner_attrs=('client_id', 'user_id'),
+                          batch_size=2, sample_every=2)
+    assert stats.count == 4
+    assert len(stats.sizes) == 2
+    assert stats.ttls['<1h'] == 3
+    assert stats.ttls['eternal'] == 1
+    assert stats.top_owners('client_id') == [(web_client.id, 4)]
+    assert stats.top_owners('user_id', 1) == [(1, 2)]
+
+
+def test_space_saving_counter():
+    counter = SpaceSavingCounter(capacity=3)
+    for item in 'aaaaabbbbcde':
+        counter.add(item)
+    assert len(counter.counts) == 3
+    # heavy hitters are kept, counts are never underestimated
+    assert counter.most_common(2) == [('a', 5), ('b', 4)]
+    assert counter.counts['e'] == 3
+    assert counter.errors['e'] == 2
+
+
+def test_top_owners_are_bounded():
+    stats = KeyspaceStats('AccessToken', owner_attrs=('user_id', ), max_owners=10)
+    for user_id in range(1000):
+        stats.add(None, obj=oauthist.AccessToken(user_id=user_id))
+        stats.add(None, obj=oauthist.AccessToken(user_id=-1))
+    assert len(stats.owners['user_id'].counts) == 10
+    assert stats.top_owners('user_id', 1)[0][0] == -1
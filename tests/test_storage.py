@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import pickle
+import ormist
+import oauthist
+from oauthist import storage
+from .conftest import WEB_CALLBACK, setup_module, teardown_function
+
+
+def test_get_objects(web_client):
+    client, missing, empty = storage.get_objects((oauthist.Client, web_client.id),
+                                                 (oauthist.Client, 'foo'),
+                                                 (oauthist.Code, None))
+    assert client == web_client
+    assert missing is None
+    assert empty is None
+
+
+def test_iter_objects():
+    clients = []
+    for i in range(5):
+        client = oauthist.Client(client_type='web', redirect_urls=[WEB_CALLBACK])
+        client.save()
+        clients.append(client.id)
+    received = [client.id for client in storage.iter_objects(oauthist.Client, batch_size=2)]
+    assert sorted(received) == sorted(clients)
+    received = [client.id for client in storage.iter_objects(oauthist.Client, batch_size=2,
+                                                             unique=True)]
+    assert sorted(received) == sorted(clients)
+
+
+def test_read_fallback_to_primary(web_client):
+    # empty database pretends to be a replica, which lags behind
+    ormist.setup_redis('replica', 'localhost', 6379, db=15)
+    oauthist.configure(read_systems=['replica'])
+    try:
+        token = oauthist.AccessToken(client_id=web_client.id)
+        token.save()
+        assert oauthist.get_client(web_client.id) == web_client
+        assert oauthist.get_access_token(token.id) == token
+        [(received, ttl)] = storage.read_objects_with_ttl(oauthist.AccessToken, [token.id])
+        assert received == token
+        assert ttl is None
+    finally:
+        setup_module()
+
+
+def test_lua_script_is_reloaded():
+    script = oauthist.LuaScript("return redis.call('INCR', KEYS[1])")
+    key = oauthist.redis_key('test', 'counter')
+    assert script(oauthist.get_redis(), keys=[key]) == 1
+    # the script is sent again, if Redis has lost it
+    oauthist.get_redis().script_flush()
+    assert script(oauthist.get_redis(), keys=[key]) == 2
+    oauthist.get_redis().delete(key)
+
+
+def test_compact_serializer(web_client):
+    old_token = oauthist.AccessToken(client_id=web_client.id, user_id=1)
+    old_token.save()
+    oauthist.configure(object_serializer=oauthist.CompactSerializer())
+    try:
+        token = oauthist.AccessToken(client_id=web_client.id, user_id=2,
+                                     scope='foo', color='red')
+        token.save()
+        value = oauthist.get_redis().get(storage.object_key(oauthist.AccessToken, token.id))
+        assert value.startswith(b'\x00')
+        assert len(value) < len(pickle.dumps(token.attrs))
+        received = storage.get_object(oauthist.AccessToken, token.id)
+        assert received.attrs == token.attrs
+        # objects, pickled before the serializer was set up, are still read
+        received = storage.get_object(oauthist.AccessToken, old_token.id)
+        assert received.attrs == old_token.attrs
+    finally:
+        setup_module()
+
+
+def test_full_cleanup_removes_auxiliary_keys(web_client):
+    oauthist.configure(track_token_usage=True)
+    try:
+        token = oauthist.AccessToken(client_id=web_client.id, user_id=1)
+        token.save()
+        oauthist.get_redis().set(oauthist.redis_key('revoked', 'foo'), '1')
+        oauthist.full_cleanup()
+        keys = list(oauthist.get_redis().scan_iter(match=oauthist.redis_key('*')))
+        assert keys == []
+        assert oauthist.get_access_token(token.id) is None
+    finally:
+        setup_module()
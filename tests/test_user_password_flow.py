@@ -81,3 +81,65 @@ def test_with_public_clients(ua_client):
                                                 verify_requisites=success,
                                                 client_secret_required=False)
     assert not req.is_invalid()
+
+
+def test_token_attrs(web_client):
+    def verify(username, password):
+        return {'user_id': 1, 'email': 'user1@example.com', 'name': 'User 1'}
+    oauthist.configure(scopes=['user_ro'], token_attrs=['email'])
+    try:
+        req = PasswordExchangeRequest.from_werkzeug(http_request(web_client),
+                                                    verify_requisites=verify)
+        access_token = req.exchange_for_token(foo='bar')
+        assert access_token.attrs['user_id'] == 1
+        assert access_token.attrs['email'] == 'user1@example.com'
+        assert access_token.attrs['foo'] == 'bar'
+        assert 'name' not in access_token.attrs
+    finally:
+        setup_module()
+
+
+def test_rate_limit(web_client):
+    calls = []
+    def verify(username, password):
+        calls.append(username)
+        return {'user_id': 1}
+    oauthist.configure(scopes=['user_ro'], rate_limits={'username': (2, 60)})
+    try:
+        for i in range(2):
+            req = PasswordExchangeRequest.from_werkzeug(http_request(web_client),
+                                                        verify_requisites=verify)
+            assert not req.is_invalid()
+        req = PasswordExchangeRequest.from_werkzeug(http_request(web_client),
+                                                    verify_requisites=verify)
+        assert req.is_invalid()
+        assert req.error == 'slow_down'
+        assert req.get_error().get_status() == 429
+        # requisites of rejected requests are not verified
+        assert len(calls) == 2
+        # other users are not affected
+        req = PasswordExchangeRequest.from_werkzeug(http_request(web_client, username='user2'),
+                                                    verify_requisites=verify)
+        assert not req.is_invalid()
+    finally:
+        oauthist.get_redis().delete(oauthist.redis_key('ratelimit', 'username', 'user1'),
+                                    oauthist.redis_key('ratelimit', 'username', 'user2'))
+        setup_module()
+
+
+def test_rate_limit_counts_exchange_once(web_client):
+    oauthist.configure(scopes=['user_ro'], rate_limits={'username': (2, 60)})
+    try:
+        # the documented pattern validates every request twice
+        for i in range(2):
+            req = PasswordExchangeRequest.from_werkzeug(http_request(web_client),
+                                                        verify_requisites=success)
+            assert not req.is_invalid()
+            assert req.exchange_for_token()
+        req = PasswordExchangeRequest.from_werkzeug(http_request(web_client),
+                                                    verify_requisites=success)
+        assert req.is_invalid()
+        assert req.error == 'slow_down'
+    finally:
+        oauthist.get_redis().delete(oauthist.redis_key('ratelimit', 'username', 'user1'))
+        setup_module()
@@ -43,3 +43,55 @@ def test_check_url(url, is_valid):
     else:
         with pytest.raises(OauthistValidationError):
             check_url(url)
+
+
+def test_sign_unsign():
+    value = sign({'scope': 'foo bar', 'user_id': 1}, 'secret')
+    assert unsign(value, ['old secret', 'secret']) == {'scope': 'foo bar', 'user_id': 1}
+
+
+@pytest.mark.parametrize('value', [
+    'foo',
+    'foo.bar',
+    sign({'scope': 'foo'}, 'another secret'),
+    sign({'scope': 'foo'}, 'secret')[:-2],
+])
+def test_unsign_invalid(value):
+    with pytest.raises(OauthistValidationError):
+        unsign(value, ['secret'])
+
+
+@pytest.mark.parametrize(('url', 'expected_result'), [
+    ('HTTP://Example.com/foo.php', 'http://example.com/foo.php'),
+    ('http://example.com:80', 'http://example.com/'),
+    ('https://example.com:443/?1=2#3=4', 'https://example.com/?1=2'),
+    ('http://example.com:8080/', 'http://example.com:8080/'),
+])
+def test_normalize_url(url, expected_result):
+    assert normalize_url(url) == expected_result
+
+
+def test_chunks():
+    assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunks([], 2)) == []
+
+
+def test_hash_ring():
+    ring = HashRing(['shard1', 'shard2', 'shard3'])
+    keys = ['key%s' % i for i in range(1000)]
+    nodes = dict((key, ring.get_node(key)) for key in keys)
+    assert set(nodes.values()) == set(['shard1', 'shard2', 'shard3'])
+    # only keys of the removed node are moved
+    ring = HashRing(['shard1', 'shard2'])
+    for key in keys:
+        if nodes[key] != 'shard3':
+            assert ring.get_node(key) == nodes[key]
+
+
+def test_expire_timeout():
+    assert expire_timeout(None) is None
+    assert expire_timeout(60) == 60
+    assert expire_timeout(datetime.timedelta(minutes=1)) == 60
+    assert 59 <= expire_timeout(datetime.datetime.now() + datetime.timedelta(minutes=1)) <= 60
+    # the moment has passed, but the key must still get a positive TTL
+    assert expire_timeout(-10) == 1